@@ -0,0 +1,872 @@
+import os
+import tracemalloc
+import cv2
+import numpy as np
+from skimage.color import hed_from_rgb
+from skimage.morphology import opening, disk
+from skimage.measure import label, regionprops
+from skimage.feature import peak_local_max
+from skimage.segmentation import watershed
+from scipy import ndimage as ndi
+
+from config import (
+    DISK_SIZE, GAUSSIAN_SIGMA, MIN_DISTANCE, MIN_AREA_H, MIN_AREA_D, MARKER_RADIUS,
+    TISSUE_DETECTION, TISSUE_MAX_SIDE, TISSUE_SATURATION, TISSUE_OPTICAL_DENSITY,
+    TISSUE_MARGIN, TISSUE_MIN_PIXELS, PYRAMID_ANALYSIS, PYRAMID_MARGIN, LOW_MEMORY, MEMORY_BUDGET_MB,
+    LOW_MEMORY_BYTES_PER_PIXEL, PIPELINE_BYTES_PER_PIXEL, TILE_OVERLAP, MIN_TILE_SIZE, THRESHOLD_SAMPLE_PIXELS, NEIGHBOUR_RADIUS,
+    DAB_SCORE_THRESHOLDS, DENSITY_CELL_SIZE
+)
+from pyramid import coarse_level, candidate_mask
+from histogram import channel_histogram
+from labels import save_labels
+from metrics import StageTimer
+from stacks import read_image
+from spatial import spatial_statistics
+from density import DensityMap
+
+
+# Optical density of every 8-bit intensity, computed with the same operations as the
+# per-pixel conversions (rgb2hed for float64, the low memory path for float32)
+OD_LUT = np.maximum(np.arange(256) / 255, 1e-6)
+OD_LUT = np.log(OD_LUT) / np.log(1e-6)
+OD_LUT_32 = np.maximum(np.arange(256, dtype=np.float32) * np.float32(1 / 255), np.float32(1e-6))
+OD_LUT_32 = np.log(OD_LUT_32) * np.float32(1 / np.log(1e-6))
+
+
+def processing_params(params):
+    """
+    Normalize a parameter dictionary, filling in defaults from the config.
+
+    Parameters:
+        params (dict): Raw parameters (e.g. loaded from the parameters file)
+
+    Returns:
+        dict: Parameters converted to the types used by the pipeline
+    """
+    def threshold(name):
+        value = params.get(name)
+        return float(value) if value is not None else None
+
+    return {
+        'h_threshold': threshold('h_threshold'),
+        'd_threshold': threshold('d_threshold'),
+        'disk_size': int(params.get('disk_size', DISK_SIZE)),
+        'gaussian_sigma': float(params.get('gaussian_sigma', GAUSSIAN_SIGMA)),
+        'min_distance': int(params.get('min_distance', MIN_DISTANCE)),
+        'min_area_h': int(params.get('min_area_h', MIN_AREA_H)),
+        'min_area_d': int(params.get('min_area_d', MIN_AREA_D)),
+        'marker_radius': int(params.get('marker_radius', MARKER_RADIUS)),
+        'neighbour_radius': float(params.get('neighbour_radius', NEIGHBOUR_RADIUS)),
+        'dab_thresholds': tuple(float(t) for t in params.get('dab_thresholds', DAB_SCORE_THRESHOLDS)),
+        'density_cell_size': int(params.get('density_cell_size', DENSITY_CELL_SIZE)),
+        'tissue_detection': bool(params.get('tissue_detection', TISSUE_DETECTION)),
+        'pyramid_analysis': bool(params.get('pyramid_analysis', PYRAMID_ANALYSIS)),
+        'low_memory': bool(params.get('low_memory', LOW_MEMORY)),
+        'memory_budget_mb': float(params.get('memory_budget_mb', MEMORY_BUDGET_MB))
+    }
+
+
+def deconvolve(img_bgr, low_memory=False):
+    """
+    Separate the hematoxylin and DAB stains of a BGR image.
+
+    Parameters:
+        img_bgr (numpy.ndarray): Image as returned by cv2.imread
+        low_memory (bool): Compute float32 planes in place and skip the eosin plane
+
+    Returns:
+        tuple: (h_chan, d_chan) stain planes
+    """
+    # Same Beer-Lambert conversion as rgb2hed; 8-bit intensities take only 256 optical
+    # densities, so they are looked up instead of taking a logarithm per pixel
+    rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
+    if not low_memory:
+        hed = cv2.LUT(rgb, OD_LUT) @ hed_from_rgb
+        np.maximum(hed, 0, out=hed)
+        return hed[:, :, 0], hed[:, :, 2]
+
+    # float32 planes, without the float64 copies
+    od = cv2.LUT(rgb, OD_LUT_32)
+    del rgb
+    conv = hed_from_rgb.astype(np.float32)
+    h_chan = od @ conv[:, 0]
+    d_chan = od @ conv[:, 2]
+    del od
+    np.maximum(h_chan, 0, out=h_chan)
+    np.maximum(d_chan, 0, out=d_chan)
+    return h_chan, d_chan
+
+
+def full_region(shape):
+    """
+    Build a region that covers the whole image.
+
+    Parameters:
+        shape (tuple): Image shape
+
+    Returns:
+        tuple: (row slice, column slice, mask) with no mask
+    """
+    return (slice(0, shape[0]), slice(0, shape[1]), None)
+
+
+def rect_region(shape, y0, y1, x0, x1):
+    """
+    Build a rectangular region clipped to the image.
+
+    Parameters:
+        shape (tuple): Image shape
+        y0, y1 (int): First and last+1 row of the rectangle
+        x0, x1 (int): First and last+1 column of the rectangle
+
+    Returns:
+        tuple: (row slice, column slice, mask) with no mask
+    """
+    y0, y1 = sorted((max(0, min(shape[0], int(y0))), max(0, min(shape[0], int(y1)))))
+    x0, x1 = sorted((max(0, min(shape[1], int(x0))), max(0, min(shape[1], int(x1)))))
+    return (slice(y0, y1), slice(x0, x1), None)
+
+
+def tissue_regions(img_bgr, bounds=None):
+    """
+    Detect tissue on a low resolution copy of the image and return the regions to analyze.
+    A pixel counts as tissue when its saturation or optical density exceeds the configured
+    thresholds. Every connected piece of tissue (grown by TISSUE_MARGIN) becomes one region.
+
+    Parameters:
+        img_bgr (numpy.ndarray): Full resolution image as returned by cv2.imread
+        bounds (tuple): Optional (row slice, column slice) to restrict detection to
+
+    Returns:
+        list: Regions as (row slice, column slice, mask) tuples in full resolution coordinates
+    """
+    if bounds is None:
+        bounds = (slice(0, img_bgr.shape[0]), slice(0, img_bgr.shape[1]))
+    area = img_bgr[bounds[0], bounds[1]]
+    h, w = area.shape[:2]
+    if h == 0 or w == 0:
+        return []
+
+    scale = min(1.0, TISSUE_MAX_SIDE / max(h, w))
+    sw, sh = max(1, int(round(w * scale))), max(1, int(round(h * scale)))
+    small = cv2.resize(area, (sw, sh), interpolation=cv2.INTER_AREA) if scale < 1 else area
+
+    saturation = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)[:, :, 1] / 255.0
+    od = -np.log(np.maximum(small, 1) / 255.0).mean(axis=2)
+    tissue = (saturation > TISSUE_SATURATION) | (od > TISSUE_OPTICAL_DENSITY)
+
+    lbl = label(tissue)
+    sizes = np.bincount(lbl.ravel())
+    sizes[0] = 0
+    tissue = (sizes >= TISSUE_MIN_PIXELS)[lbl]
+
+    return mask_regions(tissue, bounds, TISSUE_MARGIN)
+
+
+def mask_regions(small_mask, bounds, margin):
+    """
+    Turn a low resolution mask into full resolution regions.
+    Every connected piece of the mask, grown by the margin, becomes one region. Regions never
+    share pixels, so objects are not counted twice.
+
+    Parameters:
+        small_mask (numpy.ndarray): Boolean mask covering the bounds at low resolution
+        bounds (tuple): (row slice, column slice) of the full resolution area the mask covers
+        margin (int): Full resolution pixels added around every piece of the mask
+
+    Returns:
+        list: Regions as (row slice, column slice, mask) tuples in full resolution coordinates
+    """
+    oy, ox = bounds[0].start, bounds[1].start
+    h, w = bounds[0].stop - oy, bounds[1].stop - ox
+    sh, sw = small_mask.shape
+    if h <= 0 or w <= 0 or not small_mask.any():
+        return []
+
+    fy, fx = h / sh, w / sw
+    grow = max(1, int(np.ceil(margin / min(fy, fx))))
+    small_mask = ndi.binary_dilation(small_mask, iterations=grow)
+
+    lbl = label(small_mask)
+    regions = []
+    for i, sl in enumerate(ndi.find_objects(lbl), start=1):
+        if sl is None:
+            continue
+        y0, y1 = int(np.floor(sl[0].start * fy)), min(h, int(np.ceil(sl[0].stop * fy)))
+        x0, x1 = int(np.floor(sl[1].start * fx)), min(w, int(np.ceil(sl[1].stop * fx)))
+        piece = (lbl[sl] == i).astype(np.uint8)
+        mask = cv2.resize(piece, (x1 - x0, y1 - y0), interpolation=cv2.INTER_NEAREST).astype(bool)
+        regions.append((slice(oy + y0, oy + y1), slice(ox + x0, ox + x1), mask))
+    return regions
+
+
+def region_pixels(regions):
+    """
+    Count the pixels covered by the bounding boxes of a list of regions.
+
+    Parameters:
+        regions (list): Regions as (row slice, column slice, mask) tuples
+
+    Returns:
+        int: Number of pixels the pipeline has to visit
+    """
+    return sum((rs.stop - rs.start) * (cs.stop - cs.start) for rs, cs, _ in regions)
+
+
+def segment(h_chan, d_chan, th_h, th_d, params, mask=None):
+    """
+    Segment blue nuclei and brown spots in a pair of stain planes.
+
+    Parameters:
+        h_chan (numpy.ndarray): Hematoxylin plane
+        d_chan (numpy.ndarray): DAB plane
+        th_h (float): Hematoxylin threshold
+        th_d (float): DAB threshold
+        params (dict): Parameters as returned by processing_params
+        mask (numpy.ndarray): Optional boolean mask of pixels to analyze
+
+    Returns:
+        tuple: (lbl_h, lbl_d, cents_h, cents_d) label images and (row, col) centroids of
+               the objects that pass the area filters
+    """
+    fg_h = h_chan > th_h
+    fg_d = d_chan > th_d
+    if mask is not None:
+        fg_h &= mask
+        fg_d &= mask
+
+    if params['low_memory']:
+        return segment_low_memory(fg_h, fg_d, params)
+
+    mask_h = opening(fg_h, disk(params['disk_size']))
+    mask_d = opening(fg_d, disk(params['disk_size']))
+    dt = ndi.distance_transform_edt(mask_h)
+    sm = ndi.gaussian_filter(dt, sigma=params['gaussian_sigma'])
+    coords = peak_local_max(sm, min_distance=params['min_distance'], labels=mask_h)
+    markers = np.zeros_like(dt, dtype=int)
+    if coords.size:
+        markers[coords[:, 0], coords[:, 1]] = np.arange(1, len(coords) + 1)
+    else:
+        r, c = np.unravel_index(np.argmax(sm), sm.shape)
+        markers[r, c] = 1
+    lbl_h = watershed(-sm, markers, mask=mask_h)
+    lbl_d = label(mask_d)
+    cents_h = [r.centroid for r in regionprops(lbl_h) if r.area > params['min_area_h']]
+    cents_d = [r.centroid for r in regionprops(lbl_d) if r.area > params['min_area_d']]
+    return lbl_h, lbl_d, cents_h, cents_d
+
+
+def segment_low_memory(fg_h, fg_d, params):
+    """
+    Low memory variant of the segmentation steps that follow thresholding.
+    Uses uint8 masks, a distance map smoothed in place and int32 labels, and frees every
+    intermediate as soon as it is no longer needed. Gives the labels and centroids of segment.
+
+    Parameters:
+        fg_h (numpy.ndarray): Thresholded hematoxylin mask
+        fg_d (numpy.ndarray): Thresholded DAB mask
+        params (dict): Parameters as returned by processing_params
+
+    Returns:
+        tuple: (lbl_h, lbl_d, cents_h, cents_d) as returned by segment
+    """
+    footprint = disk(params['disk_size'])
+    mask_h = opening(fg_h, footprint)
+    del fg_h
+    # OpenCV's precise transform is the exact EDT rounded to float32. Squared distances are
+    # integers, so the float64 values of distance_transform_edt are recovered exactly; the
+    # smoothing and watershed then rank pixels, and break ties, as the default pipeline does
+    sm = cv2.distanceTransform(mask_h.view(np.uint8), cv2.DIST_L2, cv2.DIST_MASK_PRECISE).astype(np.float64)
+    np.square(sm, out=sm)
+    np.rint(sm, out=sm)
+    np.sqrt(sm, out=sm)
+    ndi.gaussian_filter(sm, sigma=params['gaussian_sigma'], output=sm)
+    coords = peak_local_max(sm, min_distance=params['min_distance'], labels=mask_h)
+    markers = np.zeros(sm.shape, dtype=np.int32)
+    if coords.size:
+        markers[coords[:, 0], coords[:, 1]] = np.arange(1, len(coords) + 1, dtype=np.int32)
+    else:
+        r, c = np.unravel_index(np.argmax(sm), sm.shape)
+        markers[r, c] = 1
+    del coords
+    np.negative(sm, out=sm)
+    lbl_h = watershed(sm, markers, mask=mask_h).astype(np.int32, copy=False)
+    del sm, markers, mask_h
+
+    mask_d = opening(fg_d, footprint)
+    del fg_d
+    lbl_d, _ = ndi.label(mask_d, structure=np.ones((3, 3), dtype=bool))
+    del mask_d
+
+    cents_h = [r.centroid for r in regionprops(lbl_h) if r.area > params['min_area_h']]
+    cents_d = [r.centroid for r in regionprops(lbl_d) if r.area > params['min_area_d']]
+    return lbl_h, lbl_d, cents_h, cents_d
+
+
+def label_centroids(lbl, chunk_rows=256):
+    """
+    Compute the centroid of every label with bincount reductions.
+    Rows are processed in chunks so the coordinate weights stay small.
+
+    Parameters:
+        lbl (numpy.ndarray): Label image
+        chunk_rows (int): Number of rows reduced at once
+
+    Returns:
+        tuple: (rows, cols) arrays indexed by label (NaN for labels that do not occur)
+    """
+    n = int(lbl.max()) + 1 if lbl.size else 1
+    counts = np.zeros(n)
+    sum_y = np.zeros(n)
+    sum_x = np.zeros(n)
+    cols = np.arange(lbl.shape[1], dtype=np.float64)
+    for y0 in range(0, lbl.shape[0], chunk_rows):
+        chunk = lbl[y0:y0 + chunk_rows]
+        flat = chunk.ravel()
+        rows = np.repeat(np.arange(y0, y0 + chunk.shape[0], dtype=np.float64), chunk.shape[1])
+        counts += np.bincount(flat, minlength=n)
+        sum_y += np.bincount(flat, weights=rows, minlength=n)
+        sum_x += np.bincount(flat, weights=np.tile(cols, chunk.shape[0]), minlength=n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sum_y / counts, sum_x / counts
+
+
+def object_measurements(lbl, h_chan, d_chan, chunk_rows=256):
+    """
+    Measure every labelled object with bincount reductions: area, centroid, mean
+    hematoxylin and DAB intensity and maximum DAB intensity.
+
+    Parameters:
+        lbl (numpy.ndarray): Label image
+        h_chan (numpy.ndarray): Hematoxylin plane of the same shape
+        d_chan (numpy.ndarray): DAB plane of the same shape
+        chunk_rows (int): Number of rows reduced at once
+
+    Returns:
+        dict: 'label', 'area', 'row', 'col', 'mean_h', 'mean_d' and 'max_d' arrays with one
+              entry per object, in label order
+    """
+    n = int(lbl.max()) + 1 if lbl.size else 1
+    area, sum_y, sum_x, sum_h, sum_d = np.zeros((5, n))
+    max_d = np.full(n, -np.inf)
+    index = np.arange(n)
+    cols = np.arange(lbl.shape[1], dtype=np.float64)
+    for y0 in range(0, lbl.shape[0], chunk_rows):
+        chunk = lbl[y0:y0 + chunk_rows]
+        flat = chunk.ravel()
+        d_flat = d_chan[y0:y0 + chunk_rows].ravel()
+        rows = np.repeat(np.arange(y0, y0 + chunk.shape[0], dtype=np.float64), chunk.shape[1])
+        counts = np.bincount(flat, minlength=n)
+        area += counts
+        sum_y += np.bincount(flat, weights=rows, minlength=n)
+        sum_x += np.bincount(flat, weights=np.tile(cols, chunk.shape[0]), minlength=n)
+        sum_h += np.bincount(flat, weights=h_chan[y0:y0 + chunk_rows].ravel(), minlength=n)
+        sum_d += np.bincount(flat, weights=d_flat, minlength=n)
+        # ndi.maximum reports 0 for labels missing from the chunk, so only present labels are merged
+        present = counts > 0
+        max_d[present] = np.maximum(max_d[present], ndi.maximum(d_flat, flat, index)[present])
+
+    present = np.flatnonzero(area[1:]) + 1
+    a = area[present]
+    return {
+        'label': present.astype(np.int32),
+        'area': a.astype(np.int32),
+        'row': sum_y[present] / a,
+        'col': sum_x[present] / a,
+        'mean_h': (sum_h[present] / a).astype(np.float32),
+        'mean_d': (sum_d[present] / a).astype(np.float32),
+        'max_d': max_d[present].astype(np.float32)
+    }
+
+
+def offset_measurements(table, label_offset, row_offset, col_offset):
+    """
+    Move object measurements of a region into full image coordinates.
+
+    Parameters:
+        table (dict): Measurements as returned by object_measurements
+        label_offset (int): Offset added to the labels
+        row_offset, col_offset (int): Position of the region in the image
+
+    Returns:
+        dict: The same table, shifted in place
+    """
+    table['label'] += label_offset
+    table['row'] += row_offset
+    table['col'] += col_offset
+    return table
+
+
+def concat_measurements(tables):
+    """
+    Join object measurement tables.
+
+    Parameters:
+        tables (list): Tables as returned by object_measurements
+
+    Returns:
+        dict: One table with all objects (empty columns if the list is empty)
+    """
+    if not tables:
+        return object_measurements(np.zeros((0, 0), dtype=np.int32), np.zeros((0, 0)), np.zeros((0, 0)))
+    return {key: np.concatenate([t[key] for t in tables]) for key in tables[0]}
+
+
+def segment_regions(planes, shape, th_h, th_d, params, regions, objects=None):
+    """
+    Run the segmentation separately inside each region and merge the results.
+
+    Parameters:
+        planes (callable): Function returning the (h_chan, d_chan) planes of a region
+        shape (tuple): Shape of the full image
+        th_h (float): Hematoxylin threshold
+        th_d (float): DAB threshold
+        params (dict): Parameters as returned by processing_params
+        regions (list): Regions as (row slice, column slice, mask) tuples; tiles carry the
+            (row slice, column slice) of their core as a fourth element, and only objects whose
+            centroid lies in the core are kept
+        objects (dict): Optional {'h': [], 'd': []} receiving object measurement tables
+            (all objects, before the area filters) of every region; only the stains whose
+            key is present are measured
+
+    Returns:
+        tuple: (lbl_h, lbl_d, cents_h, cents_d) in full image coordinates
+    """
+    if len(regions) == 1 and regions[0][2] is None and regions[0][:2] == full_region(shape)[:2]:
+        h_chan, d_chan = planes(regions[0])
+        result = segment(h_chan, d_chan, th_h, th_d, params)
+        if objects is not None:
+            for key, lbl in (('h', result[0]), ('d', result[1])):
+                if key in objects:
+                    objects[key].append(object_measurements(lbl, h_chan, d_chan))
+        return result
+
+    lbl_h = np.zeros(shape, dtype=np.int32)
+    lbl_d = np.zeros(shape, dtype=np.int32)
+    cents_h, cents_d = [], []
+    next_h = next_d = 0
+
+    for region in regions:
+        rs, cs, mask = region[:3]
+        h_part, d_part = planes(region)
+        if h_part.size == 0:
+            continue
+
+        part_h, part_d, part_cents_h, part_cents_d = segment(h_part, d_part, th_h, th_d, params, mask)
+        if len(region) > 3:
+            core_rs, core_cs = region[3]
+            part_h, part_cents_h = keep_core(part_h, part_cents_h, rs, cs, core_rs, core_cs)
+            part_d, part_cents_d = keep_core(part_d, part_cents_d, rs, cs, core_rs, core_cs)
+        if objects is not None:
+            for key, part, offset in (('h', part_h, next_h), ('d', part_d, next_d)):
+                if key in objects:
+                    objects[key].append(offset_measurements(object_measurements(part, h_part, d_part),
+                                                            offset, rs.start, cs.start))
+        del h_part, d_part
+        for full, part, offset in ((lbl_h, part_h, next_h), (lbl_d, part_d, next_d)):
+            fg = part > 0
+            full[rs, cs][fg] = part[fg] + offset
+        next_h += int(part_h.max())
+        next_d += int(part_d.max())
+
+        cents_h.extend((y + rs.start, x + cs.start) for y, x in part_cents_h)
+        cents_d.extend((y + rs.start, x + cs.start) for y, x in part_cents_d)
+
+    return lbl_h, lbl_d, cents_h, cents_d
+
+
+def keep_core(lbl, cents, rs, cs, core_rs, core_cs):
+    """
+    Drop the objects of a tile whose centroid falls outside the tile core.
+
+    Parameters:
+        lbl (numpy.ndarray): Label image of the tile
+        cents (list): (row, col) centroids in tile coordinates
+        rs, cs (slice): Position of the tile in the image
+        core_rs, core_cs (slice): Position of the tile core in the image
+
+    Returns:
+        tuple: (label image, centroids) restricted to the core
+    """
+    def in_core(y, x):
+        return ((core_rs.start <= y + rs.start) & (y + rs.start < core_rs.stop) &
+                (core_cs.start <= x + cs.start) & (x + cs.start < core_cs.stop))
+
+    cy, cx = label_centroids(lbl)
+    keep = in_core(cy, cx)
+    keep[0] = False
+    lbl = np.where(keep[lbl], lbl, 0)
+    return lbl, [(y, x) for y, x in cents if in_core(y, x)]
+
+
+def plan_tiles(img_shape, regions, params):
+    """
+    Split regions into overlapping tiles when they would not fit the memory budget.
+    Only applies in low memory mode.
+
+    Parameters:
+        img_shape (tuple): Shape of the full image
+        regions (list): Regions as (row slice, column slice, mask) tuples
+        params (dict): Parameters as returned by processing_params
+
+    Returns:
+        list: The regions, with oversized ones replaced by tiles carrying their core
+    """
+    if not params['low_memory']:
+        return regions
+
+    # The image and the two full size int32 label images are held for the whole run
+    fixed = img_shape[0] * img_shape[1] * (3 + 8)
+    budget = max(0, params['memory_budget_mb'] * 2 ** 20 - fixed)
+    side = int(np.sqrt(budget / LOW_MEMORY_BYTES_PER_PIXEL)) - 2 * TILE_OVERLAP
+    side = max(MIN_TILE_SIZE, side)
+
+    if all(region_pixels([region]) * LOW_MEMORY_BYTES_PER_PIXEL <= budget for region in regions):
+        return regions
+
+    tiles = []
+    for region in regions:
+        rs, cs, mask = region
+        if region_pixels([region]) * LOW_MEMORY_BYTES_PER_PIXEL <= budget:
+            tiles.append(region)
+            continue
+        for y in range(rs.start, rs.stop, side):
+            for x in range(cs.start, cs.stop, side):
+                core = (slice(y, min(y + side, rs.stop)), slice(x, min(x + side, cs.stop)))
+                ty0, ty1 = max(rs.start, y - TILE_OVERLAP), min(rs.stop, y + side + TILE_OVERLAP)
+                tx0, tx1 = max(cs.start, x - TILE_OVERLAP), min(cs.stop, x + side + TILE_OVERLAP)
+                tile_mask = None
+                if mask is not None:
+                    tile_mask = mask[ty0 - rs.start:ty1 - rs.start, tx0 - cs.start:tx1 - cs.start]
+                    if not tile_mask[y - ty0:core[0].stop - ty0, x - tx0:core[1].stop - tx0].any():
+                        continue
+                tiles.append((slice(ty0, ty1), slice(tx0, tx1), tile_mask, core))
+    return tiles
+
+
+def estimate_memory(image_size, params):
+    """
+    Estimate the peak memory of the pipeline for an image, before reading it.
+
+    Parameters:
+        image_size (tuple): (width, height) of the image
+        params (dict): Parameters as returned by processing_params
+
+    Returns:
+        int: Estimated bytes
+    """
+    pixels = int(image_size[0]) * int(image_size[1])
+    if not params['low_memory']:
+        return pixels * PIPELINE_BYTES_PER_PIXEL
+    # As in plan_tiles: the image and the label images are held whole, tiles fill the rest of the budget
+    fixed = pixels * (3 + 8)
+    budget = max(0, params['memory_budget_mb'] * 2 ** 20 - fixed)
+    tile = (MIN_TILE_SIZE + 2 * TILE_OVERLAP) ** 2 * LOW_MEMORY_BYTES_PER_PIXEL
+    return fixed + min(pixels * LOW_MEMORY_BYTES_PER_PIXEL, max(budget, tile))
+
+
+def estimate_thresholds(img_bgr, regions, params):
+    """
+    Estimate Otsu thresholds from a strided subsample of the regions.
+    Used when the image is tiled and the full planes are never held at once.
+
+    Parameters:
+        img_bgr (numpy.ndarray): Full resolution image
+        regions (list): Regions as (row slice, column slice, mask) tuples
+        params (dict): Parameters as returned by processing_params
+
+    Returns:
+        tuple: (th_h, th_d)
+    """
+    total = max(1, region_pixels(regions))
+    step = max(1, int(np.sqrt(total / THRESHOLD_SAMPLE_PIXELS)))
+    h_parts, d_parts = [], []
+    for rs, cs, mask in regions:
+        h_part, d_part = deconvolve(img_bgr[rs, cs][::step, ::step], params['low_memory'])
+        sub = mask[::step, ::step] if mask is not None else None
+        h_parts.append((h_part, sub))
+        d_parts.append((d_part, sub))
+    return channel_histogram(h_parts).otsu(), channel_histogram(d_parts).otsu()
+
+
+def analysis_regions(img_bgr, params, roi=None, path=None):
+    """
+    Decide which parts of an image the pipeline has to analyze.
+
+    Parameters:
+        img_bgr (numpy.ndarray): Full resolution image
+        params (dict): Parameters as returned by processing_params
+        roi (tuple): Optional (y0, y1, x0, x1) user-selected rectangle
+        path (str): Optional image path, used to read stored pyramid levels
+
+    Returns:
+        list: Regions as (row slice, column slice, mask) tuples
+    """
+    shape = img_bgr.shape[:2]
+    region = rect_region(shape, *roi) if roi is not None else full_region(shape)
+    if params['pyramid_analysis']:
+        coarse = coarse_level(img_bgr, path)
+        candidates = candidate_mask(coarse, params['h_threshold'], params['d_threshold'])
+        rs, cs = region[:2]
+        fy, fx = shape[0] / coarse.shape[0], shape[1] / coarse.shape[1]
+        small = candidates[int(rs.start // fy):int(np.ceil(rs.stop / fy)),
+                           int(cs.start // fx):int(np.ceil(cs.stop / fx))]
+        return mask_regions(small, region[:2], PYRAMID_MARGIN)
+    if params['tissue_detection']:
+        return tissue_regions(img_bgr, bounds=region[:2])
+    return [region]
+
+
+def analyze_image(img_bgr, params, roi=None, path=None, measure_objects=False, timer=None):
+    """
+    Run the full detection pipeline on an image.
+
+    Parameters:
+        img_bgr (numpy.ndarray): Image as returned by cv2.imread
+        params (dict): Parameters as returned by processing_params
+        roi (tuple): Optional (y0, y1, x0, x1) rectangle to restrict the analysis to
+        path (str): Optional path of the image file
+        measure_objects (bool): Also measure every brown spot; nuclei are always measured
+                                (see object_measurements)
+        timer (StageTimer): Optional timer receiving the 'regions', 'deconvolve', 'thresholds'
+                            and 'segment' stages (tiles are deconvolved inside 'segment')
+
+    Returns:
+        dict: Label images, centroids, thresholds used, the fraction of skipped pixels and the
+              'objects_h' nucleus measurements, plus the 'objects_d' table if requested
+    """
+    timer = timer or StageTimer()
+    shape = img_bgr.shape[:2]
+    with timer.stage('regions'):
+        regions = analysis_regions(img_bgr, params, roi, path)
+        tiles = plan_tiles(shape, regions, params)
+    th_h, th_d = params['h_threshold'], params['d_threshold']
+
+    if tiles is not regions:
+        if th_h is None or th_d is None:
+            with timer.stage('thresholds'):
+                est_h, est_d = estimate_thresholds(img_bgr, regions, params)
+            th_h = est_h if th_h is None else th_h
+            th_d = est_d if th_d is None else th_d
+        planes = lambda region: deconvolve(img_bgr[region[0], region[1]], True)
+    else:
+        stored = {}
+        with timer.stage('deconvolve'):
+            for region in regions:
+                stored[id(region)] = deconvolve(img_bgr[region[0], region[1]], params['low_memory'])
+
+        with timer.stage('thresholds'):
+            if th_h is None:
+                th_h = channel_histogram([(stored[id(region)][0], region[2]) for region in regions]).otsu()
+            if th_d is None:
+                th_d = channel_histogram([(stored[id(region)][1], region[2]) for region in regions]).otsu()
+        planes = lambda region: stored.pop(id(region))
+
+    objects = {'h': [], 'd': []} if measure_objects else {'h': []}
+    with timer.stage('segment'):
+        lbl_h, lbl_d, cents_h, cents_d = segment_regions(planes, shape, th_h, th_d, params, tiles, objects)
+
+    total = shape[0] * shape[1]
+    result = {
+        'lbl_h': lbl_h,
+        'lbl_d': lbl_d,
+        'cents_h': cents_h,
+        'cents_d': cents_d,
+        'h_threshold': th_h,
+        'd_threshold': th_d,
+        'skipped_fraction': max(0.0, 1 - region_pixels(regions) / total) if total else 0.0
+    }
+    result['objects_h'] = concat_measurements(objects['h'])
+    if measure_objects:
+        result['objects_d'] = concat_measurements(objects['d'])
+    return result
+
+
+class PeakMemory:
+    """
+    Context manager measuring the peak memory allocated inside a block.
+    NumPy (and therefore OpenCV and scikit-image) arrays are traced by tracemalloc.
+    When disabled the block runs untraced and peak_mb stays None.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.peak_mb = None
+
+    def __enter__(self):
+        if not self.enabled:
+            return self
+        self.started = not tracemalloc.is_tracing()
+        if self.started or not hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.stop()
+            tracemalloc.start()
+        else:
+            tracemalloc.reset_peak()
+        self.baseline = tracemalloc.get_traced_memory()[0]
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.enabled:
+            return False
+        self.peak_mb = max(0, tracemalloc.get_traced_memory()[1] - self.baseline) / 2 ** 20
+        if self.started:
+            tracemalloc.stop()
+        return False
+
+
+def count_summary(num_blue, num_red):
+    """
+    Compute the count statistics reported for an image.
+
+    Parameters:
+        num_blue (int): Number of blue nuclei
+        num_red (int): Number of brown/red spots
+
+    Returns:
+        dict: Counts, ratios and percentages
+    """
+    total = num_blue + num_red
+    return {
+        'blue_count': num_blue,
+        'red_count': num_red,
+        'total_count': total,
+        'pct_red_of_total': (num_red / total * 100) if total > 0 else 0,
+        'red_blue_ratio': (num_red / num_blue) if num_blue > 0 else float('inf'),
+        'pct_blue_of_total': (num_blue / total * 100) if total > 0 else 0,
+        'red_as_pct_of_blue': (num_red / num_blue * 100) if num_blue > 0 else float('inf')
+    }
+
+
+def dab_scores(mean_d, thresholds=DAB_SCORE_THRESHOLDS):
+    """
+    Score nuclei by their mean DAB intensity into 0, 1+, 2+ and 3+ and compute the H-score.
+
+    Parameters:
+        mean_d (numpy.ndarray): Mean DAB intensity of every counted nucleus
+        thresholds (tuple): Intensities at which a nucleus is scored 1+, 2+ and 3+
+
+    Returns:
+        dict: Nuclei per class, percentage of DAB-positive (1+ or more) nuclei, H-score
+              (0-300) and the mean nuclear DAB intensity
+    """
+    mean_d = np.asarray(mean_d, dtype=np.float64)
+    classes = np.bincount(np.digitize(mean_d, thresholds), minlength=4)
+    total = len(mean_d)
+    pct = classes / total * 100 if total else np.zeros(4)
+    return {
+        'dab_0_count': int(classes[0]),
+        'dab_1_count': int(classes[1]),
+        'dab_2_count': int(classes[2]),
+        'dab_3_count': int(classes[3]),
+        'pct_dab_positive': float(pct[1:].sum()),
+        'h_score': float(pct[1] + 2 * pct[2] + 3 * pct[3]),
+        'mean_nuclear_dab': float(mean_d.mean()) if total else None
+    }
+
+
+def measure_image(image_path, params, image_data=None, labels_path=None, measure_objects=False, timer=None,
+                  density_path=None):
+    """
+    Analyze an image file and collect the values reported for it.
+    Used by the bulk processor and by headless workers.
+
+    Parameters:
+        image_path (str): Path to the image file or page specification (see stacks.split_page);
+            only used as the name if image_data is given
+        params (dict): Normalized parameters (see processing_params)
+        image_data (bytes): Encoded image file contents, e.g. an upload
+        labels_path (str): File to save the label images to in run-length form (optional)
+        measure_objects (bool): Add the per-object measurement tables ('objects_h', 'objects_d')
+        timer (StageTimer): Optional timer receiving the 'read', 'save_labels' and 'density' stages
+                            besides those of analyze_image
+        density_path (str): File to save the density map of the detections to (optional)
+
+    Returns:
+        dict: Filename, count, DAB positivity and spatial statistics, skipped fraction, peak memory, centroids,
+              image size, label and density map files, or None if the image could not be read
+    """
+    timer = timer or StageTimer()
+    with PeakMemory(params['low_memory']) as peak:
+        with timer.stage('read'):
+            if image_data is None:
+                img = read_image(image_path)
+            else:
+                img = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            return None
+        analysis = analyze_image(img, params, path=image_path if image_data is None else None,
+                                 measure_objects=measure_objects, timer=timer)
+        if labels_path:
+            with timer.stage('save_labels'):
+                save_labels(labels_path, analysis['lbl_h'], analysis['lbl_d'])
+        cents_h, cents_d = analysis['cents_h'], analysis['cents_d']
+        skipped_fraction = analysis['skipped_fraction']
+        objects_h, objects_d = analysis.get('objects_h'), analysis.get('objects_d')
+        img_h, img_w = img.shape[:2]
+        del analysis, img
+
+    result = {'filename': os.path.basename(image_path)}
+    result.update(count_summary(len(cents_h), len(cents_d)))
+    counted = objects_h['area'] > params['min_area_h']
+    result.update(dab_scores(objects_h['mean_d'][counted], params['dab_thresholds']))
+    if density_path:
+        with timer.stage('density'):
+            density = DensityMap((img_w, img_h), params['density_cell_size'])
+            density.add_nuclei(np.column_stack([objects_h['row'][counted], objects_h['col'][counted]]),
+                               objects_h['mean_d'][counted] >= params['dab_thresholds'][0])
+            density.add_brown(cents_d)
+            density.save(density_path)
+    result.update(spatial_statistics(cents_h, cents_d, params['neighbour_radius']))
+    result.update({
+        'skipped_fraction': skipped_fraction,
+        'peak_memory_mb': peak.peak_mb,
+        'cents_h': cents_h,
+        'cents_d': cents_d,
+        'image_size': (img_w, img_h),
+        'labels_file': labels_path,
+        'density_file': density_path
+    })
+    if measure_objects:
+        result['objects_h'], result['objects_d'] = objects_h, objects_d
+    return result
+
+
+def export_row(result):
+    """
+    Build the CSV row exported for one image.
+
+    Parameters:
+        result (dict): Result dictionary of a processed image
+
+    Returns:
+        dict: Column name to value
+    """
+    return {
+        'Filename': result['filename'],
+        'Blue nuclei count': result['blue_count'],
+        'Red stain count': result['red_count'],
+        'Total count': result['total_count'],
+        'Red:Blue ratio': result['red_blue_ratio'],
+        'Red as % of Blue': result['red_as_pct_of_blue'],
+        '% Red of total': result['pct_red_of_total'],
+        '% Blue of total': result['pct_blue_of_total'],
+        'Background skipped %': result['skipped_fraction'] * 100,
+        'Peak memory (MB)': result.get('peak_memory_mb'),
+        'Nuclei DAB 0': result.get('dab_0_count'),
+        'Nuclei DAB 1+': result.get('dab_1_count'),
+        'Nuclei DAB 2+': result.get('dab_2_count'),
+        'Nuclei DAB 3+': result.get('dab_3_count'),
+        '% DAB-positive nuclei': result.get('pct_dab_positive'),
+        'H-score': result.get('h_score'),
+        'Mean nuclear DAB': result.get('mean_nuclear_dab'),
+        'Neighbour radius (px)': result.get('neighbour_radius'),
+        'Red near blue count': result.get('red_near_blue_count'),
+        '% Red near blue': result.get('pct_red_near_blue'),
+        '% Blue with red neighbour': result.get('pct_blue_with_red'),
+        'Mean red neighbours per blue': result.get('mean_red_per_blue'),
+        'Max red neighbours per blue': result.get('max_red_per_blue'),
+        'Median red to nearest blue (px)': result.get('nearest_blue_median'),
+        '90th pct red to nearest blue (px)': result.get('nearest_blue_p90'),
+        'Duplicate of': result.get('duplicate_of') or '',
+        'Near duplicates': '; '.join(result.get('similar_to') or [])
+    }
@@ -0,0 +1,210 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+
+from config import (
+    ANNOTATED_FORMAT, ANNOTATED_COMPRESSION, ANNOTATED_CONTOURS, ANNOTATED_MARKER_RADIUS,
+    ANNOTATED_WRITERS, ANNOTATED_MAX_PENDING
+)
+from overlay import BLUE_MARKER, RED_MARKER, stamp_offsets, display_points
+from labels import load_labels
+from stacks import read_image, output_name
+
+# Outline colours of segmented nuclei and brown spots (RGB, like the marker colours)
+NUCLEUS_OUTLINE = (0, 255, 255)
+BROWN_OUTLINE = (255, 255, 0)
+
+# Seconds between checks for cancellation while waiting for a free writer slot
+WAIT_SECONDS = 0.2
+
+
+def encode_params(fmt, level):
+    """
+    Translate a compression level into OpenCV encoder flags.
+
+    Parameters:
+        fmt (str): 'png', 'tif' or 'jpg'
+        level (int): 0 (fastest, largest files) to 9 (smallest files)
+
+    Returns:
+        list: Flags for cv2.imwrite
+    """
+    level = min(9, max(0, int(level)))
+    if fmt == 'png':
+        return [cv2.IMWRITE_PNG_COMPRESSION, level]
+    if fmt == 'jpg':
+        return [cv2.IMWRITE_JPEG_QUALITY, 100 - 5 * level]
+    if fmt == 'tif':
+        # libtiff has no deflate level setting in OpenCV: 0 is uncompressed, anything else deflate
+        return [cv2.IMWRITE_TIFF_COMPRESSION, getattr(cv2, 'IMWRITE_TIFF_COMPRESSION_ADOBE_DEFLATE', 8) if level else 1]
+    raise ValueError(f"Unsupported annotated image format {fmt}")
+
+
+def label_outlines(lbl):
+    """
+    Find the boundary pixels of the objects of a label image.
+
+    Parameters:
+        lbl (numpy.ndarray): 2D label image (0 = background)
+
+    Returns:
+        numpy.ndarray: Boolean mask of the object pixels next to another label or the background
+    """
+    edge = np.zeros(lbl.shape, dtype=bool)
+    differs = lbl[:, 1:] != lbl[:, :-1]
+    edge[:, 1:] |= differs
+    edge[:, :-1] |= differs
+    differs = lbl[1:] != lbl[:-1]
+    edge[1:] |= differs
+    edge[:-1] |= differs
+    edge &= lbl > 0
+    return edge
+
+
+def stamp_markers(img, cents, radius, color):
+    """
+    Draw filled markers on a full resolution image.
+
+    Parameters:
+        img (numpy.ndarray): BGR image, drawn on in place
+        cents (array-like): (row, col) centroids
+        radius (int): Marker radius in pixels
+        color (tuple): RGB marker colour
+    """
+    points = display_points(cents, 1, 1)
+    if not len(points):
+        return
+    dy, dx = stamp_offsets(radius)
+    ys = (points[:, 1:2] + dy).ravel()
+    xs = (points[:, 0:1] + dx).ravel()
+    inside = (ys >= 0) & (ys < img.shape[0]) & (xs >= 0) & (xs < img.shape[1])
+    img[ys[inside], xs[inside]] = color[::-1]
+
+
+def render_annotation(img, cents_h, cents_d, marker_radius=ANNOTATED_MARKER_RADIUS, labels=None):
+    """
+    Draw the detections of an image at full resolution.
+
+    Parameters:
+        img (numpy.ndarray): BGR image, drawn on in place
+        cents_h (array-like): (row, col) centroids of the counted nuclei
+        cents_d (array-like): (row, col) centroids of the counted brown spots
+        marker_radius (int): Marker radius in pixels
+        labels (tuple): (nucleus labels, brown spot labels) as RunLengthLabels, to outline
+                        every segmented object (optional)
+
+    Returns:
+        numpy.ndarray: The annotated image
+    """
+    if labels is not None:
+        for runs, color in zip(labels, (NUCLEUS_OUTLINE, BROWN_OUTLINE)):
+            if runs.shape == img.shape[:2]:
+                img[label_outlines(runs.decode())] = color[::-1]
+    stamp_markers(img, cents_h, marker_radius, BLUE_MARKER)
+    stamp_markers(img, cents_d, marker_radius, RED_MARKER)
+    return img
+
+
+class AnnotationWriter:
+    """
+    Renders and encodes full resolution annotated images on a pool of writer threads, so
+    slow PNG/TIFF compression does not hold up processing. At most max_pending images are
+    queued or being written; submit waits for a free slot, which bounds the memory used by
+    images that have not been written yet.
+    """
+
+    def __init__(self, folder, fmt=ANNOTATED_FORMAT, level=ANNOTATED_COMPRESSION, contours=ANNOTATED_CONTOURS,
+                 marker_radius=ANNOTATED_MARKER_RADIUS, workers=ANNOTATED_WRITERS, max_pending=ANNOTATED_MAX_PENDING,
+                 cancel_event=None):
+        """
+        Parameters:
+            folder (str): Output folder (created when the first image is written)
+            fmt (str): 'png', 'tif' or 'jpg'
+            level (int): Compression level from 0 to 9
+            contours (bool): Outline the segmented objects when label images are available
+            marker_radius (int): Marker radius in pixels
+            workers (int): Writer threads
+            max_pending (int): Images queued or being written before submit waits
+            cancel_event (threading.Event): Stops submit from waiting for a slot once set
+        """
+        self.folder = folder
+        self.fmt = fmt
+        self.flags = encode_params(fmt, level)
+        self.contours = contours
+        self.marker_radius = marker_radius
+        self.cancel_event = cancel_event
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='annotate')
+        self.slots = threading.BoundedSemaphore(max(1, max_pending))
+        self.lock = threading.Lock()
+        self.written = 0
+        self.errors = {}
+
+    def output_path(self, image_path):
+        """
+        Get the file the annotated version of an image is written to (see stacks.output_name).
+
+        Parameters:
+            image_path (str): Image path or page specification
+
+        Returns:
+            str: Path in the output folder
+        """
+        return os.path.join(self.folder, f"{output_name(image_path)}_annotated.{self.fmt}")
+
+    def submit(self, image_path, cents_h, cents_d, labels_path=None):
+        """
+        Queue an image for writing, waiting while max_pending images are not written yet.
+
+        Parameters:
+            image_path (str): Image path or page specification
+            cents_h (array-like): (row, col) centroids of the counted nuclei
+            cents_d (array-like): (row, col) centroids of the counted brown spots
+            labels_path (str): Saved label images of the image (optional)
+
+        Returns:
+            str: Path the annotated image will be written to, or None if cancelled
+        """
+        while not self.slots.acquire(timeout=WAIT_SECONDS):
+            if self.cancel_event is not None and self.cancel_event.is_set():
+                return None
+        path = self.output_path(image_path)
+        try:
+            future = self.executor.submit(self._write, image_path, np.array(cents_h, dtype=np.float64),
+                                          np.array(cents_d, dtype=np.float64), labels_path, path)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return path
+
+    def _write(self, image_path, cents_h, cents_d, labels_path, path):
+        try:
+            img = read_image(image_path)
+            if img is None:
+                raise ValueError("The image could not be read")
+            labels = None
+            if self.contours and labels_path and os.path.exists(labels_path):
+                labels = load_labels(labels_path)
+            render_annotation(img, cents_h, cents_d, self.marker_radius, labels)
+            del labels
+            os.makedirs(self.folder, exist_ok=True)
+            tmp_path = f"{os.path.splitext(path)[0]}.tmp.{self.fmt}"
+            if not cv2.imwrite(tmp_path, img, self.flags):
+                raise OSError(f"Could not write {tmp_path}")
+            os.replace(tmp_path, path)
+            with self.lock:
+                self.written += 1
+        except Exception as e:
+            with self.lock:
+                self.errors[image_path] = str(e)
+
+    def close(self, cancel=False):
+        """
+        Wait for the queued images to be written.
+
+        Parameters:
+            cancel (bool): Drop the images whose writing has not started yet
+        """
+        self.executor.shutdown(wait=True, cancel_futures=cancel)
@@ -0,0 +1,159 @@
+import os
+import sys
+import json
+import time
+import numpy as np
+
+from config import DEFAULT_PARAMS_FILE, CALIBRATION_SAMPLE_IMAGES, CALIBRATION_PIXELS_PER_IMAGE
+from analysis import processing_params, analysis_regions, region_pixels, deconvolve
+from histogram import channel_histogram
+from stacks import read_image
+
+CALIBRATION_VERSION = 1
+
+
+def sample_images(image_paths, count=CALIBRATION_SAMPLE_IMAGES):
+    """
+    Pick the images used for calibration, spread evenly over the sorted batch.
+
+    Parameters:
+        image_paths (list): All images of the batch
+        count (int): Number of images to sample (all images if 0 or larger than the batch)
+
+    Returns:
+        list: Sampled image paths
+    """
+    paths = sorted(image_paths)
+    if not count or count >= len(paths):
+        return paths
+    return [paths[int(i)] for i in np.linspace(0, len(paths) - 1, count).round()]
+
+
+def calibrate(image_paths, params, sample_count=CALIBRATION_SAMPLE_IMAGES,
+              pixels_per_image=CALIBRATION_PIXELS_PER_IMAGE, progress=None):
+    """
+    Derive batch thresholds from pooled H and D histograms of a sample of the batch.
+    Every sampled image contributes about the same number of pixels, taken on a regular
+    grid from the areas the pipeline would analyze (so blank glass is left out when
+    tissue detection is enabled).
+
+    Parameters:
+        image_paths (list): All images of the batch
+        params (dict): Raw processing parameters
+        sample_count (int): Number of images to sample
+        pixels_per_image (int): Pixels sampled per image
+        progress (callable): Optional function called with (done, total) after each image
+
+    Returns:
+        dict: Calibration with the thresholds, the sampled images and the histogram statistics
+    """
+    run_params = processing_params(params)
+    run_params['pyramid_analysis'] = False
+    sampled = sample_images(image_paths, sample_count)
+
+    h_parts, d_parts, used = [], [], []
+    for i, path in enumerate(sampled):
+        img = read_image(path)
+        if img is not None:
+            regions = analysis_regions(img, run_params)
+            step = max(1, int(np.ceil(np.sqrt(max(1, region_pixels(regions)) / pixels_per_image))))
+            for rs, cs, mask in regions:
+                h_part, d_part = deconvolve(np.ascontiguousarray(img[rs, cs][::step, ::step]),
+                                            run_params['low_memory'])
+                sub = mask[::step, ::step] if mask is not None else None
+                h_parts.append((h_part, sub))
+                d_parts.append((d_part, sub))
+            used.append(os.path.abspath(path))
+            del img
+        if progress:
+            progress(i + 1, len(sampled))
+
+    h_stats, d_stats = channel_histogram(h_parts), channel_histogram(d_parts)
+    return {
+        'version': CALIBRATION_VERSION,
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'h_threshold': float(h_stats.otsu()),
+        'd_threshold': float(d_stats.otsu()),
+        'h_range': [float(h_stats.min), float(h_stats.max)],
+        'd_range': [float(d_stats.min), float(d_stats.max)],
+        'sampled_pixels': int(h_stats.sampled),
+        'batch_images': len(image_paths),
+        'images': used,
+        'tissue_detection': run_params['tissue_detection']
+    }
+
+
+def save_calibration(path, calibration):
+    """
+    Write a calibration to a JSON file.
+
+    Parameters:
+        path (str): Calibration file
+        calibration (dict): Calibration as returned by calibrate
+    """
+    with open(path, 'w') as f:
+        json.dump(calibration, f, indent=4)
+
+
+def load_calibration(path):
+    """
+    Read a calibration file.
+
+    Parameters:
+        path (str): Calibration file
+
+    Returns:
+        dict: Calibration
+
+    Raises:
+        ValueError: If the file is not a calibration file
+    """
+    with open(path, 'r') as f:
+        calibration = json.load(f)
+    if not isinstance(calibration, dict) or calibration.get('version') != CALIBRATION_VERSION or \
+            'h_threshold' not in calibration or 'd_threshold' not in calibration:
+        raise ValueError(f"{path} is not a calibration file")
+    return calibration
+
+
+def apply_calibration(params, calibration):
+    """
+    Use the thresholds of a calibration for a run.
+
+    Parameters:
+        params (dict): Raw processing parameters
+        calibration (dict): Calibration (None to leave the parameters unchanged)
+
+    Returns:
+        dict: Copy of the parameters with the calibrated thresholds
+    """
+    if calibration is None:
+        return dict(params)
+    return dict(params, h_threshold=calibration['h_threshold'], d_threshold=calibration['d_threshold'])
+
+
+if __name__ == "__main__":
+    import argparse
+    from workqueue import list_images
+
+    parser = argparse.ArgumentParser(description="Compute batch thresholds from a sample of the images")
+    parser.add_argument('images', nargs='+', help="Image files or folders of the batch")
+    parser.add_argument('--params', default=DEFAULT_PARAMS_FILE, help="Parameters file")
+    parser.add_argument('--output', required=True, help="Calibration file to write")
+    parser.add_argument('--sample-images', type=int, default=CALIBRATION_SAMPLE_IMAGES,
+                        help="Images to sample (0 = all)")
+    parser.add_argument('--pixels-per-image', type=int, default=CALIBRATION_PIXELS_PER_IMAGE)
+    args = parser.parse_args()
+
+    with open(args.params, 'r') as f:
+        params = json.load(f)
+
+    images = list_images(args.images)
+    if not images:
+        print("No images found")
+        sys.exit(1)
+    calibration = calibrate(images, params, args.sample_images, args.pixels_per_image,
+                            progress=lambda done, total: print(f"Sampled {done} of {total} image(s)"))
+    save_calibration(args.output, calibration)
+    print(f"H threshold {calibration['h_threshold']:.4f}, D threshold {calibration['d_threshold']:.4f} "
+          f"from {calibration['sampled_pixels']} pixels of {len(calibration['images'])} image(s)")
@@ -9,6 +9,11 @@ DEFAULT_PARAMS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "
 DISPLAY_MAX_WIDTH = 400
 DISPLAY_MAX_HEIGHT = 400
 
+# Zoom viewer settings
+VIEWER_TILE_SIZE = 256
+VIEWER_CACHE_TILES = 256      # rendered tiles kept in the LRU cache
+VIEWER_MAX_ZOOM = 8
+
 # Processing parameters
 DISK_SIZE = 1
 GAUSSIAN_SIGMA = 1
@@ -17,6 +22,123 @@ MIN_AREA_H = 2
 MIN_AREA_D = 5
 MARKER_RADIUS = 2
 
+# DAB positivity of nuclei: mean nuclear DAB at which a nucleus is scored 1+, 2+ and 3+
+# (H-score = 1 x %1+ + 2 x %2+ + 3 x %3+, from 0 to 300)
+DAB_SCORE_THRESHOLDS = (0.015, 0.03, 0.06)
+
+# Spatial statistics: brown spots within this distance (pixels) of a nucleus are its neighbours
+NEIGHBOUR_RADIUS = 20
+
+# Tissue detection (skips blank glass before segmentation)
+TISSUE_DETECTION = False
+TISSUE_MAX_SIDE = 512           # longest side of the low resolution copy used for detection
+TISSUE_SATURATION = 0.08        # minimum HSV saturation (0-1) of tissue
+TISSUE_OPTICAL_DENSITY = 0.15   # minimum mean optical density of tissue
+TISSUE_MARGIN = 16              # full resolution pixels kept around detected tissue
+TISSUE_MIN_PIXELS = 1           # smallest tissue piece kept, in low resolution pixels
+
+# Multi-resolution analysis (full resolution segmentation only where the coarse level shows signal)
+PYRAMID_ANALYSIS = False
+PYRAMID_COARSE_SIDE = 1024      # longest side of the coarse level used to find candidates
+PYRAMID_SENSITIVITY = 0.5       # fraction of the thresholds applied at the coarse level
+PYRAMID_MARGIN = 24             # full resolution pixels kept around candidate areas
+
+# Low memory mode (float32/uint8/int32 intermediates, tiling above the memory budget). Untiled
+# results equal the default ones; tiled results can differ for nuclei on the tile borders
+LOW_MEMORY = False
+MEMORY_BUDGET_MB = 1024
+LOW_MEMORY_BYTES_PER_PIXEL = 56     # estimated peak pipeline bytes per analyzed pixel
+TILE_OVERLAP = 64                   # pixels shared by neighbouring tiles
+MIN_TILE_SIZE = 256
+THRESHOLD_SAMPLE_PIXELS = 4000000   # pixels sampled for Otsu thresholds of tiled images
+PIPELINE_BYTES_PER_PIXEL = 96       # estimated peak pipeline bytes per pixel outside low memory mode
+
+# Parallel bulk runs: images are started largest first on worker processes while their
+# estimated pipeline memory fits the budget; results are still reported in listing order
+BULK_WORKERS = max(1, min(4, (os.cpu_count() or 1) // 2))
+BULK_MEMORY_MB = 4096
+
+# Channel statistics (range, histogram and Otsu thresholds of the stain planes)
+STATS_BINS = 256                    # histogram bins, as used by skimage's threshold_otsu
+STATS_CHUNK_PIXELS = 1 << 20        # pixels visited per block
+
+# Batch threshold calibration
+CALIBRATION_FILENAME = "dotcounter_calibration.json"
+CALIBRATION_SAMPLE_IMAGES = 16          # images sampled from a batch
+CALIBRATION_PIXELS_PER_IMAGE = 500000   # pixels sampled from every image
+
+# Bulk run journal (written next to the processed images)
+JOURNAL_FILENAME = ".dotcounter_journal.jsonl"
+
+# Label images of bulk runs, saved in run-length form next to the processed images
+SAVE_LABELS = True
+LABELS_DIRNAME = ".dotcounter_labels"
+
+# Density maps of bulk runs: nuclei, brown spots and DAB-positive share per grid cell
+DENSITY_MAPS = True
+DENSITY_DIRNAME = ".dotcounter_density"
+DENSITY_CELL_SIZE = 256         # grid cell side in image pixels
+DENSITY_MIN_SIDE = 512          # heatmap images are enlarged to at least this many pixels
+
+# Full resolution annotated images of bulk runs (markers and label contours), written by a
+# pool of writer threads; processing waits when ANNOTATED_MAX_PENDING images are not written yet
+ANNOTATED_EXPORT = False
+ANNOTATED_DIRNAME = "annotated"
+ANNOTATED_FORMATS = ('png', 'tif', 'jpg')
+ANNOTATED_FORMAT = 'png'
+ANNOTATED_COMPRESSION = 3       # 0 (fastest, largest) to 9 (smallest)
+ANNOTATED_CONTOURS = True       # outline the segmented objects from the saved label images
+ANNOTATED_MARKER_RADIUS = 4
+ANNOTATED_WRITERS = 2
+ANNOTATED_MAX_PENDING = 4
+
+# Per-object datasets of bulk runs (row groups of a Parquet file, or NPZ files without pyarrow)
+EXPORT_OBJECTS = True
+OBJECTS_DIRNAME = ".dotcounter_objects"
+OBJECTS_ROW_GROUP = 65536       # objects per row group
+
+# Per-image metrics logs (stage timings, memory, cache hits) for run reports
+METRICS_ENABLED = False
+METRICS_FILENAME = ".dotcounter_metrics.jsonl"
+METRICS_SLOWEST = 10            # slowest images listed by the report
+METRICS_INTERVAL_SECONDS = 60   # width of the throughput buckets of the report
+
+# Multi-page TIFFs (focal planes or serial fields): 'pages' gives one result per page;
+# 'pages + max' / 'pages + mean' add a projection of each stack, 'max' / 'mean' give only
+# the projection and 'first page' reads the first page like other image readers
+STACK_MODE = 'pages'
+
+# Duplicate detection in bulk runs (identical files reuse one result, near duplicates are flagged)
+DUPLICATE_DETECTION = True
+DUPLICATE_HASH_SIZE = 16        # difference hash of 16 x 16 bits, computed from the result thumbnail
+DUPLICATE_MAX_DISTANCE = 24     # differing bits up to which two images count as near duplicates
+FINGERPRINT_CHUNK_BYTES = 1 << 20
+
+# Stain planes of images opened in the dot counter, kept as .npy files keyed by file hash and
+# memory mapped when the image is opened again; the least recently opened images are evicted
+HED_CACHE = True
+HED_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".dotcounter", "hed_cache")
+HED_CACHE_MAX_MB = 4096
+
+# Speculative precomputation of the neighbouring slider positions in the dot counter
+SPECULATION_ENABLED = True
+SPECULATION_SLIDERS = ('h_threshold', 'd_threshold', 'min_distance')
+SPECULATION_STEPS = 2           # positions precomputed on each side of the current one
+SPECULATION_IDLE_MS = 300       # pause after the last change before precomputing starts
+SPECULATION_MAX_MB = 512        # memory for precomputed results
+
+# Shared-filesystem work queue (workers on any machine that mounts the queue folder)
+WORKQUEUE_HEARTBEAT_SECONDS = 15    # how often a worker refreshes the claim of its image
+WORKQUEUE_STALE_SECONDS = 120       # claims not refreshed for this long are taken over
+WORKQUEUE_POLL_SECONDS = 5          # wait between passes while other workers hold claims
+
+# Local HTTP analysis service
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8765
+SERVICE_WORKERS = 2             # analysis processes kept warm (maximum concurrent analyses)
+SERVICE_MAX_QUEUE = 16          # requests waiting for a worker before new ones are rejected
+SERVICE_MAX_UPLOAD_MB = 512
+
 # The paramter range for the slider
 PARAM_RANGES = {
     'h_threshold': {'min': 0, 'max': 1, 'step': 0.01, 'length': 250},
@@ -0,0 +1,183 @@
+import os
+import re
+import cv2
+import numpy as np
+
+from config import DENSITY_CELL_SIZE, DENSITY_MIN_SIDE
+from stacks import output_name
+
+# Colour of grid cells without nuclei in positive fraction maps (BGR)
+EMPTY_CELL = (96, 96, 96)
+
+
+class DensityMap:
+    """
+    Counts of nuclei, brown spots and DAB-positive nuclei per cell of a regular grid over an image.
+    Points are binned with bincount as they are added, so memory depends on the grid size only,
+    not on the number of objects.
+    """
+
+    def __init__(self, image_size, cell_size=DENSITY_CELL_SIZE):
+        """
+        Parameters:
+            image_size (tuple): (width, height) of the image in pixels
+            cell_size (int): Side of a grid cell in pixels
+        """
+        width, height = image_size
+        self.cell_size = int(cell_size)
+        self.shape = (max(1, -(-int(height) // self.cell_size)), max(1, -(-int(width) // self.cell_size)))
+        self.nuclei = np.zeros(self.shape, dtype=np.int64)
+        self.brown = np.zeros(self.shape, dtype=np.int64)
+        self.positive = np.zeros(self.shape, dtype=np.int64)
+
+    def _bin(self, points):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        rows = np.clip((points[:, 0] // self.cell_size).astype(np.intp), 0, self.shape[0] - 1)
+        cols = np.clip((points[:, 1] // self.cell_size).astype(np.intp), 0, self.shape[1] - 1)
+        cells = np.bincount(rows * self.shape[1] + cols, minlength=self.shape[0] * self.shape[1])
+        return cells.reshape(self.shape)
+
+    def add_nuclei(self, points, positive=None):
+        """
+        Add nuclei, e.g. those of one tile.
+
+        Parameters:
+            points (array-like): (row, col) centroids in image coordinates
+            positive (numpy.ndarray): Optional boolean array marking the DAB-positive nuclei
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        self.nuclei += self._bin(points)
+        if positive is not None:
+            self.positive += self._bin(points[np.asarray(positive, dtype=bool)])
+
+    def add_brown(self, points):
+        """
+        Add brown spots, e.g. those of one tile.
+
+        Parameters:
+            points (array-like): (row, col) centroids in image coordinates
+        """
+        self.brown += self._bin(points)
+
+    def positive_fraction(self):
+        """
+        Returns:
+            numpy.ndarray: Share of DAB-positive nuclei per cell (NaN for cells without nuclei)
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.nuclei > 0, self.positive / self.nuclei, np.nan)
+
+    def save(self, path):
+        """
+        Save the grids as a compressed .npz file.
+
+        Parameters:
+            path (str): Destination file
+        """
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        np.savez_compressed(path, nuclei=self.nuclei, brown=self.brown, positive=self.positive,
+                            cell_size=self.cell_size)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load grids saved with save.
+
+        Parameters:
+            path (str): .npz file
+
+        Returns:
+            DensityMap: The saved map
+        """
+        with np.load(path) as data:
+            cell_size = int(data['cell_size'])
+            nuclei = data['nuclei']
+            density = cls((nuclei.shape[1] * cell_size, nuclei.shape[0] * cell_size), cell_size)
+            density.nuclei, density.brown, density.positive = nuclei, data['brown'], data['positive']
+        return density
+
+
+def heatmap_image(grid, vmax=None, min_side=DENSITY_MIN_SIDE):
+    """
+    Colour a grid for viewing. Cells are enlarged without smoothing so every cell stays visible.
+
+    Parameters:
+        grid (numpy.ndarray): Counts or fractions per cell; NaN cells are shown in grey
+        vmax (float): Value shown in the brightest colour (default: the largest value)
+        min_side (int): Smallest length in pixels of the longer side of the image
+
+    Returns:
+        numpy.ndarray: BGR image
+    """
+    grid = np.asarray(grid, dtype=np.float64)
+    empty = np.isnan(grid)
+    if vmax is None:
+        vmax = np.nanmax(grid) if not empty.all() else 0
+    scaled = np.nan_to_num(grid / vmax if vmax > 0 else grid * 0, nan=0.0)
+    img = cv2.applyColorMap(np.clip(scaled * 255, 0, 255).astype(np.uint8), cv2.COLORMAP_INFERNO)
+    img[empty] = EMPTY_CELL
+    scale = max(1, -(-min_side // max(grid.shape)))
+    return cv2.resize(img, (grid.shape[1] * scale, grid.shape[0] * scale), interpolation=cv2.INTER_NEAREST)
+
+
+def render_maps(density_path, folder, name):
+    """
+    Write the heatmaps of a saved density map as PNG images.
+
+    Parameters:
+        density_path (str): .npz file saved by DensityMap.save
+        folder (str): Output folder
+        name (str): Image name the files are named after
+
+    Returns:
+        list: Paths of the written images (nuclei, brown spots, positive fraction)
+    """
+    density = DensityMap.load(density_path)
+    os.makedirs(folder, exist_ok=True)
+    stem = re.sub(r'[^\w.-]', '_', name)
+    paths = []
+    for suffix, img in (('nuclei', heatmap_image(density.nuclei)),
+                        ('brown', heatmap_image(density.brown)),
+                        ('positive', heatmap_image(density.positive_fraction(), vmax=1.0))):
+        path = os.path.join(folder, f"{stem}_{suffix}.png")
+        cv2.imwrite(path, img)
+        paths.append(path)
+    return paths
+
+
+def export_maps(results, csv_path):
+    """
+    Write the heatmaps of exported results into a folder next to the CSV file.
+    Maps are named with stacks.output_name, so images with the same file name in
+    different folders do not overwrite each other's maps.
+
+    Parameters:
+        results (list): Result dictionaries; those with an existing 'density_file' are rendered
+        csv_path (str): Exported CSV file; the maps go to "<name>_density"
+
+    Returns:
+        int: Number of images whose maps were written
+    """
+    folder = f"{os.path.splitext(csv_path)[0]}_density"
+    written = 0
+    for result in results:
+        density_path = result.get('density_file')
+        if density_path and os.path.exists(density_path):
+            render_maps(density_path, folder, output_name(result.get('image_path') or result['filename']))
+            written += 1
+    return written
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Render saved density maps as heatmap images")
+    parser.add_argument('maps', nargs='+', help="Density map .npz files")
+    parser.add_argument('--output', default='.', help="Folder receiving the PNG images")
+    args = parser.parse_args()
+
+    for path in args.maps:
+        for written in render_maps(path, args.output, os.path.splitext(os.path.basename(path))[0]):
+            print(written)
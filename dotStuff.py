@@ -1,18 +1,11 @@
 import tkinter as tk
-from tkinter import filedialog, messagebox, ttk
-from PIL import Image, ImageTk
-import cv2
-import numpy as np
+from tkinter import filedialog, messagebox, simpledialog, ttk
+from PIL import ImageTk
 import json
 import os
 import sys
-from skimage.color import rgb2hed
-from skimage.morphology import opening, disk
-from skimage.measure import label, regionprops
-from skimage.feature import peak_local_max
-from skimage.segmentation import watershed
-from skimage.filters import threshold_otsu
-from scipy import ndimage as ndi
+import time
+import threading
 
 class ToolTip:
     """
@@ -118,6 +111,21 @@ except ImportError:
             messagebox.showerror("Error", "Could not load config.py. Make sure it's in the same directory as this script.")
             sys.exit(1)
 
+from analysis import (
+    processing_params, deconvolve, segment_regions, full_region, rect_region, tissue_regions, region_pixels
+)
+from histogram import channel_histogram
+from overlay import OverlayRenderer, display_points
+from viewer import ZoomViewer
+from metrics import StageTimer, MetricsLog, metrics_record
+from speculation import SpeculativeSegmenter
+from hedcache import HEDCache
+from stacks import PROJECTIONS, page_count, page_spec, read_image, open_thumbnail
+
+# Sliders that change the segmentation (marker_radius only changes the display)
+SEGMENTATION_SLIDERS = ('h_threshold', 'd_threshold', 'disk_size', 'gaussian_sigma',
+                        'min_distance', 'min_area_h', 'min_area_d')
+
 PARAM_TOOLTIPS = {
     'h_threshold': """Blue Nuclei Detection Sensitivity
 
@@ -184,6 +192,33 @@ What it does: Controls the size of the colored dots shown on the result image (v
 → Higher value: Larger dots for visualization (more visible)"""
 }
 
+
+def segment_values(h_chan, d_chan, values, regions):
+    """
+    Segment the stain planes with a set of slider values.
+
+    Parameters:
+        h_chan (numpy.ndarray): Hematoxylin plane of the whole image
+        d_chan (numpy.ndarray): DAB plane of the whole image
+        values (dict): Values of the SEGMENTATION_SLIDERS
+        regions (list): Regions to analyze
+
+    Returns:
+        tuple: (lbl_h, lbl_d, cents_h, cents_d) as returned by segment_regions
+    """
+    params = processing_params({
+        'disk_size': int(values['disk_size']),
+        'gaussian_sigma': values['gaussian_sigma'],
+        'min_distance': int(values['min_distance']),
+        'min_area_h': int(values['min_area_h']),
+        'min_area_d': int(values['min_area_d'])
+    })
+    return segment_regions(
+        lambda region: (h_chan[region[0], region[1]], d_chan[region[0], region[1]]),
+        h_chan.shape, values['h_threshold'], values['d_threshold'], params, regions
+    )
+
+
 class DotCounterApp:
     """
     Application for counting and analyzing blue nuclei and brown staining in biological images.
@@ -231,6 +266,23 @@ class DotCounterApp:
         self.save_btn = tk.Button(controls, text="Save Parameters", command=self.save_parameters, state=tk.DISABLED)
         self.save_btn.pack(side=tk.LEFT, padx=5)
         
+        self.tissue_var = tk.BooleanVar(value=TISSUE_DETECTION)
+        tk.Checkbutton(controls, text="Auto Tissue", variable=self.tissue_var,
+                       command=self.update_regions).pack(side=tk.LEFT, padx=5)
+        
+        self.clear_roi_btn = tk.Button(controls, text="Clear ROI", command=self.clear_roi, state=tk.DISABLED)
+        self.clear_roi_btn.pack(side=tk.LEFT, padx=5)
+        
+        self.zoom_btn = tk.Button(controls, text="Zoom View", command=self.open_zoom_view, state=tk.DISABLED)
+        self.zoom_btn.pack(side=tk.LEFT, padx=5)
+        self.viewer = None
+        
+        self.orig_canvas.bind("<ButtonPress-1>", self.start_roi)
+        self.orig_canvas.bind("<B1-Motion>", self.drag_roi)
+        self.orig_canvas.bind("<ButtonRelease-1>", self.end_roi)
+        self.roi = None
+        self.regions = None
+        
         param_frame = tk.Frame(main_frame)
         param_frame.pack(pady=5, fill=tk.X)
         
@@ -276,6 +328,9 @@ class DotCounterApp:
         
         self.root.bind('<Tab>', self.swap_focus)
         self.active_slider = None
+        self.speculation = SpeculativeSegmenter()
+        self.speculation_job = None
+        self.hed_cache = HEDCache() if HED_CACHE else None
         
         self.reset_parameters()
         
@@ -355,7 +410,10 @@ class DotCounterApp:
             self.slider_frames[which].config(highlightbackground="blue", highlightthickness=3)
             if force and which in self.sliders:
                 self.sliders[which].focus_set()
-            self.active_slider = which
+            if which != self.active_slider:
+                self.speculation.discard()
+                self.active_slider = which
+                self.schedule_speculation()
     
     def swap_focus(self, event):
         """
@@ -402,6 +460,7 @@ class DotCounterApp:
             return
         
         params = {name: slider.get() for name, slider in self.sliders.items()}
+        params['tissue_detection'] = bool(self.tissue_var.get())
         params['image_path'] = self.path
         
         try:
@@ -436,6 +495,9 @@ class DotCounterApp:
                 for name, value in params.items():
                     if name in self.sliders and name != 'image_path':
                         self.sliders[name].set(value)
+                if 'tissue_detection' in params:
+                    self.tissue_var.set(bool(params['tissue_detection']))
+                    self.regions = None
                 
                 self.update_dots(None)
                 return True
@@ -452,11 +514,31 @@ class DotCounterApp:
         path = filedialog.askopenfilename()
         if not path:
             return
+        pages = page_count(path)
+        if pages > 1:
+            page = simpledialog.askstring(
+                "Multi-page TIFF",
+                f"The file has {pages} pages. Enter the page to open (1-{pages}), "
+                f"or {' / '.join(PROJECTIONS)} for a projection of all pages:",
+                initialvalue="1", parent=self.root)
+            if page is None:
+                return
+            page = page.strip().lower()
+            if page not in PROJECTIONS and not (page.isdigit() and 1 <= int(page) <= pages):
+                messagebox.showerror("Error", f"Invalid page: {page}")
+                return
+            path = page_spec(path, page)
+        self.metrics = MetricsLog(os.path.join(os.path.dirname(path), METRICS_FILENAME)) if METRICS_ENABLED else None
+        orig = read_image(path)
+        if orig is None:
+            messagebox.showerror("Error", f"Could not read {path}")
+            return
         self.path = path
-        self.orig = cv2.imread(path)
-        img = Image.open(path)
-        
-        img.thumbnail((DISPLAY_MAX_WIDTH, DISPLAY_MAX_HEIGHT))
+        self.orig = orig
+        self.close_zoom_view()
+        if hasattr(self, 'detections'):
+            del self.detections
+        img = open_thumbnail(path, (DISPLAY_MAX_WIDTH, DISPLAY_MAX_HEIGHT))
         self.display = img
         dw, dh = img.size
         h, w = self.orig.shape[:2]
@@ -466,18 +548,19 @@ class DotCounterApp:
         self.orig_canvas.config(width=dw, height=dh)
         self.orig_canvas.delete("all")
         self.orig_canvas.create_image(dw//2, dh//2, image=self.orig_tkimg)
+        self.roi = None
+        self.regions = None
+        self.clear_roi_btn.config(state=tk.DISABLED)
         
-        self.tkimg = ImageTk.PhotoImage(img)
+        self.renderer = OverlayRenderer(img)
+        self.tkimg = self.renderer.photo_image()
         self.canvas.config(width=dw, height=dh)
         self.canvas.delete("all")
         self.canvas.create_image(dw//2, dh//2, image=self.tkimg)
         
-        rgb = cv2.cvtColor(self.orig, cv2.COLOR_BGR2RGB).astype(np.float64) / 255
-        hed = rgb2hed(rgb)
-        self.h_chan = hed[:, :, 0]
-        self.d_chan = hed[:, :, 2]
-        h_min, h_max = self.h_chan.min(), self.h_chan.max()
-        d_min, d_max = self.d_chan.min(), self.d_chan.max()
+        self.h_chan, self.d_chan, stats = self.stain_planes(path)
+        h_min, h_max = stats['h_min'], stats['h_max']
+        d_min, d_max = stats['d_min'], stats['d_max']
         
         self.sliders['h_threshold'].config(from_=h_min, to=h_max, resolution=(h_max - h_min) / 100, state=tk.NORMAL)
         self.sliders['d_threshold'].config(from_=d_min, to=d_max, resolution=(d_max - d_min) / 100, state=tk.NORMAL)
@@ -485,8 +568,8 @@ class DotCounterApp:
         for slider in self.sliders.values():
             slider.config(state=tk.NORMAL)
         
-        self.default_params['h_threshold'] = threshold_otsu(self.h_chan)
-        self.default_params['d_threshold'] = threshold_otsu(self.d_chan)
+        self.default_params['h_threshold'] = stats['h_otsu']
+        self.default_params['d_threshold'] = stats['d_otsu']
         
         self.reset_parameters()
         
@@ -495,9 +578,39 @@ class DotCounterApp:
         self.count_btn.config(state=tk.NORMAL)
         self.reset_btn.config(state=tk.NORMAL)
         self.save_btn.config(state=tk.NORMAL)
+        self.zoom_btn.config(state=tk.NORMAL)
         
         self.focus_slider('h_threshold', force=True)
 
+    def stain_planes(self, path):
+        """
+        Get the H and D planes of the loaded image with their ranges and Otsu thresholds.
+        Images opened before are memory mapped from the plane cache; new ones are
+        deconvolved and added to the cache in the background.
+        
+        Parameters:
+            path (str): Image path or page specification of self.orig
+            
+        Returns:
+            tuple: (H plane, D plane, dict of h_min, h_max, h_otsu, d_min, d_max, d_otsu)
+        """
+        key = self.hed_cache.key(path) if self.hed_cache is not None else None
+        cached = self.hed_cache.load(key) if key else None
+        if cached is not None:
+            return cached
+        
+        h_chan, d_chan = deconvolve(self.orig)
+        # One histogram per plane provides both the slider range and the default threshold
+        h_stats = channel_histogram([(h_chan, None)])
+        d_stats = channel_histogram([(d_chan, None)])
+        stats = {
+            'h_min': float(h_stats.min), 'h_max': float(h_stats.max), 'h_otsu': float(h_stats.otsu()),
+            'd_min': float(d_stats.min), 'd_max': float(d_stats.max), 'd_otsu': float(d_stats.otsu())
+        }
+        if key:
+            threading.Thread(target=self.hed_cache.store, args=(key, h_chan, d_chan, stats), daemon=True).start()
+        return h_chan, d_chan, stats
+
     def update_dots(self, val):
         """
         Update the image processing based on current slider values.
@@ -508,52 +621,189 @@ class DotCounterApp:
         if not hasattr(self, 'orig'):
             return
             
-        th_h = self.sliders['h_threshold'].get()
-        th_d = self.sliders['d_threshold'].get()
-        disk_size = int(self.sliders['disk_size'].get())
-        gaussian_sigma = self.sliders['gaussian_sigma'].get()
-        min_distance = int(self.sliders['min_distance'].get())
-        min_area_h = int(self.sliders['min_area_h'].get())
-        min_area_d = int(self.sliders['min_area_d'].get())
+        values = {name: self.sliders[name].get() for name in SEGMENTATION_SLIDERS}
         marker_radius = int(self.sliders['marker_radius'].get())
         
-        mask_h = opening(self.h_chan > th_h, disk(disk_size))
-        mask_d = opening(self.d_chan > th_d, disk(disk_size))
-        dt = ndi.distance_transform_edt(mask_h)
-        sm = ndi.gaussian_filter(dt, sigma=gaussian_sigma)
-        coords = peak_local_max(sm, min_distance=min_distance, labels=mask_h)
-        markers = np.zeros_like(dt, dtype=int)
-        if coords.size:
-            for i, (r, c) in enumerate(coords, start=1):
-                markers[r, c] = i
-        else:
-            r, c = np.unravel_index(np.argmax(sm), sm.shape)
-            markers[r, c] = 1
-        split = watershed(-sm, markers, mask=mask_h)
-        lbl_h = split
-        lbl_d = label(mask_d)
-        cents_h = [r.centroid for r in regionprops(lbl_h) if r.area > min_area_h]
-        cents_d = [r.centroid for r in regionprops(lbl_d) if r.area > min_area_d]
-        disp = np.array(self.display)
-        disp_bgr = cv2.cvtColor(disp, cv2.COLOR_RGB2BGR)
-        for y, x in cents_h:
-            dx, dy = int(x * self.sx), int(y * self.sy)
-            cv2.circle(disp_bgr, (dx, dy), marker_radius, (255, 0, 0), -1)
-        for y, x in cents_d:
-            dx, dy = int(x * self.sx), int(y * self.sy)
-            cv2.circle(disp_bgr, (dx, dy), marker_radius, (0, 0, 255), -1)
-        ann = cv2.cvtColor(disp_bgr, cv2.COLOR_BGR2RGB)
-        pil_ann = Image.fromarray(ann)
-        self.tkimg = ImageTk.PhotoImage(pil_ann)
-        self.canvas.config(width=pil_ann.width, height=pil_ann.height)
-        self.canvas.delete("all")
-        self.canvas.create_image(pil_ann.width//2, pil_ann.height//2, image=self.tkimg)
+        timer = StageTimer()
+        start = time.perf_counter()
+        cached_regions = self.regions is not None
+        with timer.stage('regions'):
+            regions = self.analysis_regions()
+        result = self.speculation.get(values)
+        speculated = result is not None
+        if result is None:
+            with timer.stage('segment'):
+                result = segment_values(self.h_chan, self.d_chan, values, regions)
+            self.speculation.put(values, result)
+        lbl_h, lbl_d, cents_h, cents_d = result
+        with timer.stage('render'):
+            self.renderer.render(display_points(cents_h, self.sx, self.sy),
+                                 display_points(cents_d, self.sx, self.sy), marker_radius)
+            self.renderer.update_photo()
+        self.detections = (lbl_h, lbl_d, cents_h, cents_d, marker_radius)
+        if self.viewer is not None:
+            self.viewer.set_overlays(*self.detections)
         bh = len(cents_h)
         bd = len(cents_d)
         tot = bh + bd
         pct = (bd / tot * 100) if tot else 0
-        self.label.config(text=f"Blue nuclei: {bh}\nBrown stained spots: {bd}\n% brown staining: {pct:.2f}%")
+        skipped = max(0.0, 1 - region_pixels(regions) / self.h_chan.size) * 100
+        if self.metrics is not None:
+            h, w = self.h_chan.shape
+            self.metrics.write(metrics_record(
+                'interactive', self.path, timer, (time.perf_counter() - start) * 1000,
+                {'image_size': (w, h), 'blue_count': bh, 'red_count': bd},
+                {'planes': True, 'regions': cached_regions, 'speculation': speculated}
+            ))
+        self.label.config(text=f"Blue nuclei: {bh}\nBrown stained spots: {bd}\n% brown staining: {pct:.2f}%"
+                               f"\nSkipped pixels: {skipped:.1f}%")
+        self.schedule_speculation()
+    
+    def schedule_speculation(self):
+        """
+        (Re)start the idle timer after which the neighbouring positions of the focused
+        slider are precomputed.
+        """
+        if not SPECULATION_ENABLED:
+            return
+        if self.speculation_job is not None:
+            self.root.after_cancel(self.speculation_job)
+        self.speculation_job = self.root.after(SPECULATION_IDLE_MS, self.speculate)
+    
+    def speculate(self):
+        """
+        Precompute, in the background, the results of the slider positions up to
+        SPECULATION_STEPS steps on either side of the focused slider's current value.
+        """
+        self.speculation_job = None
+        name = self.active_slider
+        if not hasattr(self, 'orig') or name not in SPECULATION_SLIDERS:
+            return
+        
+        slider = self.sliders[name]
+        values = {n: self.sliders[n].get() for n in SEGMENTATION_SLIDERS}
+        resolution = float(slider.cget('resolution'))
+        start, end = float(slider.cget('from')), float(slider.cget('to'))
+        # The slider moves on a grid of steps from its start and reports values formatted to a
+        # fixed number of decimals; candidates are built the same way so that they compare
+        # equal to the values reported after a move
+        decimals = len(str(slider.tk.call(slider, 'get')).partition('.')[2])
+        index = round((values[name] - start) / resolution)
+        last = int(round((end - start) / resolution))
+        
+        candidates = []
+        for step in range(1, SPECULATION_STEPS + 1):
+            for sign in (1, -1):
+                if 0 <= index + sign * step <= last:
+                    value = round(start + (index + sign * step) * resolution, decimals)
+                    value = int(value) if isinstance(values[name], int) else value
+                    candidates.append(dict(values, **{name: value}))
+        
+        regions = self.analysis_regions()
+        h_chan, d_chan = self.h_chan, self.d_chan
+        self.speculation.speculate(values, candidates,
+                                   lambda candidate: segment_values(h_chan, d_chan, candidate, regions))
+    
+    def analysis_regions(self):
+        """
+        Get the regions of the image to analyze, based on the ROI and tissue detection.
+        The result is cached until the ROI or the tissue detection setting changes.
+        
+        Returns:
+            list: Regions as (row slice, column slice, mask) tuples
+        """
+        if self.regions is None:
+            self.speculation.discard()
+            shape = self.h_chan.shape
+            region = rect_region(shape, *self.roi) if self.roi is not None else full_region(shape)
+            if self.tissue_var.get():
+                self.regions = tissue_regions(self.orig, bounds=region[:2])
+            else:
+                self.regions = [region]
+        return self.regions
+    
+    def update_regions(self):
+        """
+        Recompute the analyzed regions after the ROI or tissue detection setting changed.
+        """
+        self.regions = None
+        if hasattr(self, 'orig'):
+            self.update_dots(None)
+    
+    def start_roi(self, event):
+        """
+        Start drawing a region of interest on the original image.
+        
+        Parameters:
+            event: The mouse press event
+        """
+        if not hasattr(self, 'orig'):
+            return
+        self.roi_start = (event.x, event.y)
+        self.orig_canvas.delete("roi")
+    
+    def drag_roi(self, event):
+        """
+        Update the region of interest rectangle while the mouse is dragged.
+        
+        Parameters:
+            event: The mouse motion event
+        """
+        if not hasattr(self, 'roi_start'):
+            return
+        x0, y0 = self.roi_start
+        self.orig_canvas.delete("roi")
+        self.orig_canvas.create_rectangle(x0, y0, event.x, event.y, outline="yellow", width=2, tags="roi")
+    
+    def end_roi(self, event):
+        """
+        Finish the region of interest and re-run the detection inside it.
+        
+        Parameters:
+            event: The mouse release event
+        """
+        if not hasattr(self, 'roi_start'):
+            return
+        x0, y0 = self.roi_start
+        del self.roi_start
+        if abs(event.x - x0) < 3 or abs(event.y - y0) < 3:
+            return
+        self.roi = (min(y0, event.y) / self.sy, max(y0, event.y) / self.sy,
+                    min(x0, event.x) / self.sx, max(x0, event.x) / self.sx)
+        self.clear_roi_btn.config(state=tk.NORMAL)
+        self.update_regions()
+    
+    def clear_roi(self):
+        """
+        Remove the region of interest and analyze the whole image again.
+        """
+        self.roi = None
+        self.orig_canvas.delete("roi")
+        self.clear_roi_btn.config(state=tk.DISABLED)
+        self.update_regions()
 
+    def open_zoom_view(self):
+        """
+        Open a pan/zoom window showing the full resolution image and the current detections.
+        """
+        if not hasattr(self, 'orig'):
+            return
+        if self.viewer is not None:
+            self.viewer.window.destroy()
+        
+        self.viewer = ZoomViewer(self.root, self.orig, title=os.path.basename(self.path))
+        self.viewer.window.protocol("WM_DELETE_WINDOW", self.close_zoom_view)
+        if hasattr(self, 'detections'):
+            self.viewer.set_overlays(*self.detections)
+    
+    def close_zoom_view(self):
+        """
+        Close the zoom window.
+        """
+        if self.viewer is not None:
+            self.viewer.window.destroy()
+            self.viewer = None
+    
     def count_blobs(self):
         """
         Process the image and update the display with current parameters.
@@ -566,6 +816,7 @@ class DotCounterApp:
         """
         if self.manage_root:
             self.root.mainloop()
+            self.speculation.shutdown()
 
 
 if __name__ == "__main__":
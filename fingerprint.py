@@ -0,0 +1,169 @@
+import os
+import hashlib
+import numpy as np
+
+from config import DUPLICATE_HASH_SIZE, DUPLICATE_MAX_DISTANCE, FINGERPRINT_CHUNK_BYTES
+
+# Number of set bits of every byte value
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def file_digest(path, chunk_size=FINGERPRINT_CHUNK_BYTES):
+    """
+    Hash the bytes of a file.
+
+    Parameters:
+        path (str): File to hash
+        chunk_size (int): Bytes read at a time
+
+    Returns:
+        str: Hexadecimal BLAKE2b digest
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def partial_digest(path, size, chunk_size=FINGERPRINT_CHUNK_BYTES):
+    """
+    Hash the first and the last chunk of a file.
+    Files of up to two chunks are hashed completely.
+
+    Parameters:
+        path (str): File to hash
+        size (int): Size of the file in bytes
+        chunk_size (int): Bytes hashed at each end
+
+    Returns:
+        str: Hexadecimal BLAKE2b digest
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        digest.update(f.read(chunk_size))
+        if size > 2 * chunk_size:
+            f.seek(-chunk_size, os.SEEK_END)
+        digest.update(f.read(chunk_size))
+    return digest.hexdigest()
+
+
+def _groups(paths, key):
+    """
+    Group paths by a key, keeping their order. Paths whose key cannot be read are left out.
+
+    Parameters:
+        paths (list): Paths to group
+        key (callable): Function of a path raising OSError if the file cannot be read
+
+    Returns:
+        dict: Key to the list of paths sharing it
+    """
+    groups = {}
+    for path in paths:
+        try:
+            groups.setdefault(key(path), []).append(path)
+        except OSError:
+            continue
+    return groups
+
+
+def exact_duplicates(image_paths, chunk_size=FINGERPRINT_CHUNK_BYTES):
+    """
+    Find files with identical contents. Files that share their size with another file
+    are compared by their first and last chunk, and only files that still match are read
+    completely, so a folder without duplicates costs one stat per file plus two chunks
+    per file of a shared size.
+
+    Parameters:
+        image_paths (list): Image files, in processing order
+        chunk_size (int): Bytes compared at each end of a file before reading it completely
+
+    Returns:
+        dict: Path of every duplicate to the path of the first file with the same contents
+    """
+    duplicates = {}
+    for size, paths in _groups(image_paths, os.path.getsize).items():
+        if len(paths) < 2:
+            continue
+        for candidates in _groups(paths, lambda path: partial_digest(path, size, chunk_size)).values():
+            if len(candidates) < 2:
+                continue
+            if size > 2 * chunk_size:
+                same = _groups(candidates, lambda path: file_digest(path, chunk_size)).values()
+            else:
+                # The partial digest already covered the whole files
+                same = [candidates]
+            for group in same:
+                for path in group[1:]:
+                    duplicates[path] = group[0]
+    return duplicates
+
+
+def perceptual_hash(pil_img, size=DUPLICATE_HASH_SIZE):
+    """
+    Compute the difference hash of an image: the signs of the horizontal brightness
+    gradients of a size x size grayscale reduction. Re-encoding, rescaling and small
+    colour changes flip few bits; different fields differ in about half of them.
+
+    Parameters:
+        pil_img (PIL.Image.Image): Image, typically the result thumbnail
+        size (int): Hash side; the hash has size * size bits
+
+    Returns:
+        str: Hash as a hexadecimal string
+    """
+    from PIL import Image
+
+    gray = np.asarray(pil_img.convert('L').resize((size + 1, size), Image.BOX), dtype=np.int16)
+    return np.packbits(gray[:, 1:] > gray[:, :-1]).tobytes().hex()
+
+
+class NearDuplicateIndex:
+    """
+    Perceptual hashes of the images seen so far, searched by Hamming distance.
+    """
+
+    def __init__(self, max_distance=DUPLICATE_MAX_DISTANCE):
+        """
+        Parameters:
+            max_distance (int): Largest number of differing bits for two images to be near duplicates
+        """
+        self.max_distance = max_distance
+        self.hashes = None
+        self.keys = []
+        self.groups = []
+
+    def add(self, key, hash_hex, group=None):
+        """
+        Add an image and find the images added before that look the same.
+
+        Parameters:
+            key: Identifier of the image
+            hash_hex (str): Perceptual hash of the image
+            group: Images of the same group (e.g. exact duplicates) are not reported
+
+        Returns:
+            list: Keys of the earlier images within max_distance, nearest first
+        """
+        bits = np.frombuffer(bytes.fromhex(hash_hex), dtype=np.uint8)
+        n = len(self.keys)
+        matches = []
+        if n:
+            distances = POPCOUNT[self.hashes[:n] ^ bits].sum(axis=1, dtype=np.int32)
+            for i in np.argsort(distances, kind='stable'):
+                if distances[i] > self.max_distance:
+                    break
+                if group is None or self.groups[i] != group:
+                    matches.append(self.keys[i])
+
+        # Grow the hash table by doubling, so that adding n images copies O(n) hashes
+        if self.hashes is None or n == len(self.hashes):
+            grown = np.zeros((max(16, 2 * n), len(bits)), dtype=np.uint8)
+            if n:
+                grown[:n] = self.hashes[:n]
+            self.hashes = grown
+        self.hashes[n] = bits
+        self.keys.append(key)
+        self.groups.append(group)
+        return matches
@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import threading
+import numpy as np
+
+from config import HED_CACHE_DIR, HED_CACHE_MAX_MB
+from fingerprint import file_digest
+from stacks import split_page
+
+# Bumped whenever the deconvolution or the statistics change, so entries computed before are not reused
+CACHE_VERSION = 2
+
+# Temporary files older than this were left by a process that died while storing an entry
+STALE_TMP_SECONDS = 3600
+
+
+class HEDCache:
+    """
+    On-disk cache of the hematoxylin and DAB planes of images, with their slider ranges and
+    Otsu thresholds. Entries are keyed by the hash of the file contents, so renamed or copied
+    images hit the cache and edited ones do not. Planes are opened memory mapped, which makes
+    reopening a large image independent of its size. Every hit refreshes the modification time
+    of the entry; the least recently used entries are removed once the cache exceeds its cap.
+    """
+
+    def __init__(self, folder=HED_CACHE_DIR, max_bytes=HED_CACHE_MAX_MB * 2 ** 20):
+        """
+        Parameters:
+            folder (str): Cache folder (created on the first store)
+            max_bytes (int): Largest total size of the cached files
+        """
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+    def key(self, spec):
+        """
+        Get the cache key of an image.
+
+        Parameters:
+            spec (str): Image path or page specification
+
+        Returns:
+            str: Key made of the file hash and the page, or None if the file cannot be read
+        """
+        path, page = split_page(spec)
+        try:
+            digest = file_digest(path)
+        except OSError:
+            return None
+        return f"v{CACHE_VERSION}_{digest}" + (f"_{page}" if page is not None else "")
+
+    def _paths(self, key):
+        base = os.path.join(self.folder, key)
+        return f"{base}_h.npy", f"{base}_d.npy", f"{base}.json"
+
+    def load(self, key):
+        """
+        Open a cached entry.
+
+        Parameters:
+            key (str): Key returned by key()
+
+        Returns:
+            tuple: (read-only memory mapped H plane, D plane, statistics dict), or None on a miss
+        """
+        h_path, d_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                stats = json.load(f)
+            h_chan = np.load(h_path, mmap_mode='r')
+            d_chan = np.load(d_path, mmap_mode='r')
+            for path in (h_path, d_path, meta_path):
+                os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return h_chan, d_chan, stats
+
+    def store(self, key, h_chan, d_chan, stats):
+        """
+        Add an entry and evict the least recently used ones above the size cap.
+        Entries larger than the whole cache are not stored.
+
+        Parameters:
+            key (str): Key returned by key()
+            h_chan (numpy.ndarray): Hematoxylin plane
+            d_chan (numpy.ndarray): DAB plane
+            stats (dict): JSON-serializable statistics of the planes (ranges, thresholds)
+
+        Returns:
+            bool: Whether the entry was stored
+        """
+        if h_chan.nbytes + d_chan.nbytes > self.max_bytes:
+            return False
+        h_path, d_path, meta_path = self._paths(key)
+        with self.lock:
+            try:
+                os.makedirs(self.folder, exist_ok=True)
+                for path, plane in ((h_path, h_chan), (d_path, d_chan)):
+                    tmp_path = path + '.tmp.npy'
+                    np.save(tmp_path, plane)
+                    os.replace(tmp_path, path)
+                # The statistics are written last: an entry without them is incomplete and never loaded
+                tmp_path = meta_path + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(stats, f)
+                os.replace(tmp_path, meta_path)
+            except OSError:
+                return False
+            self.evict()
+        return True
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits its size cap.
+        Temporary files left by interrupted stores are removed once they are stale;
+        newer ones (another process may still be writing them) count towards the cap.
+        """
+        entries = {}
+        pending = 0
+        try:
+            names = os.listdir(self.folder)
+        except OSError:
+            return
+        now = time.time()
+        for name in names:
+            path = os.path.join(self.folder, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if '.tmp' in name:
+                if now - stat.st_mtime < STALE_TMP_SECONDS:
+                    pending += stat.st_size
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    pending += stat.st_size
+                continue
+            key = name[:-len('.json')] if name.endswith('.json') else name.rsplit('_', 1)[0]
+            size, used = entries.get(key, (0, 0))
+            entries[key] = (size + stat.st_size, max(used, stat.st_mtime))
+
+        total = pending + sum(size for size, _ in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k][1]):
+            if total <= self.max_bytes:
+                break
+            # The statistics go first, so a partly removed entry is never loaded
+            for path in reversed(self._paths(key)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    # Still mapped by an open image (Windows); it is removed on a later eviction
+                    break
+            else:
+                total -= entries[key][0]
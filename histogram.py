@@ -0,0 +1,149 @@
+import math
+import numpy as np
+from skimage.filters import threshold_otsu
+
+from config import STATS_BINS, STATS_CHUNK_PIXELS
+
+
+class ChannelHistogram:
+    """
+    Range and fixed-bin histogram of a stain plane, from which thresholds and slider ranges
+    are derived without further passes over the pixels.
+
+    Error bounds:
+        Without subsampling the histogram uses the exact value range and the bins of
+        skimage.filters.threshold_otsu, so otsu() returns the same threshold. Like any
+        histogram-based Otsu, that threshold is a bin center and may differ from the
+        optimum over the raw values by at most one bin width, (max - min) / bins.
+        With subsampling, every cumulative bin share of the sample is within
+        cdf_error() of the share over all pixels (Dvoretzky-Kiefer-Wolfowitz bound at
+        99% confidence, treating the regular grid sample as random), and min/max are
+        those of the sampled pixels.
+    """
+
+    def __init__(self, counts, edges, vmin, vmax, sampled, total):
+        """
+        Parameters:
+            counts (numpy.ndarray): Pixels per bin
+            edges (numpy.ndarray): Bin edges (len(counts) + 1 values)
+            vmin, vmax: Smallest and largest value seen
+            sampled (int): Number of pixels in the histogram
+            total (int): Number of pixels the statistics stand for
+        """
+        self.counts = counts
+        self.edges = edges
+        self.min = vmin
+        self.max = vmax
+        self.sampled = sampled
+        self.total = total
+
+    @property
+    def centers(self):
+        return (self.edges[:-1] + self.edges[1:]) / 2.0
+
+    @property
+    def bin_width(self):
+        return float(self.max - self.min) / len(self.counts) if len(self.counts) else 0.0
+
+    def otsu(self):
+        """
+        Compute the Otsu threshold from the histogram.
+
+        Returns:
+            float: Threshold (0.0 if no pixels were seen)
+        """
+        if not self.sampled:
+            return 0.0
+        if self.min == self.max:
+            return self.min
+        return threshold_otsu(hist=(self.counts, self.centers))
+
+    def percentile(self, q):
+        """
+        Estimate a percentile by interpolating inside the histogram bins.
+
+        Parameters:
+            q (float): Percentile between 0 and 100
+
+        Returns:
+            float: Value below which q percent of the pixels lie
+        """
+        if not self.sampled:
+            return 0.0
+        cumulative = np.concatenate(([0], np.cumsum(self.counts)))
+        return float(np.interp(q / 100 * cumulative[-1], cumulative, self.edges))
+
+    def cdf_error(self, confidence=0.99):
+        """
+        Bound on the error of the cumulative bin shares caused by subsampling.
+
+        Parameters:
+            confidence (float): Confidence level of the bound
+
+        Returns:
+            float: Maximum absolute error of any cumulative share (0.0 without subsampling)
+        """
+        if self.sampled >= self.total or not self.sampled:
+            return 0.0
+        return math.sqrt(math.log(2 / (1 - confidence)) / (2 * self.sampled))
+
+
+def _row_chunks(plane, mask):
+    """
+    Yield the values of a plane in blocks of rows, restricted to the mask if given.
+    """
+    rows = max(1, STATS_CHUNK_PIXELS // max(1, plane.shape[1]))
+    for y in range(0, plane.shape[0], rows):
+        chunk = plane[y:y + rows]
+        yield chunk[mask[y:y + rows]] if mask is not None else chunk
+
+
+def channel_histogram(parts, bins=STATS_BINS, sample_pixels=None):
+    """
+    Compute the range and histogram of a stain plane made of one or more parts.
+    The values are visited once for the range and once for the histogram, block by block,
+    without concatenating or copying the planes.
+
+    Parameters:
+        parts (list): (plane, mask) pairs; mask is a boolean array of the plane's shape or None
+        bins (int): Number of histogram bins
+        sample_pixels (int): If given, sample a regular grid of about this many pixels
+
+    Returns:
+        ChannelHistogram: Statistics of the plane
+    """
+    total = sum(int(mask.sum()) if mask is not None else plane.size for plane, mask in parts)
+    size = sum(plane.size for plane, _ in parts)
+    step = 1
+    if sample_pixels and size > sample_pixels:
+        step = max(1, int(math.ceil(math.sqrt(size / sample_pixels))))
+    if step > 1:
+        parts = [(plane[::step, ::step], mask[::step, ::step] if mask is not None else None)
+                 for plane, mask in parts]
+
+    vmin = vmax = None
+    sampled = 0
+    for plane, mask in parts:
+        for values in _row_chunks(plane, mask):
+            if not values.size:
+                continue
+            sampled += values.size
+            lo, hi = values.min(), values.max()
+            vmin = lo if vmin is None or lo < vmin else vmin
+            vmax = hi if vmax is None or hi > vmax else vmax
+
+    if not sampled:
+        return ChannelHistogram(np.zeros(bins, dtype=np.intp), np.zeros(bins + 1), 0.0, 0.0, 0, total)
+
+    counts = np.zeros(bins, dtype=np.intp)
+    if vmin == vmax:
+        counts[0] = sampled
+        return ChannelHistogram(counts, np.full(bins + 1, vmin), vmin, vmax, sampled, total if step > 1 else sampled)
+
+    edges = None
+    for plane, mask in parts:
+        for values in _row_chunks(plane, mask):
+            if values.size:
+                part_counts, edges = np.histogram(values, bins=bins, range=(vmin, vmax))
+                counts += part_counts
+    return ChannelHistogram(counts, edges, vmin, vmax, sampled, total if step > 1 else sampled)
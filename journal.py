@@ -0,0 +1,152 @@
+import json
+import os
+
+from stacks import split_page
+
+
+class RunJournal:
+    """
+    Append-only journal for bulk processing runs.
+    Every finished image is written as a single JSON line together with the parameters
+    that produced it, so an interrupted run can be resumed without reprocessing the
+    images that already completed.
+    """
+
+    def __init__(self, path):
+        """
+        Initialize a journal backed by the given file.
+
+        Parameters:
+            path (str): Location of the journal file (created on first write)
+        """
+        self.path = path
+        self._file = None
+
+    @staticmethod
+    def file_signature(image_path):
+        """
+        Build a signature used to detect whether an image changed since it was journaled.
+
+        Parameters:
+            image_path (str): Path to the image file or page specification
+
+        Returns:
+            dict: Absolute path, size in bytes and modification time of the file
+        """
+        st = os.stat(split_page(image_path)[0])
+        return {
+            'path': os.path.abspath(image_path),
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns
+        }
+
+    def entries(self):
+        """
+        Read all complete records from the journal.
+        A partially written trailing line (e.g. after a crash) is ignored.
+
+        Returns:
+            list: Journal records in the order they were written
+        """
+        if not os.path.exists(self.path):
+            return []
+
+        records = []
+        with open(self.path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+        return records
+
+    def completed(self, params):
+        """
+        Find images that were already processed with the given parameters.
+
+        Parameters:
+            params (dict): Parameters of the run that is about to start
+
+        Returns:
+            dict: Mapping of absolute image path to its journal record
+        """
+        params = json.loads(json.dumps(params))
+        done = {}
+        for record in self.entries():
+            if record.get('type') != 'image' or record.get('params') != params:
+                continue
+            signature = record.get('signature', {})
+            path = signature.get('path')
+            try:
+                if path and self.file_signature(path) == signature:
+                    done[path] = record
+            except OSError:
+                continue
+        return done
+
+    def discard(self, params, image_paths=None):
+        """
+        Remove the records made with the given parameters, keeping those of other parameter sets.
+        Called when a run finishes, so a complete run is not offered for resuming, and when
+        the user declines to resume.
+
+        Parameters:
+            params (dict): Parameters whose records are removed
+            image_paths (list): Only remove the records of these images (all images if None)
+        """
+        self.close()
+        if not os.path.exists(self.path):
+            return
+        params = json.loads(json.dumps(params))
+        paths = None if image_paths is None else {os.path.abspath(p) for p in image_paths}
+        kept = [record for record in self.entries()
+                if record.get('params') != params
+                or (paths is not None and record.get('signature', {}).get('path') not in paths)]
+        if not kept:
+            os.remove(self.path)
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for record in kept:
+                f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def record(self, image_path, params, result):
+        """
+        Append the result of a finished image and flush it to disk.
+
+        Parameters:
+            image_path (str): Path to the processed image
+            params (dict): Parameters used to process the image
+            result (dict): JSON-serializable result values
+        """
+        if self._file is None:
+            self._file = open(self.path, 'a+')
+            self._file.seek(0, os.SEEK_END)
+            if self._file.tell() > 0:
+                self._file.seek(self._file.tell() - 1)
+                if self._file.read(1) != '\n':
+                    self._file.write('\n')
+
+        entry = {
+            'type': 'image',
+            'signature': self.file_signature(image_path),
+            'params': params,
+            'result': result
+        }
+        self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        """
+        Close the underlying journal file if it is open.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,143 @@
+import os
+import numpy as np
+
+ENCODE_CHUNK_ROWS = 512
+
+
+class RunLengthLabels:
+    """
+    Label image stored as runs of equal, non-zero labels along the image rows.
+    Object areas and centroids are computed from the runs without decoding the image,
+    which makes re-filtering objects by area immediate.
+    """
+
+    def __init__(self, shape, starts, lengths, values):
+        """
+        Parameters:
+            shape (tuple): (height, width) of the label image
+            starts (numpy.ndarray): Flat index of the first pixel of every run
+            lengths (numpy.ndarray): Number of pixels of every run
+            values (numpy.ndarray): Label of every run
+        """
+        self.shape = tuple(int(v) for v in shape)
+        self.starts = starts
+        self.lengths = lengths
+        self.values = values
+        self._stats = None
+
+    @classmethod
+    def encode(cls, lbl):
+        """
+        Encode a label image. Runs never cross the end of a row.
+
+        Parameters:
+            lbl (numpy.ndarray): 2D label image (0 = background)
+
+        Returns:
+            RunLengthLabels: Encoded labels
+        """
+        h, w = lbl.shape
+        index_dtype = np.uint32 if lbl.size < 2 ** 32 else np.uint64
+        starts, lengths, values = [], [], []
+        for y0 in range(0, h, ENCODE_CHUNK_ROWS):
+            chunk = lbl[y0:y0 + ENCODE_CHUNK_ROWS]
+            change = np.ones(chunk.shape, dtype=bool)
+            change[:, 1:] = chunk[:, 1:] != chunk[:, :-1]
+            idx = np.flatnonzero(change)
+            run_values = chunk.ravel()[idx]
+            run_lengths = np.diff(np.append(idx, chunk.size))
+            keep = run_values != 0
+            starts.append((idx[keep] + y0 * w).astype(index_dtype))
+            lengths.append(run_lengths[keep].astype(np.uint32))
+            values.append(run_values[keep].astype(np.int32))
+        if not starts:
+            return cls(lbl.shape, np.zeros(0, index_dtype), np.zeros(0, np.uint32), np.zeros(0, np.int32))
+        return cls(lbl.shape, np.concatenate(starts), np.concatenate(lengths), np.concatenate(values))
+
+    def decode(self):
+        """
+        Rebuild the label image.
+
+        Returns:
+            numpy.ndarray: int32 label image
+        """
+        out = np.zeros(self.shape[0] * self.shape[1], dtype=np.int32)
+        if len(self.starts):
+            lengths = self.lengths.astype(np.intp)
+            offsets = self.starts.astype(np.intp) - (np.cumsum(lengths) - lengths)
+            out[np.arange(lengths.sum()) + np.repeat(offsets, lengths)] = np.repeat(self.values, lengths)
+        return out.reshape(self.shape)
+
+    def object_stats(self):
+        """
+        Compute the area and centroid of every object from the runs.
+
+        Returns:
+            tuple: (labels, areas, rows, cols) arrays with one entry per object, in label order
+        """
+        if self._stats is None:
+            w = self.shape[1]
+            starts = self.starts.astype(np.int64)
+            lengths = self.lengths.astype(np.float64)
+            rows, first_cols = np.divmod(starts, w)
+            n = int(self.values.max()) + 1 if len(self.values) else 1
+            areas = np.bincount(self.values, weights=lengths, minlength=n)
+            sum_rows = np.bincount(self.values, weights=lengths * rows, minlength=n)
+            sum_cols = np.bincount(self.values, weights=lengths * first_cols + lengths * (lengths - 1) / 2,
+                                   minlength=n)
+            present = np.flatnonzero(areas[1:]) + 1
+            areas = areas[present]
+            self._stats = (present, areas.astype(np.int64), sum_rows[present] / areas, sum_cols[present] / areas)
+        return self._stats
+
+    def centroids(self, min_area):
+        """
+        Get the centroids of the objects that pass an area filter, as the pipeline reports them.
+
+        Parameters:
+            min_area (int): Objects need more pixels than this to be kept
+
+        Returns:
+            numpy.ndarray: (N, 2) array of (row, col) centroids
+        """
+        _, areas, rows, cols = self.object_stats()
+        keep = areas > min_area
+        return np.column_stack((rows[keep], cols[keep]))
+
+
+def save_labels(path, lbl_h, lbl_d):
+    """
+    Save the nucleus and brown spot label images of an image in run-length form.
+
+    Parameters:
+        path (str): Output .npz file (its folder is created if needed)
+        lbl_h (numpy.ndarray): Nucleus label image
+        lbl_d (numpy.ndarray): Brown spot label image
+    """
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    arrays = {'shape': np.asarray(lbl_h.shape, dtype=np.int64)}
+    for prefix, lbl in (('h', lbl_h), ('d', lbl_d)):
+        runs = RunLengthLabels.encode(lbl)
+        arrays.update({f'{prefix}_starts': runs.starts, f'{prefix}_lengths': runs.lengths,
+                       f'{prefix}_values': runs.values})
+    tmp_path = path + '.tmp.npz'
+    np.savez_compressed(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_labels(path):
+    """
+    Load label images saved by save_labels.
+
+    Parameters:
+        path (str): .npz file
+
+    Returns:
+        tuple: (nucleus labels, brown spot labels) as RunLengthLabels
+    """
+    with np.load(path) as data:
+        shape = tuple(data['shape'])
+        return tuple(RunLengthLabels(shape, data[f'{p}_starts'], data[f'{p}_lengths'], data[f'{p}_values'])
+                     for p in ('h', 'd'))
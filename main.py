@@ -3,17 +3,14 @@ from tkinter import filedialog, messagebox, ttk
 import os
 import sys
 import json
-import cv2
-import numpy as np
-from PIL import Image, ImageTk
+import time
+import hashlib
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from PIL import ImageTk
 import pandas as pd
-from skimage.color import rgb2hed
-from skimage.morphology import opening, disk
-from skimage.measure import label, regionprops
-from skimage.feature import peak_local_max
-from skimage.segmentation import watershed
-from skimage.filters import threshold_otsu
-from scipy import ndimage as ndi
 
 try:
     from config import *
@@ -75,6 +72,23 @@ except ImportError:
         print("Error: Could not load dotStuff.py. Make sure it's in the same directory as this script.")
         sys.exit(1)
 
+from journal import RunJournal
+from calibration import calibrate, save_calibration, load_calibration, apply_calibration
+from analysis import (
+    processing_params, measure_image, estimate_memory, export_row, count_summary, deconvolve, object_measurements
+)
+from overlay import OverlayRenderer, display_points
+from labels import load_labels
+from objects import ObjectWriter, summary_results, image_info
+from metrics import StageTimer, MetricsLog, metrics_record
+from fingerprint import exact_duplicates, perceptual_hash, NearDuplicateIndex
+from spatial import spatial_statistics
+from density import export_maps
+from annotate import AnnotationWriter
+from stacks import STACK_MODES, read_image, open_thumbnail, expand_pages, image_size
+from scheduler import AdmissionScheduler, measure_task
+from viewer import ZoomViewer
+
 class MainApp:
     """
     Main application class that serves as the entry point for the Image Analysis Tool.
@@ -194,9 +208,71 @@ class BulkProcessorApp:
         self.selection_label = ttk.Label(selection_frame, text="No files selected")
         self.selection_label.pack(side=tk.LEFT, padx=10)
         
-        ttk.Button(selection_frame, text="Process Images", command=self.process_images, width=15).pack(side=tk.LEFT, padx=15)
+        self.process_btn = ttk.Button(selection_frame, text="Process Images", command=self.process_images, width=15)
+        self.process_btn.pack(side=tk.LEFT, padx=15)
+        self.cancel_btn = ttk.Button(selection_frame, text="Cancel", command=self.cancel_processing, width=10, state=tk.DISABLED)
+        self.cancel_btn.pack(side=tk.LEFT, padx=5)
         ttk.Button(selection_frame, text="Export Results", command=self.export_results, width=15).pack(side=tk.LEFT, padx=5)
         
+        options_frame = ttk.Frame(controls_frame)
+        options_frame.pack(pady=5, fill=tk.X)
+        
+        self.tissue_var = tk.BooleanVar(value=TISSUE_DETECTION)
+        ttk.Checkbutton(options_frame, text="Skip background (tissue detection)", variable=self.tissue_var,
+                        command=self.update_options).pack(side=tk.LEFT, padx=5)
+        
+        self.pyramid_var = tk.BooleanVar(value=PYRAMID_ANALYSIS)
+        ttk.Checkbutton(options_frame, text="Multi-resolution analysis", variable=self.pyramid_var,
+                        command=self.update_options).pack(side=tk.LEFT, padx=5)
+        
+        self.low_memory_var = tk.BooleanVar(value=LOW_MEMORY)
+        ttk.Checkbutton(options_frame, text="Low-memory mode, budget (MB):", variable=self.low_memory_var,
+                        command=self.update_options).pack(side=tk.LEFT, padx=5)
+        self.budget_var = tk.StringVar(value=str(MEMORY_BUDGET_MB))
+        ttk.Spinbox(options_frame, from_=128, to=65536, increment=128, textvariable=self.budget_var,
+                    width=8, command=self.update_options).pack(side=tk.LEFT)
+        
+        ttk.Label(options_frame, text="Multi-page TIFFs:").pack(side=tk.LEFT, padx=(15, 5))
+        self.stack_var = tk.StringVar(value=STACK_MODE)
+        ttk.Combobox(options_frame, textvariable=self.stack_var, values=list(STACK_MODES),
+                     state="readonly", width=12).pack(side=tk.LEFT)
+        
+        annotate_frame = ttk.Frame(controls_frame)
+        annotate_frame.pack(pady=5, fill=tk.X)
+        
+        self.annotate_var = tk.BooleanVar(value=ANNOTATED_EXPORT)
+        ttk.Checkbutton(annotate_frame, text="Write full resolution annotated images as:",
+                        variable=self.annotate_var).pack(side=tk.LEFT, padx=5)
+        self.annotate_format_var = tk.StringVar(value=ANNOTATED_FORMAT)
+        ttk.Combobox(annotate_frame, textvariable=self.annotate_format_var, values=list(ANNOTATED_FORMATS),
+                     state="readonly", width=5).pack(side=tk.LEFT)
+        ttk.Label(annotate_frame, text="Compression (0-9):").pack(side=tk.LEFT, padx=(15, 5))
+        self.annotate_level_var = tk.StringVar(value=str(ANNOTATED_COMPRESSION))
+        ttk.Spinbox(annotate_frame, from_=0, to=9, increment=1, textvariable=self.annotate_level_var,
+                    width=3).pack(side=tk.LEFT)
+        
+        calibration_frame = ttk.Frame(controls_frame)
+        calibration_frame.pack(pady=5, fill=tk.X)
+        
+        self.calibrate_btn = ttk.Button(calibration_frame, text="Calibrate Thresholds", command=self.calibrate_thresholds, width=20)
+        self.calibrate_btn.pack(side=tk.LEFT, padx=5)
+        ttk.Button(calibration_frame, text="Load Calibration", command=self.load_calibration_file, width=18).pack(side=tk.LEFT, padx=5)
+        ttk.Button(calibration_frame, text="Clear Calibration", command=self.clear_calibration, width=18).pack(side=tk.LEFT, padx=5)
+        self.calibration_label = ttk.Label(calibration_frame, text="No calibration (thresholds from parameters)")
+        self.calibration_label.pack(side=tk.LEFT, padx=10)
+        
+        review_frame = ttk.Frame(controls_frame)
+        review_frame.pack(pady=5, fill=tk.X)
+        
+        self.area_vars = {}
+        for name in ('min_area_h', 'min_area_d'):
+            ttk.Label(review_frame, text=f"{PARAM_NAMES[name]}:").pack(side=tk.LEFT, padx=5)
+            self.area_vars[name] = tk.StringVar(value=str(PARAM_RANGES[name]['default']))
+            ttk.Spinbox(review_frame, from_=PARAM_RANGES[name]['min'], to=PARAM_RANGES[name]['max'],
+                        increment=PARAM_RANGES[name]['step'], textvariable=self.area_vars[name],
+                        width=5).pack(side=tk.LEFT)
+        ttk.Button(review_frame, text="Apply Area Filters", command=self.apply_area_filters, width=18).pack(side=tk.LEFT, padx=10)
+        
         search_frame = ttk.Frame(controls_frame)
         search_frame.pack(pady=5, fill=tk.X)
         
@@ -236,8 +312,24 @@ class BulkProcessorApp:
         status_bar.pack(side=tk.BOTTOM, fill=tk.X)
         
         self.load_parameters()
+        self.tissue_var.set(bool(self.params.get('tissue_detection', TISSUE_DETECTION)))
+        self.pyramid_var.set(bool(self.params.get('pyramid_analysis', PYRAMID_ANALYSIS)))
+        self.low_memory_var.set(bool(self.params.get('low_memory', LOW_MEMORY)))
+        self.budget_var.set(str(self.params.get('memory_budget_mb', MEMORY_BUDGET_MB)))
+        for name, var in self.area_vars.items():
+            var.set(str(self.params.get(name, PARAM_RANGES[name]['default'])))
         
         self.results = []
+        self.calibration = None
+        self.calibration_progress = None
+        self.label_cache = {}
+        self.objects_dataset = None
+        self.near_duplicates = NearDuplicateIndex()
+        
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.result_queue = queue.Queue()
+        self.cancel_event = None
+        self.run_id = 0
         
         self.all_image_files = []
         self.image_files = []
@@ -366,128 +458,677 @@ class BulkProcessorApp:
                               if k not in ['image_path', 'h_threshold', 'd_threshold']])
         self.status_var.set(f"Using parameters: {params_str}")
     
-    def process_image(self, image_path):
+    def update_options(self):
+        """
+        Copy the processing options chosen in the window into the run parameters.
+        """
+        self.params['tissue_detection'] = bool(self.tissue_var.get())
+        self.params['pyramid_analysis'] = bool(self.pyramid_var.get())
+        self.params['low_memory'] = bool(self.low_memory_var.get())
+        try:
+            self.params['memory_budget_mb'] = max(1, int(float(self.budget_var.get())))
+        except ValueError:
+            self.params['memory_budget_mb'] = MEMORY_BUDGET_MB
+    
+    def calibrate_thresholds(self):
+        """
+        Compute batch thresholds from a sample of the selected images in the background,
+        save them to a calibration file and use them for the following runs.
+        """
+        if self.cancel_event is not None or self.calibration_progress is not None:
+            return
+        
+        if not self.image_files:
+            messagebox.showerror("Error", "No images selected. Please select a folder or individual files.")
+            return
+        
+        folder = os.path.commonpath([os.path.dirname(os.path.abspath(f)) for f in self.image_files])
+        path = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            initialdir=folder,
+            initialfile=CALIBRATION_FILENAME,
+            filetypes=[("JSON files", "*.json"), ("All files", "*.*")],
+            title="Save Calibration"
+        )
+        if not path:
+            return
+        
+        self.update_options()
+        params = {k: v for k, v in self.params.items() if k != 'image_path'}
+        self.calibration_progress = (0, min(len(self.image_files), CALIBRATION_SAMPLE_IMAGES or len(self.image_files)))
+        self.process_btn.config(state=tk.DISABLED)
+        self.calibrate_btn.config(state=tk.DISABLED)
+        
+        def report(done, total):
+            self.calibration_progress = (done, total)
+        
+        future = self.executor.submit(calibrate, list(self.image_files), params, progress=report)
+        self.master.after(100, lambda: self._poll_calibration(future, path))
+    
+    def _poll_calibration(self, future, path):
+        """
+        Wait for a background calibration and store its result.
+        
+        Parameters:
+            future (concurrent.futures.Future): Running calibration
+            path (str): Calibration file to write
+        """
+        try:
+            if not self.master.winfo_exists():
+                return
+        except tk.TclError:
+            return
+        
+        if not future.done():
+            done, total = self.calibration_progress
+            self.status_var.set(f"Calibrating thresholds: sampled {done} of {total} image(s)...")
+            self.master.after(100, lambda: self._poll_calibration(future, path))
+            return
+        
+        self.calibration_progress = None
+        self.process_btn.config(state=tk.NORMAL)
+        self.calibrate_btn.config(state=tk.NORMAL)
+        try:
+            calibration = future.result()
+            if not calibration['images']:
+                raise ValueError("None of the sampled images could be read")
+            save_calibration(path, calibration)
+        except Exception as e:
+            messagebox.showerror("Error", f"Calibration failed: {str(e)}")
+            self.status_var.set("Calibration failed")
+            return
+        self.set_calibration(calibration, path)
+    
+    def load_calibration_file(self):
+        """
+        Use the thresholds of a previously saved calibration file.
+        """
+        path = filedialog.askopenfilename(
+            filetypes=[("JSON files", "*.json"), ("All files", "*.*")],
+            title="Load Calibration"
+        )
+        if not path:
+            return
+        try:
+            self.set_calibration(load_calibration(path), path)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Error", f"Could not load calibration: {str(e)}")
+    
+    def set_calibration(self, calibration, path):
+        """
+        Make a calibration active and show it.
+        
+        Parameters:
+            calibration (dict): Calibration with batch thresholds
+            path (str): File the calibration was read from or saved to
+        """
+        self.calibration = calibration
+        text = (f"Calibration: {os.path.basename(path)} (H {calibration['h_threshold']:.4f}, "
+                f"D {calibration['d_threshold']:.4f}, {len(calibration.get('images', []))} image(s) sampled)")
+        self.calibration_label.config(text=text)
+        self.status_var.set(f"Using calibrated thresholds from {path}")
+    
+    def clear_calibration(self):
+        """
+        Go back to the thresholds of the parameters file.
+        """
+        self.calibration = None
+        self.calibration_label.config(text="No calibration (thresholds from parameters)")
+        self.status_var.set("Calibration cleared")
+    
+    def process_image(self, image_path, params=None, labels_dir=None, measure_objects=False, timer=None,
+                      density_dir=None, annotations=None):
         """
         Process a single image and return the results.
         
         Parameters:
             image_path (str): Path to the image file
+            params (dict): Parameters to use (defaults to the loaded parameters)
+            labels_dir (str): Folder receiving the label images (not saved if None)
+            measure_objects (bool): Add the per-object measurement tables to the result
+            timer (StageTimer): Optional timer receiving the processing stages
+            density_dir (str): Folder receiving the density map (not saved if None)
+            annotations (AnnotationWriter): Writer of full resolution annotated images (optional)
             
         Returns:
             dict: Dictionary containing processing results or None if processing failed
         """
-        img = cv2.imread(image_path)
+        params = self.params if params is None else params
+        labels_path = self.labels_path(labels_dir, image_path, params) if labels_dir else None
+        density_path = self.labels_path(density_dir, image_path, params) if density_dir else None
+        params = processing_params(params)
+        
+        timer = timer or StageTimer()
+        result = measure_image(image_path, params, labels_path=labels_path, measure_objects=measure_objects,
+                               timer=timer, density_path=density_path)
+        return self.finish_result(image_path, result, params, timer, annotations)
+    
+    def finish_result(self, image_path, result, params, timer, annotations=None):
+        """
+        Add the thumbnail, detection markers and perceptual hash to a measured image.
+        
+        Parameters:
+            image_path (str): Path to the image file
+            result (dict): Result of measure_image (None if the image could not be read)
+            params (dict): Normalized parameters used for the image
+            timer (StageTimer): Timer receiving the 'thumbnail' stage
+            annotations (AnnotationWriter): Writer of full resolution annotated images (optional)
+            
+        Returns:
+            dict: Dictionary containing processing results or None if processing failed
+        """
+        if result is None:
+            return None
+        cents_h, cents_d = result.pop('cents_h'), result.pop('cents_d')
+        img_w, img_h = result['image_size']
+        result['image_size'] = [img_w, img_h]
+        result['image_path'] = os.path.abspath(image_path)
+        if annotations is not None:
+            # Only waits here when the writers are max_pending images behind
+            with timer.stage('annotate'):
+                annotated = annotations.submit(image_path, cents_h, cents_d, result.get('labels_file'))
+            if annotated:
+                result['annotated_file'] = annotated
+        
+        with timer.stage('thumbnail'):
+            pil_img = open_thumbnail(image_path, (300, 300))
+            
+            w, h = pil_img.size
+            sx, sy = w / img_w, h / img_h
+            
+            markers_h = display_points(cents_h, sx, sy).tolist()
+            markers_d = display_points(cents_d, sx, sy).tolist()
+            pil_ann = self.annotate_thumbnail(pil_img, markers_h, markers_d, params['marker_radius'])
+            dhash = perceptual_hash(pil_img)
+        
+        result.update({
+            'orig_img': pil_img,
+            'ann_img': pil_ann,
+            'markers_h': markers_h,
+            'markers_d': markers_d,
+            'dhash': dhash
+        })
+        return result
+    
+    def duplicate_result(self, image_path, result):
+        """
+        Build the result of an image whose file is identical to an image already processed.
+        
+        Parameters:
+            image_path (str): Path to the duplicate image file
+            result (dict): Result of the identical image
+            
+        Returns:
+            dict: Copy of the result under the duplicate's name, without the annotated
+                  image, which was written for the original only
+        """
+        result = dict(result, filename=os.path.basename(image_path), image_path=os.path.abspath(image_path))
+        result.pop('annotated_file', None)
+        return result
+    
+    def restore_objects(self, image_path, result, params):
+        """
+        Measure the objects of an image restored from the journal, using its saved labels
+        instead of segmenting it again.
+        
+        Parameters:
+            image_path (str): Path to the image file
+            result (dict): Restored result dictionary
+            params (dict): Normalized parameters of the run
+            
+        Returns:
+            tuple: (nucleus table, brown spot table), or None if the labels are not available
+        """
+        labels = self.result_labels(result)
+        img = read_image(image_path) if labels is not None else None
         if img is None:
             return None
+        h_chan, d_chan = deconvolve(img, params['low_memory'])
+        del img
+        return (object_measurements(labels[0].decode(), h_chan, d_chan),
+                object_measurements(labels[1].decode(), h_chan, d_chan))
+    
+    def labels_path(self, labels_dir, image_path, params):
+        """
+        Get the file the label images (or the density map) of an image are saved to.
+        The name depends on the image and on the parameters, so runs with different
+        parameters do not overwrite each other.
         
-        pil_img = Image.open(image_path)
-        pil_img.thumbnail((300, 300))
+        Parameters:
+            labels_dir (str): Folder of the label (or density map) files
+            image_path (str): Path to the image file
+            params (dict): Raw parameters of the run
+            
+        Returns:
+            str: Path of the .npz label file
+        """
+        key = json.dumps([os.path.abspath(image_path), params], sort_keys=True)
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+        name = os.path.splitext(os.path.basename(image_path))[0]
+        return os.path.join(labels_dir, f"{name}_{digest}.npz")
+    
+    def annotate_thumbnail(self, pil_img, markers_h, markers_d, marker_radius):
+        """
+        Draw detection markers on a thumbnail.
         
-        disk_size = int(self.params.get('disk_size', DISK_SIZE))
-        gaussian_sigma = float(self.params.get('gaussian_sigma', GAUSSIAN_SIGMA))
-        min_distance = int(self.params.get('min_distance', MIN_DISTANCE))
-        min_area_h = int(self.params.get('min_area_h', MIN_AREA_H))
-        min_area_d = int(self.params.get('min_area_d', MIN_AREA_D))
-        marker_radius = int(self.params.get('marker_radius', MARKER_RADIUS))
+        Parameters:
+            pil_img (PIL.Image): Thumbnail of the original image
+            markers_h (list): [x, y] thumbnail positions of blue nuclei
+            markers_d (list): [x, y] thumbnail positions of brown spots
+            marker_radius (int): Radius of the drawn markers
+            
+        Returns:
+            PIL.Image: Annotated copy of the thumbnail
+        """
+        return OverlayRenderer(pil_img).render(markers_h, markers_d, marker_radius).convert('RGB')
+    
+    def run_parameters(self):
+        """
+        Get the parameters that determine the results of a bulk run.
+        The thresholds of an active calibration replace those of the parameters file.
         
-        rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB).astype(np.float64) / 255
-        hed = rgb2hed(rgb)
-        h_chan = hed[:, :, 0]
-        d_chan = hed[:, :, 2]
+        Returns:
+            dict: Processing parameters without editor-only entries
+        """
+        return apply_calibration({k: v for k, v in self.params.items() if k != 'image_path'}, self.calibration)
+    
+    def journal_path(self):
+        """
+        Get the location of the run journal for the current selection.
+        The journal lives in the folder that contains the selected images.
         
-        if 'h_threshold' in self.params and self.params['h_threshold'] is not None:
-            th_h = float(self.params['h_threshold'])
-        else:
-            th_h = threshold_otsu(h_chan)
+        Returns:
+            str: Path to the journal file
+        """
+        folder = os.path.commonpath([os.path.dirname(os.path.abspath(f)) for f in self.image_files])
+        return os.path.join(folder, JOURNAL_FILENAME)
+    
+    def restore_result(self, image_path, record):
+        """
+        Rebuild a result dictionary from a journal record without reprocessing the image.
+        
+        Parameters:
+            image_path (str): Path to the image file
+            record (dict): Journal record of the finished image
             
-        if 'd_threshold' in self.params and self.params['d_threshold'] is not None:
-            th_d = float(self.params['d_threshold'])
-        else:
-            th_d = threshold_otsu(d_chan)
-        
-        mask_h = opening(h_chan > th_h, disk(disk_size))
-        mask_d = opening(d_chan > th_d, disk(disk_size))
-        dt = ndi.distance_transform_edt(mask_h)
-        sm = ndi.gaussian_filter(dt, sigma=gaussian_sigma)
-        coords = peak_local_max(sm, min_distance=min_distance, labels=mask_h)
-        markers = np.zeros_like(dt, dtype=int)
-        if coords.size:
-            for i, (r, c) in enumerate(coords, start=1):
-                markers[r, c] = i
-        else:
-            r, c = np.unravel_index(np.argmax(sm), sm.shape)
-            markers[r, c] = 1
-        split = watershed(-sm, markers, mask=mask_h)
-        lbl_h = split
-        lbl_d = label(mask_d)
-        cents_h = [r.centroid for r in regionprops(lbl_h) if r.area > min_area_h]
-        cents_d = [r.centroid for r in regionprops(lbl_d) if r.area > min_area_d]
-        
-        disp = np.array(pil_img)
-        disp_bgr = cv2.cvtColor(disp, cv2.COLOR_RGB2BGR)
-        h, w = disp.shape[:2]
-        img_h, img_w = img.shape[:2]
-        sx, sy = w / img_w, h / img_h
-        
-        for y, x in cents_h:
-            dx, dy = int(x * sx), int(y * sy)
-            cv2.circle(disp_bgr, (dx, dy), marker_radius, (255, 0, 0), -1)
-        for y, x in cents_d:
-            dx, dy = int(x * sx), int(y * sy)
-            cv2.circle(disp_bgr, (dx, dy), marker_radius, (0, 0, 255), -1)
-        
-        ann = cv2.cvtColor(disp_bgr, cv2.COLOR_BGR2RGB)
-        pil_ann = Image.fromarray(ann)
-        
-        num_blue = len(cents_h)
-        num_red = len(cents_d)
-        total = num_blue + num_red
-        pct_red_of_total = (num_red / total * 100) if total > 0 else 0
-        red_to_blue_ratio = (num_red / num_blue) if num_blue > 0 else float('inf')
-        pct_blue_of_total = (num_blue / total * 100) if total > 0 else 0
-        red_as_pct_of_blue = (num_red / num_blue * 100) if num_blue > 0 else float('inf')
-        
-        return {
-            'filename': os.path.basename(image_path),
-            'orig_img': pil_img,
-            'ann_img': pil_ann,
-            'blue_count': num_blue,
-            'red_count': num_red,
-            'total_count': total,
-            'pct_red_of_total': pct_red_of_total,
-            'red_blue_ratio': red_to_blue_ratio,
-            'pct_blue_of_total': pct_blue_of_total,
-            'red_as_pct_of_blue': red_as_pct_of_blue
-        }
+        Returns:
+            dict: Result dictionary equivalent to the one returned by process_image
+        """
+        result = dict(record['result'])
+        marker_radius = int(record['params'].get('marker_radius', MARKER_RADIUS))
+        
+        pil_img = open_thumbnail(image_path, (300, 300))
+        result['orig_img'] = pil_img
+        result['ann_img'] = self.annotate_thumbnail(pil_img, result['markers_h'], result['markers_d'], marker_radius)
+        if 'dhash' not in result:
+            result['dhash'] = perceptual_hash(pil_img)
+        return result
     
     def process_images(self):
         """
-        Process all selected images.
-        Updates the results display with the processing results.
+        Process all selected images in the background.
+        Results are added to the display as they arrive while the window stays responsive.
         """
+        if self.cancel_event is not None:
+            return
+        
         if not self.image_files:
             messagebox.showerror("Error", "No images selected. Please select a folder or individual files.")
             return
         
+        self.update_options()
+        params = self.run_parameters()
+        image_files = expand_pages(self.image_files, self.stack_var.get())
+        journal = RunJournal(self.journal_path())
+        completed = journal.completed(params)
+        completed = {os.path.abspath(f): completed[os.path.abspath(f)] for f in image_files
+                     if os.path.abspath(f) in completed}
+        
+        if completed:
+            answer = messagebox.askyesnocancel(
+                "Resume",
+                f"{len(completed)} of {len(image_files)} image(s) were already processed with the "
+                f"current parameters in an interrupted run.\n\nResume and skip them?"
+            )
+            if answer is None:
+                return
+            if not answer:
+                journal.discard(params, image_files)
+                completed = {}
+        
         for widget in self.scrollable_frame.winfo_children():
             widget.destroy()
         
         self.results = []
+        self.label_cache = {}
+        self.near_duplicates = NearDuplicateIndex()
+        
+        self.run_id += 1
+        self.cancel_event = threading.Event()
+        self.run_state = {
+            'total': len(image_files),
+            'done': 0,
+            'processed': 0,
+            'resumed': len(completed),
+            'remaining': len(image_files) - len(completed),
+            'failed': 0,
+            'annotation_failed': 0,
+            'start': time.monotonic()
+        }
         
-        if not self.image_files:
-            messagebox.showinfo("Info", "No image files found in the selection")
+        self.process_btn.config(state=tk.DISABLED)
+        self.cancel_btn.config(state=tk.NORMAL)
+        self.status_var.set(f"Processing {len(image_files)} image(s)...")
+        
+        folder = os.path.dirname(journal.path)
+        labels_dir = os.path.join(folder, LABELS_DIRNAME) if SAVE_LABELS else None
+        density_dir = os.path.join(folder, DENSITY_DIRNAME) if DENSITY_MAPS else None
+        objects = None
+        self.objects_dataset = None
+        if EXPORT_OBJECTS:
+            run_name = f"{time.strftime('%Y%m%d-%H%M%S')}-{self.run_id}"
+            objects = ObjectWriter(os.path.join(folder, OBJECTS_DIRNAME, run_name))
+            self.objects_dataset = objects.path
+        metrics = MetricsLog(os.path.join(folder, METRICS_FILENAME)) if METRICS_ENABLED else None
+        annotations = None
+        if self.annotate_var.get():
+            try:
+                level = int(self.annotate_level_var.get())
+            except ValueError:
+                level = ANNOTATED_COMPRESSION
+            annotations = AnnotationWriter(os.path.join(folder, ANNOTATED_DIRNAME), self.annotate_format_var.get(),
+                                           level, cancel_event=self.cancel_event)
+        self.executor.submit(self._run_batch, self.run_id, image_files, params, journal, completed,
+                             self.cancel_event, labels_dir, objects, metrics, density_dir, annotations)
+        self.master.after(100, self._poll_results)
+    
+    def _run_batch(self, run_id, image_files, params, journal, completed, cancel_event, labels_dir=None,
+                   objects=None, metrics=None, density_dir=None, annotations=None):
+        """
+        Worker loop of a bulk run, executed on the background executor.
+        Only finished images are journaled and reported; an image that is in progress
+        when the run is cancelled is discarded. Once every image has been handled, the
+        journal records of the run are removed, so only interrupted runs are offered for
+        resuming. Files identical to an earlier file of the run reuse its result instead
+        of being segmented again. With several worker processes, images are measured largest
+        first within the memory budget (see AdmissionScheduler) and journaled as soon as they
+        finish, but reported in listing order.
+        
+        Parameters:
+            run_id (int): Identifier of the run the results belong to
+            image_files (list): Paths of the images to process, in display order
+            params (dict): Parameters used for processing
+            journal (RunJournal): Journal receiving every finished image
+            completed (dict): Journal records of images that can be restored
+            cancel_event (threading.Event): Set when the user cancels the run
+            labels_dir (str): Folder receiving the label images of processed images
+            objects (ObjectWriter): Dataset receiving the objects of every finished image
+            metrics (MetricsLog): Log receiving the metrics record of every finished image
+            density_dir (str): Folder receiving the density maps of processed images
+            annotations (AnnotationWriter): Writer of the full resolution annotated images of processed images
+        """
+        run_params = processing_params(params)
+        pool = computed = None
+        try:
+            pending = [p for p in image_files if os.path.abspath(p) not in completed]
+            duplicates = exact_duplicates(pending) if DUPLICATE_DETECTION else {}
+            sources = set(duplicates.values())
+            originals = {}
+            fresh = {p for p in pending if p not in duplicates}
+            paths = [p for p in image_files if p in fresh]
+            if BULK_WORKERS > 1 and len(fresh) > 1:
+                # Spawned rather than forked, so workers do not inherit the Tk process state
+                pool = ProcessPoolExecutor(max_workers=BULK_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+                jobs = []
+                for img_path in paths:
+                    size = image_size(img_path)
+                    jobs.append((estimate_memory(size, run_params) if size else None, measure_task,
+                                 (img_path, run_params,
+                                  self.labels_path(labels_dir, img_path, params) if labels_dir else None,
+                                  objects is not None,
+                                  self.labels_path(density_dir, img_path, params) if density_dir else None)))
+                scheduler = AdmissionScheduler(pool, BULK_WORKERS, BULK_MEMORY_MB * 2 ** 20)
+                computed = scheduler.run(jobs, cancel_event)
+            
+            def settle(img_path, future=None):
+                # Journal an image and write its objects and metrics as soon as it is measured;
+                # returns its results queue message, or None once the run is cancelled
+                record = completed.get(os.path.abspath(img_path))
+                original = duplicates.get(img_path)
+                reused = record is None and original in originals
+                error = None
+                timer = StageTimer()
+                start = time.perf_counter()
+                try:
+                    if record is not None:
+                        result = self.restore_result(img_path, record)
+                    elif reused:
+                        result = self.duplicate_result(img_path, originals[original][0])
+                    elif future is not None:
+                        measured, stages = future.result()
+                        timer.stages.update(stages)
+                        result = self.finish_result(img_path, measured, run_params, timer, annotations)
+                    else:
+                        result = self.process_image(img_path, params, labels_dir, objects is not None, timer,
+                                                    density_dir, annotations)
+                    tables = (result.pop('objects_h', None), result.pop('objects_d', None)) if result else None
+                    if reused:
+                        tables = originals[original][1]
+                    elif result and objects is not None and tables[0] is None:
+                        tables = self.restore_objects(img_path, result, run_params)
+                except Exception as e:
+                    result, error = None, str(e)
+                
+                if cancel_event.is_set():
+                    return None
+                
+                if result:
+                    result.pop('duplicate_of', None)
+                    if original:
+                        result['duplicate_of'] = os.path.basename(original)
+                    if img_path in sources:
+                        # Copy before the display adds its own entries to the result
+                        originals[img_path] = (dict(result), tables)
+                if result and record is None:
+                    journal.record(img_path, params, {k: v for k, v in result.items() 
+                                                      if k not in ('orig_img', 'ann_img')})
+                if result and objects is not None and tables is not None:
+                    objects.append(image_info(result, run_params), *tables)
+                if metrics is not None:
+                    metrics.write(metrics_record('bulk', img_path, timer, (time.perf_counter() - start) * 1000,
+                                                 result, {'journal': record is not None, 'duplicate': reused},
+                                                 error=error))
+                return ('image', run_id, img_path, result, record is not None, error)
+            
+            settled = {}
+            for img_path in image_files:
+                if cancel_event.is_set():
+                    break
+                if computed is not None and img_path in fresh:
+                    # Images that finish before this one are settled while it is still running
+                    # and reported once their turn in the listing comes
+                    while img_path not in settled:
+                        job = next(computed, None)
+                        if job is None:
+                            break
+                        index, future = job
+                        settled[paths[index]] = settle(paths[index], future)
+                    message = settled.pop(img_path, None)
+                else:
+                    message = settle(img_path)
+                if message is None:
+                    break
+                self.result_queue.put(message)
+            
+            if not cancel_event.is_set():
+                # The run is complete: nothing is left to resume
+                journal.discard(params, image_files)
+        finally:
+            if computed is not None:
+                computed.close()
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+            journal.close()
+            if objects is not None:
+                objects.close()
+            if annotations is not None:
+                annotations.close(cancel=cancel_event.is_set())
+                for img_path, error in annotations.errors.items():
+                    self.result_queue.put(('annotation', run_id, img_path, None, False, error))
+            self.result_queue.put(('finished', run_id, None, None, False, None))
+    
+    def _poll_results(self):
+        """
+        Drain results produced by the background run and update the display.
+        Re-schedules itself with after() until the run has finished.
+        """
+        try:
+            if not self.master.winfo_exists():
+                self.cancel_processing()
+                return
+        except tk.TclError:
+            self.cancel_processing()
             return
         
-        for i, img_path in enumerate(self.image_files):
-            self.status_var.set(f"Processing image {i+1} of {len(self.image_files)}: {os.path.basename(img_path)}")
-            self.master.update()
+        finished = False
+        while True:
+            try:
+                kind, run_id, img_path, result, restored, error = self.result_queue.get_nowait()
+            except queue.Empty:
+                break
+            
+            if run_id != self.run_id:
+                continue
+            if kind == 'finished':
+                finished = True
+                break
             
-            result = self.process_image(img_path)
+            state = self.run_state
+            if kind == 'annotation':
+                state['annotation_failed'] += 1
+                continue
+            state['done'] += 1
+            if not restored:
+                state['processed'] += 1
+                state['remaining'] -= 1
+            if error or not result:
+                state['failed'] += 1
             if result:
+                self.flag_near_duplicates(result)
                 self.results.append(result)
                 self.add_result_row(result)
         
-        self.status_var.set(f"Processed {len(self.results)} images")
+        if self.cancel_event is None:
+            return
+        
+        if finished:
+            self._finish_run()
+            return
+        
+        self.status_var.set(self._progress_text())
+        self.master.after(100, self._poll_results)
+    
+    def flag_near_duplicates(self, result):
+        """
+        Compare a new result with the earlier results of the run and flag the images that
+        look the same (e.g. a JPEG and a TIFF export of the same field) on both sides.
+        Exact duplicates are reported as such and not flagged again.
+        
+        Parameters:
+            result (dict): Result about to be added to self.results
+        """
+        if not DUPLICATE_DETECTION or not result.get('dhash'):
+            return
+        group = result.get('duplicate_of') or result['filename']
+        similar = self.near_duplicates.add(len(self.results), result['dhash'], group)
+        result['similar_to'] = [self.results[i]['filename'] for i in similar]
+        for i in similar:
+            other = self.results[i]
+            other.setdefault('similar_to', []).append(result['filename'])
+            if other.get('flags_var') is not None:
+                other['flags_var'].set(self.duplicate_text(other))
+    
+    def duplicate_text(self, result):
+        """
+        Describe the duplicates of an image for its results row.
+        
+        Parameters:
+            result (dict): Processing result dictionary for a single image
+            
+        Returns:
+            str: Text shown below the statistics (empty without duplicates)
+        """
+        lines = []
+        if result.get('duplicate_of'):
+            lines.append(f"Identical to {result['duplicate_of']}")
+        if result.get('similar_to'):
+            lines.append(f"Looks like {', '.join(result['similar_to'])}")
+        return "\n".join(lines)
+    
+    def _progress_text(self):
+        """
+        Build the status bar text with progress, throughput and ETA.
+        
+        Returns:
+            str: Status message for the running batch
+        """
+        state = self.run_state
+        elapsed = time.monotonic() - state['start']
+        rate = state['processed'] / elapsed if elapsed > 0 else 0
+        
+        text = f"Processed {state['done']} of {state['total']} image(s)"
+        if rate > 0:
+            eta = state['remaining'] / rate
+            minutes, seconds = divmod(int(eta), 60)
+            text += f" | {rate:.2f} images/sec | ETA {minutes:d}:{seconds:02d}"
+        return text + self._failure_text()
+    
+    def _failure_text(self):
+        """
+        Describe the images of the run that failed.
+        
+        Returns:
+            str: Suffix for the status bar text (empty without failures)
+        """
+        state = self.run_state
+        parts = []
+        if state['failed']:
+            parts.append(f"{state['failed']} failed")
+        if state['annotation_failed']:
+            parts.append(f"{state['annotation_failed']} annotated image(s) not written")
+        return f" | {', '.join(parts)}" if parts else ""
+    
+    def _finish_run(self):
+        """
+        Restore the controls and report the outcome once a run has ended.
+        """
+        cancelled = self.cancel_event.is_set()
+        self.cancel_event = None
+        self.process_btn.config(state=tk.NORMAL)
+        self.cancel_btn.config(state=tk.DISABLED)
+        
+        resumed = self.run_state['resumed']
+        resumed = f" ({resumed} resumed from journal)" if resumed else ""
+        elapsed = time.monotonic() - self.run_state['start']
+        if cancelled:
+            text = f"Cancelled after {len(self.results)} of {self.run_state['total']} images{resumed}"
+        else:
+            text = f"Processed {len(self.results)} images in {elapsed:.1f}s{resumed}"
+        self.status_var.set(text + self._failure_text())
+    
+    def cancel_processing(self):
+        """
+        Cancel the running batch.
+        The image in progress is discarded and the controls are released immediately.
+        """
+        if self.cancel_event is None:
+            return
+        self.cancel_event.set()
+        self.run_id += 1
+        try:
+            self._finish_run()
+        except tk.TclError:
+            self.cancel_event = None
     
     def add_result_row(self, result):
         """
@@ -532,13 +1173,111 @@ class BulkProcessorApp:
             f"Red:Blue ratio: {result['red_blue_ratio']:.2f}\n"
             f"Red as % of Blue: {result['red_as_pct_of_blue']:.2f}%\n"
             f"% Red of total: {result['pct_red_of_total']:.2f}%\n"
-            f"% Blue of total: {result['pct_blue_of_total']:.2f}%"
+            f"% Blue of total: {result['pct_blue_of_total']:.2f}%\n"
+            f"Background skipped: {result['skipped_fraction'] * 100:.1f}%"
         )
+        if result.get('peak_memory_mb') is not None:
+            stats_text += f"\nPeak memory: {result['peak_memory_mb']:.0f} MB"
         
         ttk.Label(stats_frame, text=stats_text, justify=tk.LEFT).pack(padx=10, pady=10)
+        result['flags_var'] = tk.StringVar(value=self.duplicate_text(result))
+        ttk.Label(stats_frame, textvariable=result['flags_var'], foreground="red",
+                  justify=tk.LEFT).pack(padx=10, pady=(0, 10))
+        if result.get('labels_file'):
+            ttk.Button(stats_frame, text="Review", command=lambda: self.review_result(result)).pack(padx=10, pady=(0, 10))
         
         ttk.Separator(self.scrollable_frame, orient='horizontal').pack(fill=tk.X, pady=5)
     
+    def result_labels(self, result):
+        """
+        Load the saved label images of a result.
+        
+        Parameters:
+            result (dict): Processing result dictionary for a single image
+            
+        Returns:
+            tuple: (nucleus labels, brown spot labels) as RunLengthLabels, or None if
+                   no label file was saved
+        """
+        path = result.get('labels_file')
+        if not path or 'image_size' not in result:
+            return None
+        if path not in self.label_cache:
+            if not os.path.exists(path):
+                return None
+            self.label_cache[path] = load_labels(path)
+        return self.label_cache[path]
+    
+    def apply_area_filters(self):
+        """
+        Recount all results with new minimum object sizes.
+        Objects are filtered from the saved label images, so no image is segmented again.
+        """
+        if self.cancel_event is not None:
+            self.status_var.set("Area filters can be applied once the run has finished")
+            return
+        try:
+            min_areas = {name: int(float(var.get())) for name, var in self.area_vars.items()}
+        except ValueError:
+            messagebox.showerror("Error", "Minimum sizes must be numbers")
+            return
+        
+        marker_radius = int(self.params.get('marker_radius', MARKER_RADIUS))
+        params = processing_params(self.params)
+        updated = 0
+        for result in self.results:
+            labels = self.result_labels(result)
+            if labels is None:
+                continue
+            cents_h = labels[0].centroids(min_areas['min_area_h'])
+            cents_d = labels[1].centroids(min_areas['min_area_d'])
+            
+            img_w, img_h = result['image_size']
+            w, h = result['orig_img'].size
+            result['markers_h'] = display_points(cents_h, w / img_w, h / img_h).tolist()
+            result['markers_d'] = display_points(cents_d, w / img_w, h / img_h).tolist()
+            result.update(count_summary(len(cents_h), len(cents_d)))
+            result.update(spatial_statistics(cents_h, cents_d, params['neighbour_radius']))
+            result['ann_img'] = self.annotate_thumbnail(result['orig_img'], result['markers_h'],
+                                                        result['markers_d'], marker_radius)
+            updated += 1
+        
+        # DAB positivity needs the nucleus intensities, which the objects dataset keeps
+        if self.objects_dataset:
+            derived = summary_results(self.objects_dataset, min_areas['min_area_h'], min_areas['min_area_d'])
+            if [r['filename'] for r in derived] == [r['filename'] for r in self.results]:
+                for derived_result, result in zip(derived, self.results):
+                    result.update({k: v for k, v in derived_result.items() if k.startswith('dab_')
+                                   or k in ('pct_dab_positive', 'h_score', 'mean_nuclear_dab')})
+        
+        self.params.update(min_areas)
+        for widget in self.scrollable_frame.winfo_children():
+            widget.destroy()
+        for result in self.results:
+            self.add_result_row(result)
+        
+        missing = len(self.results) - updated
+        missing = f" ({missing} without saved labels unchanged)" if missing else ""
+        self.status_var.set(f"Area filters applied to {updated} image(s){missing}")
+    
+    def review_result(self, result):
+        """
+        Open the saved detections of a result in the zoom viewer.
+        
+        Parameters:
+            result (dict): Processing result dictionary for a single image
+        """
+        labels = self.result_labels(result)
+        img = read_image(result.get('image_path', ''))
+        if labels is None or img is None:
+            messagebox.showerror("Error", f"The image or labels of {result['filename']} are no longer available")
+            return
+        params = processing_params(self.params)
+        viewer = ZoomViewer(self.master, img, title=f"Review - {result['filename']}")
+        viewer.set_overlays(labels[0].decode(), labels[1].decode(),
+                            labels[0].centroids(params['min_area_h']), labels[1].centroids(params['min_area_d']),
+                            params['marker_radius'])
+    
     def export_results(self):
         """
         Export results to a CSV file.
@@ -557,23 +1296,21 @@ class BulkProcessorApp:
         if not file_path:
             return
         
-        data = []
-        for result in self.results:
-            data.append({
-                'Filename': result['filename'],
-                'Blue nuclei count': result['blue_count'],
-                'Red stain count': result['red_count'],
-                'Total count': result['total_count'],
-                'Red:Blue ratio': result['red_blue_ratio'],
-                'Red as % of Blue': result['red_as_pct_of_blue'],
-                '% Red of total': result['pct_red_of_total'],
-                '% Blue of total': result['pct_blue_of_total']
-            })
-        
-        df = pd.DataFrame(data)
+        results = self.results
+        if self.objects_dataset:
+            derived = summary_results(self.objects_dataset, int(self.params.get('min_area_h', MIN_AREA_H)),
+                                      int(self.params.get('min_area_d', MIN_AREA_D)))
+            if [r['filename'] for r in derived] == [r['filename'] for r in self.results]:
+                for derived_result, result in zip(derived, self.results):
+                    derived_result.update({k: result[k] for k in ('duplicate_of', 'similar_to') if k in result})
+                results = derived
+        
+        df = pd.DataFrame([export_row(result) for result in results])
         df.to_csv(file_path, index=False)
+        maps = export_maps(self.results, file_path)
         
-        self.status_var.set(f"Results exported to {file_path}")
+        maps = f" with density maps of {maps} image(s)" if maps else ""
+        self.status_var.set(f"Results exported to {file_path}{maps}")
 
 if __name__ == "__main__":
     root = tk.Tk()
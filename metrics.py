@@ -0,0 +1,266 @@
+import os
+import sys
+import json
+import time
+import glob
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+from config import METRICS_SLOWEST, METRICS_INTERVAL_SECONDS
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class StageTimer:
+    """
+    Wall-clock time spent in the named stages of processing one image.
+    Time spent in a stage that is entered more than once (e.g. per tile) is added up.
+    """
+
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+
+def peak_rss_mb():
+    """
+    Get the peak resident memory of the current process.
+
+    Returns:
+        float: Peak RSS in MB, or None where the resource module is not available (Windows)
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 1024
+
+
+def metrics_record(source, image_path, timer, total_ms, result=None, cache=None, **extra):
+    """
+    Build the metrics record of one processed image.
+
+    Parameters:
+        source (str): Processing path that produced the record ('bulk', 'interactive', 'worker', 'service')
+        image_path (str): Path of the image (or the name of an upload)
+        timer (StageTimer): Stage timings of the image (None if nothing was timed)
+        total_ms (float): Wall-clock time for the whole image
+        result (dict): Result dictionary providing image_size, counts and traced peak memory
+        cache (dict): Cache name to True/False for the caches consulted
+        **extra: Further values to record
+
+    Returns:
+        dict: JSON-serializable record
+    """
+    result = result or {}
+    record = {
+        'time': round(time.time(), 3),
+        'source': source,
+        'filename': os.path.basename(image_path),
+        'path': os.path.abspath(image_path) if os.path.exists(image_path) else image_path,
+        'file_bytes': os.path.getsize(image_path) if os.path.isfile(image_path) else None,
+        'width': None,
+        'height': None,
+        'megapixels': None,
+        'stages_ms': {name: round(ms, 2) for name, ms in (timer.stages.items() if timer else ())},
+        'total_ms': round(total_ms, 2),
+        'blue_count': result.get('blue_count'),
+        'red_count': result.get('red_count'),
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_traced_mb': result.get('peak_memory_mb'),
+        'cache': cache or {}
+    }
+    if result.get('image_size'):
+        width, height = result['image_size']
+        record.update({'width': int(width), 'height': int(height), 'megapixels': width * height / 1e6})
+    record.update(extra)
+    return record
+
+
+class MetricsLog:
+    """
+    Append-only JSON lines file of metrics records.
+    Each record is written with a single append, so threads and processes can share a log.
+    """
+
+    def __init__(self, path):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record) + '\n'
+        with self.lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+
+
+def read_records(paths):
+    """
+    Read metrics records from log files and folders of logs.
+    Incomplete lines, e.g. from a process that was killed while writing, are skipped.
+
+    Parameters:
+        paths (list): .jsonl files and folders containing them
+
+    Returns:
+        list: Records sorted by time
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '**', '*.jsonl'), recursive=True)))
+        else:
+            files.append(path)
+
+    records = []
+    for path in files:
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(record, dict) and 'total_ms' in record:
+                    records.append(record)
+    records.sort(key=lambda record: record.get('time', 0))
+    return records
+
+
+def _percentiles(values):
+    values = np.asarray([v for v in values if v is not None], dtype=np.float64)
+    if not len(values):
+        return None
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'p50': p50, 'p95': p95, 'p99': p99, 'max': values.max(), 'count': len(values)}
+
+
+def summarize(records, slowest=METRICS_SLOWEST, interval=METRICS_INTERVAL_SECONDS):
+    """
+    Aggregate metrics records into a run report.
+
+    Parameters:
+        records (list): Records as returned by read_records
+        slowest (int): Number of slowest images to list
+        interval (float): Width in seconds of the throughput buckets
+
+    Returns:
+        dict: Latency and stage percentiles, memory percentiles, cache hit rates,
+              throughput per interval and the slowest images
+    """
+    if not records:
+        return {'records': 0}
+
+    stages = {}
+    for record in records:
+        for name, ms in record.get('stages_ms', {}).items():
+            stages.setdefault(name, []).append(ms)
+
+    cache = {}
+    for record in records:
+        for name, hit in record.get('cache', {}).items():
+            hits, total = cache.get(name, (0, 0))
+            cache[name] = (hits + bool(hit), total + 1)
+
+    times = np.asarray([record.get('time', 0) for record in records], dtype=np.float64)
+    start = times.min()
+    buckets = np.bincount(((times - start) // interval).astype(np.intp))
+    throughput = [(start + i * interval, int(n), n * 60.0 / interval) for i, n in enumerate(buckets)]
+
+    megapixels = sum(record.get('megapixels') or 0 for record in records)
+    busy_seconds = sum(record['total_ms'] for record in records) / 1000
+    return {
+        'records': len(records),
+        'start': start,
+        'end': times.max(),
+        'sources': sorted({record.get('source') for record in records}),
+        'total_ms': _percentiles(record['total_ms'] for record in records),
+        'ms_per_megapixel': _percentiles(record['total_ms'] / record['megapixels'] for record in records
+                                         if record.get('megapixels')),
+        'stages_ms': {name: _percentiles(values) for name, values in stages.items()},
+        'peak_rss_mb': _percentiles(record.get('peak_rss_mb') for record in records),
+        'peak_traced_mb': _percentiles(record.get('peak_traced_mb') for record in records),
+        'cache': cache,
+        'megapixels_per_second': megapixels / busy_seconds if busy_seconds else None,
+        'throughput': throughput,
+        'slowest': sorted(records, key=lambda record: record['total_ms'], reverse=True)[:slowest]
+    }
+
+
+def format_report(summary):
+    """
+    Format a run report as text.
+
+    Parameters:
+        summary (dict): Report as returned by summarize
+
+    Returns:
+        str: Report
+    """
+    if not summary['records']:
+        return "No metrics records"
+
+    def stamp(t):
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t))
+
+    def row(label, stats, unit):
+        if stats is None:
+            return f"{label:<22} -"
+        return (f"{label:<22} p50 {stats['p50']:9.1f}  p95 {stats['p95']:9.1f}  p99 {stats['p99']:9.1f}  "
+                f"max {stats['max']:9.1f} {unit}")
+
+    lines = [f"{summary['records']} record(s) from {stamp(summary['start'])} to {stamp(summary['end'])} "
+             f"({', '.join(str(source) for source in summary['sources'])})", ""]
+    lines.append(row("Per image", summary['total_ms'], "ms"))
+    lines.append(row("Per megapixel", summary['ms_per_megapixel'], "ms"))
+    for name, stats in summary['stages_ms'].items():
+        lines.append(row(f"  {name}", stats, "ms"))
+    lines.append(row("Peak RSS", summary['peak_rss_mb'], "MB"))
+    lines.append(row("Peak traced", summary['peak_traced_mb'], "MB"))
+    for name, (hits, total) in summary['cache'].items():
+        lines.append(f"Cache {name:<16} {hits} of {total} hit(s) ({hits / total * 100:.1f}%)")
+    if summary['megapixels_per_second']:
+        lines.append(f"Processing rate        {summary['megapixels_per_second']:.2f} megapixels/s")
+
+    lines += ["", "Throughput:"]
+    for t, count, per_minute in summary['throughput']:
+        lines.append(f"  {stamp(t)}  {count:6d} image(s)  {per_minute:8.1f}/min")
+
+    lines += ["", f"Slowest {len(summary['slowest'])}:"]
+    for record in summary['slowest']:
+        size = f"{record['width']}x{record['height']}" if record.get('width') else "?"
+        lines.append(f"  {record['total_ms']:10.1f} ms  {size:>11}  {record.get('source')}  {record.get('path')}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Aggregate per-image metrics logs into a run report")
+    parser.add_argument('logs', nargs='+', help="Metrics log files or folders containing them")
+    parser.add_argument('--source', help="Only use records of this processing path (bulk, interactive, ...)")
+    parser.add_argument('--since', type=float, default=None, help="Only use records of the last N hours")
+    parser.add_argument('--slowest', type=int, default=METRICS_SLOWEST, help="Number of slowest images to list")
+    parser.add_argument('--interval', type=float, default=METRICS_INTERVAL_SECONDS,
+                        help="Throughput bucket width in seconds")
+    args = parser.parse_args()
+
+    records = read_records(args.logs)
+    if args.source:
+        records = [record for record in records if record.get('source') == args.source]
+    if args.since is not None:
+        records = [record for record in records if record.get('time', 0) >= time.time() - args.since * 3600]
+    print(format_report(summarize(records, args.slowest, args.interval)))
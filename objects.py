@@ -0,0 +1,279 @@
+import os
+import sys
+import json
+import glob
+import numpy as np
+
+from config import OBJECTS_ROW_GROUP
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+STAIN_BLUE = 0
+STAIN_BROWN = 1
+
+COLUMNS = {
+    'image_id': np.int32,
+    'stain': np.uint8,
+    'label': np.int32,
+    'row': np.float64,
+    'col': np.float64,
+    'area': np.int32,
+    'mean_h': np.float32,
+    'mean_d': np.float32,
+    'max_d': np.float32
+}
+
+
+class ObjectWriter:
+    """
+    Streaming writer of per-object detections.
+    A dataset is a folder holding images.jsonl (one line per image) and the objects in row
+    groups: a Parquet file when the optional pyarrow package is installed, otherwise numbered
+    NPZ files with one row group each. Objects are buffered and written once a row group is
+    full, so memory stays bounded however many objects a run produces.
+    """
+
+    def __init__(self, path, row_group=OBJECTS_ROW_GROUP):
+        """
+        Create a new dataset.
+
+        Parameters:
+            path (str): Dataset folder (must not exist yet)
+            row_group (int): Number of objects per row group
+        """
+        os.makedirs(path)
+        self.path = path
+        self.row_group = row_group
+        self.next_image_id = 0
+        self.buffer = {name: [] for name in COLUMNS}
+        self.buffered = 0
+        self.pending_images = []
+        self.part = 0
+        self._parquet = None
+
+    def append(self, image_info, objects_h, objects_d):
+        """
+        Add the objects of one image.
+
+        Parameters:
+            image_info (dict): JSON-serializable per-image values (filename, size, filters, ...)
+            objects_h (dict): Measurements of the nuclei (see analysis.object_measurements)
+            objects_d (dict): Measurements of the brown spots
+
+        Returns:
+            int: Identifier of the image in the dataset
+        """
+        image_id = self.next_image_id
+        self.next_image_id += 1
+        for stain, table in ((STAIN_BLUE, objects_h), (STAIN_BROWN, objects_d)):
+            n = len(table['label'])
+            self.buffer['image_id'].append(np.full(n, image_id, dtype=COLUMNS['image_id']))
+            self.buffer['stain'].append(np.full(n, stain, dtype=COLUMNS['stain']))
+            for name in ('label', 'row', 'col', 'area', 'mean_h', 'mean_d', 'max_d'):
+                self.buffer[name].append(np.asarray(table[name], dtype=COLUMNS[name]))
+            self.buffered += n
+        self.pending_images.append(dict(image_info, image_id=image_id))
+
+        if self.buffered >= self.row_group:
+            self.flush()
+        return image_id
+
+    def flush(self):
+        """
+        Write the buffered objects as row groups, then the images they belong to.
+        """
+        if self.buffered:
+            columns = {name: np.concatenate(parts) for name, parts in self.buffer.items()}
+            for start in range(0, self.buffered, self.row_group):
+                self._write_group({name: col[start:start + self.row_group] for name, col in columns.items()})
+            self.buffer = {name: [] for name in COLUMNS}
+            self.buffered = 0
+
+        if self.pending_images:
+            with open(os.path.join(self.path, 'images.jsonl'), 'a') as f:
+                for info in self.pending_images:
+                    f.write(json.dumps(info) + '\n')
+            self.pending_images = []
+
+    def _write_group(self, columns):
+        if pq is not None:
+            table = pa.table(columns)
+            if self._parquet is None:
+                self._parquet = pq.ParquetWriter(os.path.join(self.path, 'objects.parquet'), table.schema)
+            self._parquet.write_table(table)
+        else:
+            np.savez(os.path.join(self.path, f"objects-{self.part:06d}.npz"), **columns)
+        self.part += 1
+
+    def close(self):
+        """
+        Write the remaining objects and close the dataset.
+        """
+        self.flush()
+        if self._parquet is not None:
+            self._parquet.close()
+            self._parquet = None
+
+
+def read_images(path):
+    """
+    Read the per-image table of a dataset.
+
+    Parameters:
+        path (str): Dataset folder
+
+    Returns:
+        list: Per-image dictionaries in the order the images were written
+    """
+    images_path = os.path.join(path, 'images.jsonl')
+    if not os.path.exists(images_path):
+        return []
+    with open(images_path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def read_objects(path, columns=None):
+    """
+    Read object columns of a dataset.
+
+    Parameters:
+        path (str): Dataset folder
+        columns (list): Columns to read (all if None)
+
+    Returns:
+        dict: Column name to numpy array
+    """
+    columns = list(columns or COLUMNS)
+    parquet_path = os.path.join(path, 'objects.parquet')
+    if os.path.exists(parquet_path):
+        if pq is None:
+            raise ImportError("pyarrow is required to read Parquet object datasets")
+        table = pq.read_table(parquet_path, columns=columns)
+        return {name: table.column(name).to_numpy() for name in columns}
+
+    parts = {name: [] for name in columns}
+    for part_path in sorted(glob.glob(os.path.join(path, 'objects-*.npz'))):
+        with np.load(part_path) as part:
+            for name in columns:
+                parts[name].append(part[name])
+    return {name: np.concatenate(arrays) if arrays else np.zeros(0, dtype=COLUMNS[name])
+            for name, arrays in parts.items()}
+
+
+def summary_results(path, min_area_h=None, min_area_d=None, neighbour_radius=None, dab_thresholds=None):
+    """
+    Derive the per-image summary of the bulk processor from a dataset.
+
+    Parameters:
+        path (str): Dataset folder
+        min_area_h (int): Minimum nucleus size (default: the value used for each image)
+        min_area_d (int): Minimum brown spot size (default: the value used for each image)
+        neighbour_radius (float): Radius of the spatial statistics (default: the value used for each image)
+        dab_thresholds (tuple): DAB intensities of the 1+, 2+ and 3+ nucleus classes
+                                (default: the values used for each image)
+
+    Returns:
+        list: Result dictionaries accepted by analysis.export_row, in image order
+    """
+    from analysis import count_summary, dab_scores
+    from spatial import spatial_statistics
+
+    images = read_images(path)
+    if not images:
+        return []
+    objects = read_objects(path, ['image_id', 'stain', 'area', 'row', 'col', 'mean_d'])
+    n = max(info['image_id'] for info in images) + 1
+
+    image_id = objects['image_id'].astype(np.intp)
+    limits = np.zeros((2, n))
+    for info in images:
+        limits[0, info['image_id']] = info['min_area_h'] if min_area_h is None else min_area_h
+        limits[1, info['image_id']] = info['min_area_d'] if min_area_d is None else min_area_d
+    kept = objects['area'] > limits[objects['stain'].astype(np.intp), image_id]
+    blue = np.bincount(image_id[kept & (objects['stain'] == STAIN_BLUE)], minlength=n)
+    brown = np.bincount(image_id[kept & (objects['stain'] == STAIN_BROWN)], minlength=n)
+
+    # Kept objects grouped by image, so each image's centroids are a contiguous slice
+    order = np.flatnonzero(kept)
+    order = order[np.argsort(image_id[order], kind='stable')]
+    bounds = np.searchsorted(image_id[order], np.arange(n + 1))
+    points = np.column_stack([objects['row'], objects['col']])
+
+    results = []
+    for info in images:
+        rows = order[bounds[info['image_id']]:bounds[info['image_id'] + 1]]
+        stain = objects['stain'][rows]
+        radius = info.get('neighbour_radius') if neighbour_radius is None else neighbour_radius
+        result = {'filename': info['filename']}
+        result.update(count_summary(int(blue[info['image_id']]), int(brown[info['image_id']])))
+        thresholds = info.get('dab_thresholds') if dab_thresholds is None else dab_thresholds
+        if thresholds is not None:
+            result.update(dab_scores(objects['mean_d'][rows[stain == STAIN_BLUE]], thresholds))
+        if radius is not None:
+            result.update(spatial_statistics(points[rows[stain == STAIN_BLUE]], points[rows[stain == STAIN_BROWN]],
+                                             radius))
+        result['skipped_fraction'] = info['skipped_fraction']
+        result['peak_memory_mb'] = info.get('peak_memory_mb')
+        results.append(result)
+    return results
+
+
+def image_info(result, params):
+    """
+    Build the per-image entry of a dataset from a processing result.
+
+    Parameters:
+        result (dict): Result of analysis.measure_image
+        params (dict): Normalized parameters used for the image
+
+    Returns:
+        dict: Per-image values stored in images.jsonl
+    """
+    return {
+        'filename': result['filename'],
+        'path': result.get('image_path'),
+        'width': int(result['image_size'][0]),
+        'height': int(result['image_size'][1]),
+        'skipped_fraction': result['skipped_fraction'],
+        'peak_memory_mb': result.get('peak_memory_mb'),
+        'min_area_h': params['min_area_h'],
+        'min_area_d': params['min_area_d'],
+        'neighbour_radius': params['neighbour_radius'],
+        'dab_thresholds': list(params['dab_thresholds'])
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect per-object datasets and derive the per-image summary")
+    sub = parser.add_subparsers(dest='command', required=True)
+    info_parser = sub.add_parser('info', help="Show the size of a dataset")
+    info_parser.add_argument('dataset')
+    summary_parser = sub.add_parser('summary', help="Write the per-image CSV summary")
+    summary_parser.add_argument('dataset')
+    summary_parser.add_argument('output', help="CSV file to write")
+    summary_parser.add_argument('--min-area-h', type=int, help="Override the minimum nucleus size")
+    summary_parser.add_argument('--min-area-d', type=int, help="Override the minimum brown spot size")
+    summary_parser.add_argument('--dab-thresholds', type=float, nargs=3, metavar=('T1', 'T2', 'T3'),
+                                help="Override the DAB intensities of the 1+, 2+ and 3+ nucleus classes")
+    summary_parser.add_argument('--radius', type=float, help="Override the neighbour radius of the spatial statistics")
+    args = parser.parse_args()
+
+    if args.command == 'info':
+        objects = read_objects(args.dataset, ['stain'])
+        print(f"{len(read_images(args.dataset))} image(s), {len(objects['stain'])} object(s) "
+              f"({int((objects['stain'] == STAIN_BLUE).sum())} nuclei, "
+              f"{int((objects['stain'] == STAIN_BROWN).sum())} brown spots)")
+        sys.exit(0)
+
+    import pandas as pd
+    from analysis import export_row
+
+    results = summary_results(args.dataset, args.min_area_h, args.min_area_d, args.radius, args.dab_thresholds)
+    pd.DataFrame([export_row(result) for result in results]).to_csv(args.output, index=False)
+    print(f"Exported {len(results)} image(s) to {args.output}")
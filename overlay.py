@@ -0,0 +1,118 @@
+import numpy as np
+from PIL import Image, ImageTk
+
+BLUE_MARKER = (0, 0, 255)
+RED_MARKER = (255, 0, 0)
+
+_stamp_cache = {}
+
+
+def stamp_offsets(radius):
+    """
+    Get the pixel offsets of a filled circular marker.
+
+    Parameters:
+        radius (int): Marker radius in pixels
+
+    Returns:
+        tuple: (dy, dx) offset arrays of every pixel of the marker
+    """
+    if radius not in _stamp_cache:
+        r = max(0, int(radius))
+        dy, dx = np.mgrid[-r:r + 1, -r:r + 1]
+        inside = dy * dy + dx * dx <= r * r
+        _stamp_cache[radius] = (dy[inside], dx[inside])
+    return _stamp_cache[radius]
+
+
+class OverlayRenderer:
+    """
+    Draws detection markers on a cached copy of a thumbnail.
+    The base pixels are converted once; every render restores them with a single copy and
+    stamps all markers of a class in one vectorized assignment. The displayed Tk image is
+    updated in place instead of being recreated.
+    """
+
+    def __init__(self, base_img):
+        """
+        Initialize the renderer for a thumbnail.
+
+        Parameters:
+            base_img (PIL.Image): Thumbnail the markers are drawn on
+        """
+        # RGBA is the only colour layout PIL can map onto a NumPy buffer without copying
+        self.base = np.array(base_img.convert('RGBA'))
+        self.base[:, :, 3] = 255
+        self.buffer = self.base.copy()
+        self.height, self.width = self.base.shape[:2]
+        self.image = Image.frombuffer('RGBA', (self.width, self.height), self.buffer, 'raw', 'RGBA', 0, 1)
+        self.photo = None
+
+    def stamp(self, points, radius, color):
+        """
+        Draw filled markers for many points at once.
+
+        Parameters:
+            points (array-like): (N, 2) integer [x, y] display positions
+            radius (int): Marker radius
+            color (tuple): RGB marker color
+        """
+        color = tuple(color) + (255,)
+        points = np.asarray(points, dtype=np.intp).reshape(-1, 2)
+        if not len(points):
+            return
+        dy, dx = stamp_offsets(radius)
+        ys = (points[:, 1:2] + dy).ravel()
+        xs = (points[:, 0:1] + dx).ravel()
+        inside = (ys >= 0) & (ys < self.height) & (xs >= 0) & (xs < self.width)
+        self.buffer[ys[inside], xs[inside]] = color
+
+    def render(self, points_h, points_d, radius):
+        """
+        Redraw all markers on a fresh copy of the base thumbnail.
+
+        Parameters:
+            points_h (array-like): [x, y] display positions of blue nuclei
+            points_d (array-like): [x, y] display positions of brown spots
+            radius (int): Marker radius
+
+        Returns:
+            PIL.Image: Image sharing the render buffer (valid until the next render)
+        """
+        np.copyto(self.buffer, self.base)
+        self.stamp(points_h, radius, BLUE_MARKER)
+        self.stamp(points_d, radius, RED_MARKER)
+        return self.image
+
+    def photo_image(self):
+        """
+        Get the Tk image showing the render buffer, creating it on first use.
+        Must be called from the Tk thread.
+
+        Returns:
+            ImageTk.PhotoImage: Tk image that is refreshed by update_photo
+        """
+        if self.photo is None:
+            self.photo = ImageTk.PhotoImage(self.image)
+        return self.photo
+
+    def update_photo(self):
+        """
+        Copy the current render buffer into the existing Tk image.
+        """
+        self.photo_image().paste(self.image)
+
+
+def display_points(cents, sx, sy):
+    """
+    Convert (row, col) centroids to integer [x, y] display positions.
+
+    Parameters:
+        cents (list): (row, col) centroids in full resolution coordinates
+        sx, sy (float): Display scale factors
+
+    Returns:
+        numpy.ndarray: (N, 2) array of [x, y] positions
+    """
+    cents = np.asarray(cents, dtype=np.float64).reshape(-1, 2)
+    return np.column_stack((cents[:, 1] * sx, cents[:, 0] * sy)).astype(np.intp)
@@ -0,0 +1,178 @@
+import os
+import sys
+import json
+import time
+import cv2
+import numpy as np
+from skimage.color import rgb2hed
+
+from config import PYRAMID_COARSE_SIDE, PYRAMID_SENSITIVITY, DEFAULT_PARAMS_FILE
+from histogram import channel_histogram
+
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+
+def min_pool(img, factor=2):
+    """
+    Downsample an image by keeping the darkest value of every block.
+    Small stained objects survive the reduction, unlike with averaging.
+
+    Parameters:
+        img (numpy.ndarray): Image with shape (H, W) or (H, W, C)
+        factor (int): Block size
+
+    Returns:
+        numpy.ndarray: Image reduced by the factor in both directions
+    """
+    h, w = img.shape[:2]
+    h, w = h - h % factor, w - w % factor
+    if h == 0 or w == 0:
+        return img
+    blocks = img[:h, :w].reshape((h // factor, factor, w // factor, factor) + img.shape[2:])
+    return blocks.min(axis=(1, 3))
+
+
+def build_pyramid(img_bgr, min_side=PYRAMID_COARSE_SIDE):
+    """
+    Build an image pyramid by repeated 2x min-pooling.
+
+    Parameters:
+        img_bgr (numpy.ndarray): Full resolution image
+        min_side (int): Stop once the longest side is at most this size
+
+    Returns:
+        list: Pyramid levels, starting with the full resolution image
+    """
+    levels = [img_bgr]
+    while max(levels[-1].shape[:2]) > min_side and min(levels[-1].shape[:2]) >= 2:
+        levels.append(min_pool(levels[-1]))
+    return levels
+
+
+def read_pyramid_levels(path):
+    """
+    Read the reduced resolution levels stored in a pyramidal TIFF.
+    Requires the optional tifffile package.
+
+    Parameters:
+        path (str): Path to the image file
+
+    Returns:
+        list: Stored levels as BGR arrays (largest first), or None if the file has none
+    """
+    if tifffile is None or not path or not path.lower().endswith(('.tif', '.tiff')):
+        return None
+    try:
+        with tifffile.TiffFile(path) as tif:
+            series = tif.series[0]
+            if len(series.levels) < 2:
+                return None
+            levels = []
+            for level in series.levels[1:]:
+                data = level.asarray()
+                if data.ndim != 3 or data.shape[2] < 3:
+                    return None
+                levels.append(cv2.cvtColor(np.ascontiguousarray(data[:, :, :3]), cv2.COLOR_RGB2BGR))
+            return levels
+    except Exception:
+        return None
+
+
+def coarse_level(img_bgr, path=None, min_side=PYRAMID_COARSE_SIDE):
+    """
+    Get the coarse pyramid level used to find candidate regions.
+    Levels stored in a pyramidal TIFF are used when available; otherwise the pyramid is built.
+
+    Parameters:
+        img_bgr (numpy.ndarray): Full resolution image
+        path (str): Optional image path
+        min_side (int): Longest side the coarse level should have at least
+
+    Returns:
+        numpy.ndarray: Coarse level as a BGR image
+    """
+    stored = read_pyramid_levels(path)
+    if stored:
+        large_enough = [level for level in stored if max(level.shape[:2]) >= min_side]
+        return large_enough[-1] if large_enough else stored[0]
+    return build_pyramid(img_bgr, min_side)[-1]
+
+
+def candidate_mask(coarse_bgr, th_h=None, th_d=None):
+    """
+    Find pixels of a coarse level that may contain nuclei or brown staining.
+    The full resolution thresholds are relaxed by PYRAMID_SENSITIVITY so that objects diluted
+    by the reduction are still found; Otsu thresholds of the coarse level are used when no
+    thresholds are given.
+
+    Parameters:
+        coarse_bgr (numpy.ndarray): Coarse level as a BGR image
+        th_h (float): Hematoxylin threshold (optional)
+        th_d (float): DAB threshold (optional)
+
+    Returns:
+        numpy.ndarray: Boolean candidate mask with the shape of the coarse level
+    """
+    rgb = cv2.cvtColor(coarse_bgr, cv2.COLOR_BGR2RGB).astype(np.float64) / 255
+    hed = rgb2hed(rgb)
+    h_chan, d_chan = hed[:, :, 0], hed[:, :, 2]
+    if th_h is None:
+        th_h = channel_histogram([(h_chan, None)]).otsu()
+    if th_d is None:
+        th_d = channel_histogram([(d_chan, None)]).otsu()
+    return (h_chan > th_h * PYRAMID_SENSITIVITY) | (d_chan > th_d * PYRAMID_SENSITIVITY)
+
+
+def validate(image_paths, params):
+    """
+    Compare multi-resolution analysis against a full resolution run.
+
+    Parameters:
+        image_paths (list): Images to compare
+        params (dict): Raw processing parameters
+
+    Returns:
+        list: One dictionary per image with the counts and timings of both runs
+    """
+    from analysis import processing_params, analyze_image
+
+    rows = []
+    for path in image_paths:
+        img = cv2.imread(path)
+        if img is None:
+            continue
+        row = {'filename': os.path.basename(path)}
+        for mode in ('full', 'pyramid'):
+            run_params = processing_params(dict(params, pyramid_analysis=(mode == 'pyramid')))
+            start = time.perf_counter()
+            result = analyze_image(img, run_params, path=path)
+            row[f'{mode}_seconds'] = time.perf_counter() - start
+            row[f'{mode}_blue'] = len(result['cents_h'])
+            row[f'{mode}_red'] = len(result['cents_d'])
+        row['blue_diff'] = row['pyramid_blue'] - row['full_blue']
+        row['red_diff'] = row['pyramid_red'] - row['full_red']
+        rows.append(row)
+    return rows
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Validate multi-resolution counts against full resolution runs")
+    parser.add_argument('images', nargs='+', help="Images to compare")
+    parser.add_argument('--params', default=DEFAULT_PARAMS_FILE, help="Parameters file")
+    args = parser.parse_args()
+
+    with open(args.params, 'r') as f:
+        params = json.load(f)
+
+    mismatches = 0
+    for row in validate(args.images, params):
+        speedup = row['full_seconds'] / row['pyramid_seconds'] if row['pyramid_seconds'] else 0
+        print(f"{row['filename']}: blue {row['full_blue']} -> {row['pyramid_blue']} ({row['blue_diff']:+d}), "
+              f"red {row['full_red']} -> {row['pyramid_red']} ({row['red_diff']:+d}), {speedup:.1f}x faster")
+        mismatches += bool(row['blue_diff'] or row['red_diff'])
+    sys.exit(1 if mismatches else 0)
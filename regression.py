@@ -0,0 +1,281 @@
+import os
+import sys
+import json
+import glob
+import hashlib
+import cv2
+import numpy as np
+from scipy.spatial import cKDTree
+
+from config import PARAM_RANGES, DISK_SIZE, GAUSSIAN_SIGMA, MIN_DISTANCE, MIN_AREA_H, MIN_AREA_D
+from analysis import processing_params, analyze_image
+
+REGRESSION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "regression")
+REFERENCE_FILE = os.path.join(REGRESSION_DIR, "reference.json")
+SAMPLES_DIR = os.path.join(REGRESSION_DIR, "samples")
+
+
+def _range_value(name, position):
+    """
+    Pick a value inside the slider range of a parameter.
+
+    Parameters:
+        name (str): Parameter name in PARAM_RANGES
+        position (float): Relative position in the range (0 = min, 1 = max)
+
+    Returns:
+        float: Value snapped to the slider step
+    """
+    config = PARAM_RANGES[name]
+    value = config['min'] + position * (config['max'] - config['min'])
+    return round(round(value / config['step']) * config['step'], 6)
+
+
+PARAM_SETS = {
+    'defaults': {
+        'h_threshold': 0.103, 'd_threshold': 0.019, 'disk_size': DISK_SIZE,
+        'gaussian_sigma': GAUSSIAN_SIGMA, 'min_distance': MIN_DISTANCE,
+        'min_area_h': MIN_AREA_H, 'min_area_d': MIN_AREA_D
+    },
+    'otsu': {
+        'disk_size': DISK_SIZE, 'gaussian_sigma': GAUSSIAN_SIGMA, 'min_distance': MIN_DISTANCE,
+        'min_area_h': MIN_AREA_H, 'min_area_d': MIN_AREA_D
+    },
+    'fine': {
+        'h_threshold': 0.103, 'd_threshold': 0.019,
+        **{name: PARAM_RANGES[name]['min'] for name in
+           ('disk_size', 'gaussian_sigma', 'min_distance', 'min_area_h', 'min_area_d')}
+    },
+    'coarse': {
+        'h_threshold': 0.15, 'd_threshold': 0.04,
+        **{name: _range_value(name, 0.25) for name in
+           ('disk_size', 'gaussian_sigma', 'min_distance', 'min_area_h', 'min_area_d')}
+    }
+}
+# Low memory mode gives the results of the defaults on whole images; tiles (forced here by a
+# small memory budget) can split or merge nuclei across their borders, which these cases track
+PARAM_SETS['low_memory'] = dict(PARAM_SETS['defaults'], low_memory=True)
+PARAM_SETS['low_memory_tiled'] = dict(PARAM_SETS['defaults'], low_memory=True, memory_budget_mb=4)
+
+
+def synthetic_image(seed, size=(512, 640), nuclei=150, brown=60, glass=0.0, noise=0.0, cluster=False):
+    """
+    Draw a deterministic synthetic stained field.
+
+    Parameters:
+        seed (int): Random seed
+        size (tuple): (height, width) of the image
+        nuclei (int): Number of blue nuclei
+        brown (int): Number of brown spots
+        glass (float): Fraction of the width left as blank glass on the right
+        noise (float): Standard deviation of additive pixel noise
+        cluster (bool): Place nuclei in touching clusters
+
+    Returns:
+        numpy.ndarray: BGR image
+    """
+    rng = np.random.default_rng(seed)
+    h, w = size
+    tissue_w = int(w * (1 - glass))
+    img = np.full((h, w, 3), 242, dtype=np.uint8)
+    img[:, :tissue_w] = (215, 205, 225)
+
+    centers = rng.integers(12, (h - 12, max(13, tissue_w - 12)), size=(nuclei, 2))
+    if cluster:
+        centers[1::2] = np.clip(centers[0::2][:len(centers[1::2])] + rng.integers(-7, 8, size=(len(centers[1::2]), 2)),
+                                0, (h - 1, tissue_w - 1))
+    for y, x in centers:
+        cv2.circle(img, (int(x), int(y)), int(rng.integers(4, 8)), (150, 70, 50), -1)
+    for y, x in rng.integers(8, (h - 8, max(9, tissue_w - 8)), size=(brown, 2)):
+        cv2.circle(img, (int(x), int(y)), int(rng.integers(3, 6)), (30, 75, 135), -1)
+
+    img = cv2.GaussianBlur(img, (3, 3), 0)
+    if noise:
+        img = np.clip(img + rng.normal(0, noise, img.shape), 0, 255).astype(np.uint8)
+    return img
+
+
+SYNTHETIC_CORPUS = {
+    'synthetic_sparse': dict(seed=1, nuclei=80, brown=30),
+    'synthetic_dense': dict(seed=2, nuclei=400, brown=150),
+    'synthetic_clustered': dict(seed=3, nuclei=200, brown=60, cluster=True),
+    'synthetic_glass': dict(seed=4, nuclei=120, brown=50, glass=0.6),
+    'synthetic_noisy': dict(seed=5, nuclei=150, brown=60, noise=12.0),
+    'synthetic_large': dict(seed=6, size=(1536, 2048), nuclei=1500, brown=500)
+}
+
+
+def corpus():
+    """
+    List the regression corpus: the synthetic images plus any images in regression/samples.
+
+    Returns:
+        list: (name, loader) pairs, where loader returns the BGR image
+    """
+    items = [(name, lambda spec=spec: synthetic_image(**spec)) for name, spec in SYNTHETIC_CORPUS.items()]
+    for path in sorted(glob.glob(os.path.join(SAMPLES_DIR, '*'))):
+        if path.lower().endswith(('.png', '.jpg', '.jpeg', '.tif', '.tiff')):
+            items.append((os.path.basename(path), lambda path=path: cv2.imread(path)))
+    return items
+
+
+def label_checksum(lbl):
+    """
+    Hash a label image independently of its dtype.
+
+    Parameters:
+        lbl (numpy.ndarray): Label image
+
+    Returns:
+        str: SHA-1 of the labels as little-endian int32
+    """
+    return hashlib.sha1(np.ascontiguousarray(lbl, dtype='<i4').tobytes()).hexdigest()
+
+
+def run_case(img, params, options=None):
+    """
+    Run the pipeline for one image and parameter set and collect the guarded outputs.
+
+    Parameters:
+        img (numpy.ndarray): BGR image
+        params (dict): Raw parameters of the set
+        options (dict): Extra parameters under test (e.g. low_memory)
+
+    Returns:
+        dict: Counts, rounded centroids and label checksums
+    """
+    result = analyze_image(img, processing_params(dict(params, **(options or {}))))
+    return {
+        'blue_count': len(result['cents_h']),
+        'red_count': len(result['cents_d']),
+        'cents_h': np.round(np.asarray(result['cents_h'], dtype=np.float64).reshape(-1, 2), 3).tolist(),
+        'cents_d': np.round(np.asarray(result['cents_d'], dtype=np.float64).reshape(-1, 2), 3).tolist(),
+        'lbl_h_checksum': label_checksum(result['lbl_h']),
+        'lbl_d_checksum': label_checksum(result['lbl_d'])
+    }
+
+
+def run_corpus(options=None):
+    """
+    Run every corpus image with every parameter set.
+
+    Parameters:
+        options (dict): Extra parameters under test
+
+    Returns:
+        dict: Outputs keyed by "image/parameter set"
+    """
+    outputs = {}
+    for name, load in corpus():
+        img = load()
+        for set_name, params in PARAM_SETS.items():
+            outputs[f"{name}/{set_name}"] = run_case(img, params, options)
+    return outputs
+
+
+def match_centroids(expected, actual, tolerance):
+    """
+    Count centroids that have no partner within the tolerance.
+
+    Parameters:
+        expected (list): Reference (row, col) centroids
+        actual (list): Centroids of the run under test
+        tolerance (float): Maximum distance in pixels
+
+    Returns:
+        tuple: (missing, extra) numbers of unmatched reference and new centroids
+    """
+    expected = np.asarray(expected, dtype=np.float64).reshape(-1, 2)
+    actual = np.asarray(actual, dtype=np.float64).reshape(-1, 2)
+    if not len(expected) or not len(actual):
+        return len(expected), len(actual)
+    missing = np.isinf(cKDTree(actual).query(expected, distance_upper_bound=tolerance)[0]).sum()
+    extra = np.isinf(cKDTree(expected).query(actual, distance_upper_bound=tolerance)[0]).sum()
+    return int(missing), int(extra)
+
+
+def compare(reference, outputs, count_tolerance=0, centroid_tolerance=0.01, check_labels=True):
+    """
+    Compare outputs against the stored reference.
+
+    Parameters:
+        reference (dict): Stored reference outputs
+        outputs (dict): Outputs of the run under test
+        count_tolerance (int): Allowed absolute difference of the counts
+        centroid_tolerance (float): Allowed centroid displacement in pixels
+        check_labels (bool): Require identical label checksums
+
+    Returns:
+        list: One dictionary per case that is outside the tolerances
+    """
+    diffs = []
+    for case, ref in sorted(reference.items()):
+        out = outputs.get(case)
+        if out is None:
+            diffs.append({'case': case, 'problems': ['missing from run']})
+            continue
+
+        problems = []
+        for key in ('blue_count', 'red_count'):
+            if abs(out[key] - ref[key]) > count_tolerance:
+                problems.append(f"{key} {ref[key]} -> {out[key]}")
+        for key in ('cents_h', 'cents_d'):
+            missing, extra = match_centroids(ref[key], out[key], centroid_tolerance)
+            if missing > count_tolerance or extra > count_tolerance:
+                problems.append(f"{key}: {missing} unmatched, {extra} new (tolerance {centroid_tolerance}px)")
+        if check_labels:
+            for key in ('lbl_h_checksum', 'lbl_d_checksum'):
+                if out[key] != ref[key]:
+                    problems.append(f"{key} changed")
+        if problems:
+            diffs.append({'case': case, 'problems': problems})
+    return diffs
+
+
+def parse_options(pairs):
+    """
+    Parse NAME=VALUE pairs given on the command line into JSON values.
+    """
+    options = {}
+    for pair in pairs:
+        name, _, value = pair.partition('=')
+        try:
+            options[name] = json.loads(value)
+        except ValueError:
+            options[name] = value
+    return options
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Golden-output regression harness for the detection pipeline")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('record', help="Run the corpus and store the reference outputs")
+    cmp_parser = sub.add_parser('compare', help="Run the corpus and compare against the reference outputs")
+    cmp_parser.add_argument('--set', nargs='*', default=[], metavar='NAME=VALUE',
+                            help="Extra parameters under test, e.g. low_memory=true")
+    cmp_parser.add_argument('--count-tolerance', type=int, default=0)
+    cmp_parser.add_argument('--centroid-tolerance', type=float, default=0.01)
+    cmp_parser.add_argument('--ignore-labels', action='store_true', help="Do not require identical label images")
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        outputs = run_corpus()
+        os.makedirs(REGRESSION_DIR, exist_ok=True)
+        with open(REFERENCE_FILE, 'w') as f:
+            f.write("{\n" + ",\n".join(f"{json.dumps(case)}: {json.dumps(outputs[case])}"
+                                       for case in sorted(outputs)) + "\n}\n")
+        print(f"Recorded {len(outputs)} cases to {REFERENCE_FILE}")
+        sys.exit(0)
+
+    with open(REFERENCE_FILE, 'r') as f:
+        reference = json.load(f)
+    diffs = compare(reference, run_corpus(parse_options(args.set)), args.count_tolerance,
+                    args.centroid_tolerance, not args.ignore_labels)
+    for diff in diffs:
+        print(f"{diff['case']}:")
+        for problem in diff['problems']:
+            print(f"    {problem}")
+    print(f"{len(reference) - len(diffs)} of {len(reference)} cases within tolerance")
+    sys.exit(1 if diffs else 0)
@@ -0,0 +1,91 @@
+from concurrent.futures import wait, FIRST_COMPLETED
+
+# Seconds between checks for cancellation while waiting for jobs
+POLL_SECONDS = 0.2
+
+
+def measure_task(image_path, params, labels_path=None, measure_objects=False, density_path=None):
+    """
+    Measure one image of a bulk run in a worker process.
+
+    Parameters:
+        image_path (str): Path to the image file or page specification
+        params (dict): Normalized processing parameters
+        labels_path (str): File to save the label images to (optional)
+        measure_objects (bool): Add the per-object measurement tables
+        density_path (str): File to save the density map to (optional)
+
+    Returns:
+        tuple: (result of analysis.measure_image or None, stage timings in ms)
+    """
+    from analysis import measure_image
+    from metrics import StageTimer
+
+    timer = StageTimer()
+    result = measure_image(image_path, params, labels_path=labels_path, measure_objects=measure_objects,
+                           timer=timer, density_path=density_path)
+    return result, timer.stages
+
+
+class AdmissionScheduler:
+    """
+    Runs jobs on an executor largest first, which keeps one large image from finishing
+    long after all others (longest processing time first). A job is started only while
+    the estimated memory of the running jobs and its own fits the budget; a job larger
+    than the whole budget runs alone. Results are handed out as the jobs complete.
+    """
+
+    def __init__(self, executor, workers, budget_bytes):
+        """
+        Parameters:
+            executor (concurrent.futures.Executor): Executor running the jobs
+            workers (int): Largest number of jobs running at once
+            budget_bytes (int): Memory allowed for the running jobs
+        """
+        self.executor = executor
+        self.workers = max(1, workers)
+        self.budget = budget_bytes
+        self.peak_running = 0
+        self.peak_bytes = 0
+
+    def run(self, jobs, cancel_event=None):
+        """
+        Run jobs and yield their futures as they complete.
+
+        Parameters:
+            jobs (list): (estimated bytes, function, args) tuples; an estimate of None
+                         (e.g. an unreadable header) is treated as the whole budget
+            cancel_event (threading.Event): Stops admitting jobs once set
+
+        Yields:
+            tuple: (job index, finished future)
+        """
+        estimates = [self.budget if job[0] is None else job[0] for job in jobs]
+        order = sorted(range(len(jobs)), key=lambda i: estimates[i], reverse=True)
+        running = {}
+        used = 0
+        head = 0
+        try:
+            while running or head < len(order):
+                if cancel_event is not None and cancel_event.is_set():
+                    return
+                # Admit in order of size; a job that does not fit waits for memory to be released
+                while head < len(order) and len(running) < self.workers:
+                    i = order[head]
+                    if running and used + estimates[i] > self.budget:
+                        break
+                    _, fn, args = jobs[i]
+                    running[self.executor.submit(fn, *args)] = i
+                    used += estimates[i]
+                    head += 1
+                self.peak_running = max(self.peak_running, len(running))
+                self.peak_bytes = max(self.peak_bytes, used)
+
+                done, _ = wait(list(running), timeout=POLL_SECONDS, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = running.pop(future)
+                    used -= estimates[i]
+                    yield i, future
+        finally:
+            for future in running:
+                future.cancel()
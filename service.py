@@ -0,0 +1,305 @@
+import os
+import sys
+import json
+import math
+import time
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from config import (
+    DEFAULT_PARAMS_FILE, SERVICE_HOST, SERVICE_PORT, SERVICE_WORKERS, SERVICE_MAX_QUEUE, SERVICE_MAX_UPLOAD_MB
+)
+from metrics import MetricsLog, metrics_record
+
+
+def warm_worker():
+    """
+    Import the analysis stack in a pool process and run it once on a tiny image,
+    so that the first real request does not pay for imports and lazy initialization.
+    """
+    import numpy as np
+    from analysis import processing_params, analyze_image
+
+    analyze_image(np.full((32, 32, 3), 200, dtype=np.uint8), processing_params({}))
+
+
+def analyze_request(image_path, params, image_data=None):
+    """
+    Analyze one image in a pool process.
+
+    Parameters:
+        image_path (str): Path of the image, or the name of an upload
+        params (dict): Raw processing parameters
+        image_data (bytes): Uploaded image file contents (None to read image_path)
+
+    Returns:
+        tuple: (response dictionary or None if the image could not be read, processing seconds,
+                metrics record of the image)
+    """
+    from analysis import processing_params, measure_image
+    from metrics import StageTimer
+
+    timer = StageTimer()
+    start = time.perf_counter()
+    result = measure_image(image_path, processing_params(params), image_data, timer=timer)
+    seconds = time.perf_counter() - start
+    record = metrics_record('service', image_path, timer, seconds * 1000, result, worker=os.getpid())
+    if image_data is not None:
+        record.update({'path': None, 'file_bytes': len(image_data)})
+    if result is None:
+        return None, seconds, record
+
+    detections = [{'class': 'blue', 'row': float(r), 'col': float(c)} for r, c in result.pop('cents_h')]
+    detections += [{'class': 'brown', 'row': float(r), 'col': float(c)} for r, c in result.pop('cents_d')]
+    # Ratios are infinite without blue nuclei; JSON has no representation for that
+    result.update({k: None for k, v in result.items() if isinstance(v, float) and not math.isfinite(v)})
+    result['image_size'] = list(result['image_size'])
+    result.pop('labels_file')
+    result['detections'] = detections
+    return result, seconds, record
+
+
+class AnalysisService:
+    """
+    Warm pool of analysis processes with a bounded request queue.
+    At most `workers` images are analyzed at the same time; up to `max_queue` further
+    requests wait for a free process and any request beyond that is rejected.
+    """
+
+    def __init__(self, workers=SERVICE_WORKERS, max_queue=SERVICE_MAX_QUEUE, params_file=DEFAULT_PARAMS_FILE,
+                 metrics_path=None):
+        """
+        Start the worker processes.
+
+        Parameters:
+            workers (int): Number of analysis processes
+            max_queue (int): Number of requests allowed to wait for a process
+            params_file (str): Parameters file providing the defaults of every request
+            metrics_path (str): Optional log receiving the metrics record of every request
+        """
+        self.workers = workers
+        self.metrics = MetricsLog(metrics_path) if metrics_path else None
+        self.max_queue = max_queue
+        self.slots = threading.BoundedSemaphore(workers + max_queue)
+        self.lock = threading.Lock()
+        self.restart_lock = threading.Lock()
+        self.active = 0
+
+        self.default_params = {}
+        if params_file and os.path.exists(params_file):
+            with open(params_file, 'r') as f:
+                self.default_params = {k: v for k, v in json.load(f).items() if k != 'image_path'}
+
+        self.pool = None
+        self.start_pool()
+
+    def start_pool(self):
+        """
+        (Re)create the process pool and wait until every process has loaded the analysis stack.
+        The new pool replaces the old one once it is warm.
+        """
+        pool = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_worker)
+        for future in [pool.submit(time.sleep, 0.1) for _ in range(self.workers)]:
+            future.result()
+        old, self.pool = self.pool, pool
+        if old is not None:
+            old.shutdown(wait=False, cancel_futures=True)
+
+    def restart_pool(self, broken):
+        """
+        Replace a broken pool. Requests that saw the same pool break wait for one restart;
+        status and new requests are not held up by the warm-up.
+
+        Parameters:
+            broken (ProcessPoolExecutor): Pool that raised BrokenProcessPool
+        """
+        with self.restart_lock:
+            if self.pool is broken:
+                self.start_pool()
+
+    def request_params(self, params):
+        """
+        Combine the parameters of a request with the defaults and check that every value
+        can be converted to the type the pipeline uses.
+
+        Parameters:
+            params (dict): Request parameters, overriding the defaults
+
+        Returns:
+            dict: Raw parameters of the request
+
+        Raises:
+            ValueError: If a parameter has a value of the wrong type
+        """
+        from analysis import processing_params
+
+        merged = dict(self.default_params, **params)
+        try:
+            processing_params(merged)
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Invalid parameters: {e}") from e
+        return merged
+
+    def analyze(self, image_path, params, image_data=None):
+        """
+        Analyze an image in the pool.
+
+        Parameters:
+            image_path (str): Image path, or the name of an upload
+            params (dict): Parameters as returned by request_params
+            image_data (bytes): Uploaded image file contents
+
+        Returns:
+            tuple: (result dictionary or None, timings dictionary in milliseconds),
+                   or None if the queue is full
+        """
+        if not self.slots.acquire(blocking=False):
+            return None
+
+        start = time.perf_counter()
+        try:
+            with self.lock:
+                self.active += 1
+            pool = self.pool
+            try:
+                result, seconds, record = pool.submit(analyze_request, image_path, params, image_data).result()
+            except BrokenProcessPool:
+                self.restart_pool(pool)
+                raise
+        finally:
+            with self.lock:
+                self.active -= 1
+            self.slots.release()
+
+        total = time.perf_counter() - start
+        timings = {'analysis': seconds * 1000, 'queue': max(0.0, total - seconds) * 1000, 'total': total * 1000}
+        if self.metrics is not None:
+            self.metrics.write(dict(record, queue_ms=round(timings['queue'], 2)))
+        return result, timings
+
+    def status(self):
+        """
+        Describe the pool and the current load.
+
+        Returns:
+            dict: Worker count, queue limit and requests in progress or waiting
+        """
+        with self.lock:
+            active = self.active
+        return {'workers': self.workers, 'max_queue': self.max_queue, 'requests': active}
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """
+    HTTP interface of the analysis service.
+
+    GET  /health                      Pool status
+    POST /analyze                     JSON body {"path": ..., "params": {...}}, or the image file
+                                      itself as body with optional ?params=<JSON>&name=<file name>
+    """
+
+    service = None
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/health':
+            self.send_json(200, dict(self.service.status(), status='ok'))
+        else:
+            self.send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/analyze':
+            self.send_json(404, {'error': 'Not found'})
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > SERVICE_MAX_UPLOAD_MB * 2 ** 20:
+            self.send_json(413, {'error': f"Request larger than {SERVICE_MAX_UPLOAD_MB} MB"})
+            return
+        body = self.rfile.read(length)
+
+        try:
+            if self.headers.get('Content-Type', '').startswith('application/json'):
+                request = json.loads(body or b'{}')
+                if not isinstance(request, dict):
+                    raise ValueError("The request must be a JSON object")
+                image_path, params, image_data = request.get('path'), request.get('params') or {}, None
+                if not image_path:
+                    raise ValueError("Missing image path")
+            else:
+                query = parse_qs(url.query)
+                params = json.loads(query.get('params', ['{}'])[0])
+                image_path, image_data = query.get('name', ['upload'])[0], body
+                if not image_data:
+                    raise ValueError("Empty upload")
+            if not isinstance(params, dict):
+                raise ValueError("params must be a JSON object")
+            params = self.service.request_params(params)
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+
+        try:
+            outcome = self.service.analyze(image_path, params, image_data)
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+            return
+
+        if outcome is None:
+            self.send_json(503, {'error': 'Too many queued requests'}, {'Retry-After': '1'})
+            return
+
+        result, timings = outcome
+        headers = {
+            'X-Queue-Time-Ms': f"{timings['queue']:.1f}",
+            'X-Analysis-Time-Ms': f"{timings['analysis']:.1f}",
+            'X-Total-Time-Ms': f"{timings['total']:.1f}",
+            'Server-Timing': ", ".join(f"{name};dur={value:.1f}" for name, value in timings.items())
+        }
+        if result is None:
+            self.send_json(422, {'error': 'Could not read image'}, headers)
+        else:
+            self.send_json(200, result, headers)
+
+    def log_message(self, format, *args):
+        sys.stderr.write(f"{self.address_string()} - {format % args}\n")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local HTTP service for image analysis")
+    parser.add_argument('--host', default=SERVICE_HOST)
+    parser.add_argument('--port', type=int, default=SERVICE_PORT)
+    parser.add_argument('--workers', type=int, default=SERVICE_WORKERS, help="Analysis processes")
+    parser.add_argument('--max-queue', type=int, default=SERVICE_MAX_QUEUE, help="Requests allowed to wait")
+    parser.add_argument('--params', default=DEFAULT_PARAMS_FILE, help="Parameters file with the defaults")
+    parser.add_argument('--metrics', help="Log the metrics of every request to this JSON lines file")
+    args = parser.parse_args()
+
+    ServiceHandler.service = AnalysisService(args.workers, args.max_queue, args.params, args.metrics)
+    server = ThreadingHTTPServer((args.host, args.port), ServiceHandler)
+    print(f"Serving on http://{args.host}:{args.port} with {args.workers} worker(s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        ServiceHandler.service.shutdown()
@@ -5,12 +5,52 @@ import sys
 script_dir = os.path.dirname(os.path.abspath(__file__))
 config_path = os.path.join(script_dir, 'config.py')
 dotStuff_path = os.path.join(script_dir, 'dotStuff.py')
+journal_path = os.path.join(script_dir, 'journal.py')
+analysis_path = os.path.join(script_dir, 'analysis.py')
+pyramid_path = os.path.join(script_dir, 'pyramid.py')
+overlay_path = os.path.join(script_dir, 'overlay.py')
+viewer_path = os.path.join(script_dir, 'viewer.py')
+workqueue_path = os.path.join(script_dir, 'workqueue.py')
+service_path = os.path.join(script_dir, 'service.py')
+histogram_path = os.path.join(script_dir, 'histogram.py')
+calibration_path = os.path.join(script_dir, 'calibration.py')
+labels_path = os.path.join(script_dir, 'labels.py')
+objects_path = os.path.join(script_dir, 'objects.py')
+metrics_path = os.path.join(script_dir, 'metrics.py')
+speculation_path = os.path.join(script_dir, 'speculation.py')
+fingerprint_path = os.path.join(script_dir, 'fingerprint.py')
+stacks_path = os.path.join(script_dir, 'stacks.py')
+spatial_path = os.path.join(script_dir, 'spatial.py')
+density_path = os.path.join(script_dir, 'density.py')
+scheduler_path = os.path.join(script_dir, 'scheduler.py')
+annotate_path = os.path.join(script_dir, 'annotate.py')
+hedcache_path = os.path.join(script_dir, 'hedcache.py')
 default_params_path = os.path.join(script_dir, 'default_params.json')
 
 APP = ['main.py']
 DATA_FILES = [
     config_path,
     dotStuff_path,
+    journal_path,
+    analysis_path,
+    pyramid_path,
+    overlay_path,
+    viewer_path,
+    workqueue_path,
+    service_path,
+    histogram_path,
+    calibration_path,
+    labels_path,
+    objects_path,
+    metrics_path,
+    speculation_path,
+    fingerprint_path,
+    stacks_path,
+    spatial_path,
+    density_path,
+    scheduler_path,
+    annotate_path,
+    hedcache_path,
     default_params_path
 ]
 
@@ -28,7 +68,7 @@ OPTIONS = {
     'excludes': ['matplotlib', 'PyQt5', 'PyQt6', 'PySide2', 'PySide6'],
     'frameworks': FRAMEWORKS,
     'site_packages': True,
-    'resources': ['config.py', 'dotStuff.py', 'default_params.json'],
+    'resources': ['config.py', 'dotStuff.py', 'journal.py', 'analysis.py', 'pyramid.py', 'overlay.py', 'viewer.py', 'workqueue.py', 'service.py', 'histogram.py', 'calibration.py', 'labels.py', 'objects.py', 'metrics.py', 'speculation.py', 'fingerprint.py', 'stacks.py', 'spatial.py', 'density.py', 'scheduler.py', 'annotate.py', 'hedcache.py', 'default_params.json'],
     'iconfile': None,
     'plist': {
         'CFBundleName': 'Biology Image Analysis',
@@ -0,0 +1,99 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+from config import NEIGHBOUR_RADIUS
+
+
+def _points(cents):
+    return np.asarray(cents, dtype=np.float64).reshape(-1, 2)
+
+
+class DetectionIndex:
+    """
+    KD-trees over the nucleus and brown spot centroids of one image, answering
+    neighbourhood queries in O(log n) per point instead of comparing every pair.
+    """
+
+    def __init__(self, cents_h, cents_d):
+        """
+        Parameters:
+            cents_h (list): (row, col) centroids of the nuclei
+            cents_d (list): (row, col) centroids of the brown spots
+        """
+        self.points_h = _points(cents_h)
+        self.points_d = _points(cents_d)
+        self.tree_h = cKDTree(self.points_h) if len(self.points_h) else None
+        self.tree_d = cKDTree(self.points_d) if len(self.points_d) else None
+
+    def brown_within(self, point, radius):
+        """
+        Find the brown spots near a point.
+
+        Parameters:
+            point (tuple): (row, col) position, e.g. a nucleus centroid
+            radius (float): Search radius in pixels
+
+        Returns:
+            numpy.ndarray: Indices of the brown spots within radius, in ascending order
+        """
+        if self.tree_d is None:
+            return np.zeros(0, dtype=np.intp)
+        return np.sort(np.asarray(self.tree_d.query_ball_point(point, radius), dtype=np.intp))
+
+    def nearest_nucleus_distances(self):
+        """
+        Distance from every brown spot to the nearest nucleus.
+
+        Returns:
+            numpy.ndarray: Distances in pixels (inf for all spots if there are no nuclei)
+        """
+        if self.tree_h is None:
+            return np.full(len(self.points_d), np.inf)
+        if not len(self.points_d):
+            return np.zeros(0)
+        return self.tree_h.query(self.points_d, k=1)[0]
+
+    def brown_neighbour_counts(self, radius):
+        """
+        Number of brown spots within a radius of every nucleus.
+
+        Parameters:
+            radius (float): Search radius in pixels
+
+        Returns:
+            numpy.ndarray: Count per nucleus, in the order of the nucleus centroids
+        """
+        if self.tree_d is None or not len(self.points_h):
+            return np.zeros(len(self.points_h), dtype=np.intp)
+        return np.asarray(self.tree_d.query_ball_point(self.points_h, radius, return_length=True), dtype=np.intp)
+
+
+def spatial_statistics(cents_h, cents_d, radius=NEIGHBOUR_RADIUS):
+    """
+    Compute the co-localization statistics reported for an image.
+
+    Parameters:
+        cents_h (list): (row, col) centroids of the nuclei
+        cents_d (list): (row, col) centroids of the brown spots
+        radius (float): Neighbourhood radius in pixels
+
+    Returns:
+        dict: Brown spots near a nucleus, nuclei with brown neighbours, brown neighbours
+              per nucleus and the nearest-nucleus distance distribution of the brown spots
+    """
+    index = DetectionIndex(cents_h, cents_d)
+    distances = index.nearest_nucleus_distances()
+    counts = index.brown_neighbour_counts(radius)
+    near = int(np.count_nonzero(distances <= radius))
+    finite = distances[np.isfinite(distances)]
+    median, p90 = np.percentile(finite, [50, 90]) if len(finite) else (None, None)
+    return {
+        'neighbour_radius': float(radius),
+        'red_near_blue_count': near,
+        'pct_red_near_blue': near / len(distances) * 100 if len(distances) else 0,
+        'pct_blue_with_red': int(np.count_nonzero(counts)) / len(counts) * 100 if len(counts) else 0,
+        'mean_red_per_blue': float(counts.mean()) if len(counts) else 0,
+        'max_red_per_blue': int(counts.max()) if len(counts) else 0,
+        'nearest_blue_median': None if median is None else float(median),
+        'nearest_blue_p90': None if p90 is None else float(p90)
+    }
@@ -0,0 +1,130 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from config import SPECULATION_MAX_MB
+
+
+def result_bytes(result):
+    """
+    Estimate the memory held by a segmentation result.
+
+    Parameters:
+        result (tuple): (lbl_h, lbl_d, cents_h, cents_d) as returned by segment_regions
+
+    Returns:
+        int: Size in bytes
+    """
+    lbl_h, lbl_d, cents_h, cents_d = result
+    return lbl_h.nbytes + lbl_d.nbytes + 64 * (len(cents_h) + len(cents_d))
+
+
+class SpeculativeSegmenter:
+    """
+    Segmentation results for slider positions next to the current one, computed in a
+    background thread while the editor is idle.
+
+    Results are stored with the exact slider values they were computed for. Every call to
+    speculate or discard starts a new generation: background work of an older generation
+    is abandoned before its next position, and stored results that are not among the new
+    positions are dropped.
+    """
+
+    def __init__(self, max_mb=SPECULATION_MAX_MB):
+        """
+        Parameters:
+            max_mb (float): Memory allowed for stored results
+        """
+        self.max_bytes = max_mb * 2 ** 20
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.lock = threading.Lock()
+        self.entries = []
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _used(self):
+        return sum(size for _, _, size in self.entries)
+
+    def get(self, values):
+        """
+        Look up the result for a set of slider values.
+
+        Parameters:
+            values (dict): Slider name to value
+
+        Returns:
+            tuple: Stored result, or None
+        """
+        with self.lock:
+            for entry_values, result, _ in self.entries:
+                if entry_values == values:
+                    self.hits += 1
+                    return result
+            self.misses += 1
+        return None
+
+    def put(self, values, result):
+        """
+        Store the result of the current position, so that stepping back to it is immediate.
+        The oldest results are dropped if needed to stay within the memory cap.
+
+        Parameters:
+            values (dict): Slider name to value
+            result (tuple): Segmentation result
+        """
+        size = result_bytes(result)
+        with self.lock:
+            while self.entries and self._used() + size > self.max_bytes:
+                self.entries.pop(0)
+            if size <= self.max_bytes:
+                self.entries.append((dict(values), result, size))
+
+    def discard(self):
+        """
+        Abandon the background work and drop every stored result.
+        """
+        with self.lock:
+            self.generation += 1
+            self.entries = []
+
+    def speculate(self, current, candidates, compute):
+        """
+        Precompute the results of candidate positions in the background, nearest first.
+        Stored results other than those of the current and the candidate positions are dropped.
+
+        Parameters:
+            current (dict): Slider values of the current position
+            candidates (list): Slider values dicts to precompute, in order of priority
+            compute (callable): Function returning the segmentation result for a values dict;
+                called in the background thread
+        """
+        keep = [current] + candidates
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+            self.entries = [entry for entry in self.entries if entry[0] in keep]
+        self.executor.submit(self._run, generation, candidates, compute)
+
+    def _run(self, generation, candidates, compute):
+        for candidate in candidates:
+            with self.lock:
+                if generation != self.generation:
+                    return
+                if any(entry[0] == candidate for entry in self.entries):
+                    continue
+            result = compute(candidate)
+            size = result_bytes(result)
+            with self.lock:
+                if generation != self.generation:
+                    return
+                # Speculative results never push out others; stop once the cap is reached
+                if self._used() + size > self.max_bytes:
+                    return
+                self.entries.append((candidate, result, size))
+
+    def shutdown(self):
+        """
+        Drop every stored result and stop the background thread once its current position is done.
+        """
+        self.discard()
+        self.executor.shutdown(wait=False)
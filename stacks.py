@@ -0,0 +1,296 @@
+import os
+import re
+import hashlib
+import warnings
+import cv2
+import numpy as np
+from PIL import Image
+
+from config import STACK_MODE
+
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+PROJECTIONS = ('max', 'mean')
+
+# How multi-page TIFFs are expanded: (one result per page, projection added per stack)
+STACK_MODES = {
+    'pages': (True, None),
+    'pages + max': (True, 'max'),
+    'pages + mean': (True, 'mean'),
+    'max': (False, 'max'),
+    'mean': (False, 'mean'),
+    'first page': (False, None)
+}
+
+# A page of a TIFF is addressed as "<file>#<page number>", a projection as "<file>#max"
+PAGE_PATTERN = re.compile(r'^(.*\.tiff?)#(\d+|max|mean)$', re.IGNORECASE)
+
+
+def page_spec(path, page):
+    """
+    Build the name of a page or projection of a multi-page TIFF.
+
+    Parameters:
+        path (str): TIFF file
+        page: Page number (starting at 1) or projection name
+
+    Returns:
+        str: Page specification accepted wherever an image path is
+    """
+    return f"{path}#{page}"
+
+
+def output_name(spec):
+    """
+    Build a name for files derived from an image (annotated copies, heatmaps). It keeps the
+    file name with its extension and the page, and adds a short hash of the absolute path,
+    so images with the same name in different folders or with different extensions get
+    different files.
+
+    Parameters:
+        spec (str): Image path or page specification
+
+    Returns:
+        str: File name without extension
+    """
+    path, page = split_page(spec)
+    name = os.path.basename(path) + (f"_{page}" if page is not None else "")
+    digest = hashlib.sha1(os.path.abspath(spec).encode('utf-8')).hexdigest()[:8]
+    return re.sub(r'[^\w.-]', '_', name) + f"_{digest}"
+
+
+def split_page(spec):
+    """
+    Split a page specification into the file and the page.
+
+    Parameters:
+        spec (str): Image path or page specification
+
+    Returns:
+        tuple: (file path, page number or projection name, or None for a plain image path)
+    """
+    match = PAGE_PATTERN.match(spec)
+    if match is None or os.path.exists(spec):
+        return spec, None
+    page = match.group(2).lower()
+    return match.group(1), int(page) if page.isdigit() else page
+
+
+def _page_indices(path):
+    """
+    Get the indices of the full resolution pages of a TIFF. Reduced resolution pages
+    (pyramid levels stored as pages) are skipped.
+    """
+    if tifffile is not None:
+        with tifffile.TiffFile(path) as tif:
+            return [i for i, page in enumerate(tif.pages) if not page.is_reduced]
+    with Image.open(path) as img:
+        indices = []
+        for i in range(getattr(img, 'n_frames', 1)):
+            img.seek(i)
+            if not int(img.tag_v2.get(254, 0)) & 1:
+                indices.append(i)
+        return indices
+
+
+def page_count(path):
+    """
+    Count the full resolution pages of an image file.
+
+    Parameters:
+        path (str): Image file
+
+    Returns:
+        int: Number of pages (1 for anything but a readable multi-page TIFF)
+    """
+    if not path.lower().endswith(('.tif', '.tiff')):
+        return 1
+    try:
+        return max(1, len(_page_indices(path)))
+    except Exception:
+        return 1
+
+
+def image_size(spec):
+    """
+    Read the dimensions of an image, page or projection from the file header, without
+    decoding the pixels.
+
+    Parameters:
+        spec (str): Image path or page specification
+
+    Returns:
+        tuple: (width, height), or None if the header cannot be read
+    """
+    path, page = split_page(spec)
+    try:
+        if tifffile is not None and path.lower().endswith(('.tif', '.tiff')):
+            with tifffile.TiffFile(path) as tif:
+                indices = [i for i, p in enumerate(tif.pages) if not p.is_reduced]
+                tiff_page = tif.pages[indices[page - 1] if isinstance(page, int) else indices[0]]
+                return int(tiff_page.imagewidth), int(tiff_page.imagelength)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            with Image.open(path) as img:
+                if isinstance(page, int):
+                    img.seek(_page_indices(path)[page - 1])
+                return img.size
+    except Exception:
+        return None
+
+
+def _to_bgr(data):
+    """
+    Convert a decoded TIFF page to an 8-bit BGR image like cv2.imread returns.
+    """
+    if data.ndim == 3 and data.shape[0] in (3, 4) and data.shape[2] not in (3, 4):
+        data = np.moveaxis(data, 0, -1)
+    if data.dtype == np.uint16:
+        data = (data >> 8).astype(np.uint8)
+    elif data.dtype != np.uint8:
+        raise ValueError(f"Unsupported sample type {data.dtype}")
+    if data.ndim == 2:
+        return cv2.cvtColor(data, cv2.COLOR_GRAY2BGR)
+    if data.ndim == 3 and data.shape[2] >= 3:
+        return cv2.cvtColor(np.ascontiguousarray(data[:, :, :3]), cv2.COLOR_RGB2BGR)
+    raise ValueError(f"Unsupported page shape {data.shape}")
+
+
+def iter_pages(path, numbers=None):
+    """
+    Decode the full resolution pages of a TIFF one at a time.
+    Only the page being yielded is held in memory.
+
+    Parameters:
+        path (str): TIFF file
+        numbers (list): Page numbers (starting at 1) to read (all pages if None)
+
+    Yields:
+        numpy.ndarray: Page as a BGR image
+    """
+    indices = _page_indices(path)
+    if numbers is not None:
+        indices = [indices[n - 1] for n in numbers]
+    if tifffile is not None:
+        with tifffile.TiffFile(path) as tif:
+            for i in indices:
+                yield _to_bgr(tif.pages[i].asarray())
+    else:
+        with Image.open(path) as img:
+            for i in indices:
+                img.seek(i)
+                yield cv2.cvtColor(np.asarray(img.convert('RGB')), cv2.COLOR_RGB2BGR)
+
+
+def project_pages(pages, method):
+    """
+    Combine the pages of a stack into one image, streaming over the pages.
+
+    The 'max' projection keeps the darkest value of every channel, which is the highest
+    optical density and therefore the strongest stain found in any focal plane (the
+    brightfield counterpart of a fluorescence maximum projection). The 'mean' projection
+    averages the pages.
+
+    Parameters:
+        pages (iterable): BGR images of equal shape
+        method (str): 'max' or 'mean'
+
+    Returns:
+        numpy.ndarray: Projected BGR image, or None if there are no pages
+    """
+    acc = None
+    count = 0
+    for page in pages:
+        if acc is None:
+            acc = page.copy() if method == 'max' else page.astype(np.float32)
+        elif page.shape != acc.shape:
+            raise ValueError("The pages of the stack differ in size")
+        elif method == 'max':
+            np.minimum(acc, page, out=acc)
+        else:
+            acc += page
+        count += 1
+    if acc is None or method == 'max':
+        return acc
+    acc /= count
+    return np.rint(acc, out=acc).astype(np.uint8)
+
+
+def read_image(spec):
+    """
+    Read an image, a page of a multi-page TIFF or the projection of its pages.
+    Plain paths are read with cv2.imread as before.
+
+    Parameters:
+        spec (str): Image path or page specification
+
+    Returns:
+        numpy.ndarray: BGR image, or None if the file cannot be read
+    """
+    path, page = split_page(spec)
+    if page is None:
+        return cv2.imread(path)
+    if not os.path.exists(path):
+        return None
+    if page in PROJECTIONS:
+        return project_pages(iter_pages(path), page)
+    return next(iter_pages(path, [page]))
+
+
+def _thumbnail(img_bgr, size):
+    img = Image.fromarray(cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB))
+    img.thumbnail(size)
+    return img
+
+
+def open_thumbnail(spec, size):
+    """
+    Open the thumbnail of an image, page or projection.
+    Projections are computed from the page thumbnails, so only one page is decoded at a time.
+
+    Parameters:
+        spec (str): Image path or page specification
+        size (tuple): Largest (width, height) of the thumbnail
+
+    Returns:
+        PIL.Image.Image: Thumbnail
+    """
+    path, page = split_page(spec)
+    if page is None:
+        img = Image.open(path)
+        img.thumbnail(size)
+        return img
+    if page in PROJECTIONS:
+        thumbs = (cv2.cvtColor(np.asarray(_thumbnail(p, size)), cv2.COLOR_RGB2BGR) for p in iter_pages(path))
+        return _thumbnail(project_pages(thumbs, page), size)
+    return _thumbnail(next(iter_pages(path, [page])), size)
+
+
+def expand_pages(paths, mode=STACK_MODE):
+    """
+    Replace multi-page TIFFs in a list of images by their pages and/or projection.
+
+    Parameters:
+        paths (list): Image files
+        mode (str): Key of STACK_MODES
+
+    Returns:
+        list: Image paths and page specifications
+    """
+    pages, projection = STACK_MODES[mode]
+    expanded = []
+    for path in paths:
+        count = page_count(path) if split_page(path)[1] is None else 1
+        if count < 2:
+            expanded.append(path)
+            continue
+        if pages:
+            expanded.extend(page_spec(path, n) for n in range(1, count + 1))
+        if projection:
+            expanded.append(page_spec(path, projection))
+        if not pages and not projection:
+            expanded.append(path)
+    return expanded
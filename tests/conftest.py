@@ -0,0 +1,23 @@
+import os
+import sys
+
+import cv2
+import pytest
+
+# The modules live at the top level of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from regression import synthetic_image  # noqa: E402
+
+
+@pytest.fixture
+def write_image(tmp_path):
+    """
+    Factory writing a small synthetic field (as used by the regression corpus) to a file.
+    """
+    def write(relative_path, seed=0, size=(160, 200)):
+        path = tmp_path / relative_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        cv2.imwrite(str(path), synthetic_image(seed, size=size, nuclei=20, brown=8))
+        return str(path)
+    return write
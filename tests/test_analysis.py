@@ -0,0 +1,131 @@
+import cv2
+import numpy as np
+import pytest
+from skimage.color import rgb2hed
+from skimage.measure import regionprops
+
+from analysis import (
+    processing_params, deconvolve, measure_image, analyze_image, tissue_regions, rect_region, plan_tiles,
+    full_region, estimate_memory, PeakMemory, object_measurements, dab_scores
+)
+from regression import PARAM_SETS, synthetic_image
+
+
+def test_density_lookup_matches_rgb2hed():
+    img = synthetic_image(1, size=(96, 128), nuclei=15, brown=5, noise=0.05)
+    hed = np.maximum(rgb2hed(cv2.cvtColor(img, cv2.COLOR_BGR2RGB)), 0)
+    h_chan, d_chan = deconvolve(img)
+    assert np.allclose(h_chan, hed[:, :, 0]) and np.allclose(d_chan, hed[:, :, 2])
+    h_low, d_low = deconvolve(img, low_memory=True)
+    assert h_low.dtype == np.float32
+    assert np.allclose(h_low, h_chan, atol=1e-5) and np.allclose(d_low, d_chan, atol=1e-5)
+
+
+def test_tissue_detection_skips_glass_and_keeps_the_counts():
+    img = synthetic_image(3, size=(512, 640), nuclei=60, brown=20, glass=0.5)
+    regions = tissue_regions(img)
+    covered = np.zeros(img.shape[:2], dtype=np.int32)
+    for rs, cs, mask in regions:
+        covered[rs, cs] += mask if mask is not None else 1
+    assert covered.max() == 1 and covered.mean() < 0.8
+
+    full = analyze_image(img, processing_params(PARAM_SETS['defaults']))
+    tissue = analyze_image(img, processing_params(dict(PARAM_SETS['defaults'], tissue_detection=True)))
+    assert len(tissue['cents_h']) == len(full['cents_h'])
+    assert len(tissue['cents_d']) == len(full['cents_d'])
+    assert tissue['skipped_fraction'] == pytest.approx(1 - covered.mean())
+
+    blank = np.full((128, 128, 3), 250, dtype=np.uint8)
+    assert tissue_regions(blank) == []
+    assert analyze_image(blank, processing_params(dict(PARAM_SETS['defaults'], tissue_detection=True)))['cents_h'] == []
+
+
+def test_roi_restricts_the_analysis_to_a_clipped_rectangle():
+    assert rect_region((100, 80), 90, -5, 10, 500)[:2] == (slice(0, 90), slice(10, 80))
+    img = synthetic_image(4, size=(256, 320), nuclei=60, brown=20)
+    result = analyze_image(img, processing_params(PARAM_SETS['defaults']), roi=(40, 200, 60, 250))
+    cents = np.asarray(result['cents_h'])
+    assert len(cents)
+    assert (cents[:, 0] >= 40).all() and (cents[:, 0] < 200).all()
+    assert (cents[:, 1] >= 60).all() and (cents[:, 1] < 250).all()
+    assert not result['lbl_h'][:40].any() and not result['lbl_h'][:, 250:].any()
+
+
+def test_untiled_low_memory_runs_give_the_default_results():
+    img = synthetic_image(5, size=(256, 320), nuclei=80, brown=30, cluster=True)
+    for name in ('defaults', 'otsu', 'fine'):
+        default = analyze_image(img, processing_params(PARAM_SETS[name]))
+        low = analyze_image(img, processing_params(dict(PARAM_SETS[name], low_memory=True)))
+        assert np.array_equal(low['lbl_h'], default['lbl_h'])
+        assert np.array_equal(low['lbl_d'], default['lbl_d'])
+        assert np.array_equal(low['cents_h'], default['cents_h'])
+
+
+def test_tile_cores_cover_the_image_once():
+    shape = (700, 900)
+    params = processing_params(dict(PARAM_SETS['defaults'], low_memory=True, memory_budget_mb=4))
+    regions = [full_region(shape)]
+    tiles = plan_tiles(shape, regions, params)
+    assert len(tiles) > 1
+    covered = np.zeros(shape, dtype=np.int32)
+    for rs, cs, _, (core_rs, core_cs) in tiles:
+        covered[core_rs, core_cs] += 1
+        assert rs.start <= core_rs.start and core_rs.stop <= rs.stop
+    assert (covered == 1).all()
+    assert plan_tiles(shape, regions, processing_params(PARAM_SETS['defaults'])) is regions
+
+
+def test_tiled_runs_count_nuclei_like_whole_images():
+    img = synthetic_image(6, size=(600, 800), nuclei=300, brown=100)
+    whole = analyze_image(img, processing_params(PARAM_SETS['defaults']))
+    tiled = analyze_image(img, processing_params(dict(PARAM_SETS['defaults'], low_memory=True, memory_budget_mb=4)))
+    assert abs(len(tiled['cents_h']) - len(whole['cents_h'])) <= 3
+    assert len(tiled['cents_d']) == len(whole['cents_d'])
+    assert tiled['lbl_h'].max() >= len(tiled['cents_h'])
+
+
+def test_memory_estimates_respect_the_budget():
+    default = estimate_memory((4000, 3000), processing_params(PARAM_SETS['defaults']))
+    low = estimate_memory((4000, 3000), processing_params(dict(PARAM_SETS['defaults'], low_memory=True,
+                                                               memory_budget_mb=512)))
+    assert low < default
+    assert low <= 512 * 2 ** 20
+    with PeakMemory() as peak:
+        np.ones(2 ** 20)
+    assert peak.peak_mb >= 7.9
+    with PeakMemory(False) as peak:
+        pass
+    assert peak.peak_mb is None
+
+
+def test_object_measurements_match_regionprops():
+    img = synthetic_image(7, size=(300, 260), nuclei=50, brown=20)
+    result = analyze_image(img, processing_params(PARAM_SETS['defaults']))
+    h_chan, d_chan = deconvolve(img)
+    table = object_measurements(result['lbl_h'], h_chan, d_chan, chunk_rows=17)
+    props = regionprops(result['lbl_h'], intensity_image=d_chan)
+    assert table['label'].tolist() == [p.label for p in props]
+    assert table['area'].tolist() == [p.area for p in props]
+    assert np.allclose(np.column_stack([table['row'], table['col']]), [p.centroid for p in props])
+    assert np.allclose(table['mean_d'], [p.intensity_mean for p in props], rtol=1e-5)
+    assert np.allclose(table['max_d'], [p.intensity_max for p in props], rtol=1e-5)
+    assert np.array_equal(result['objects_h']['label'], table['label'])
+
+
+def test_dab_scores_and_h_score():
+    scores = dab_scores([0.0, 0.02, 0.02, 0.05, 0.1], thresholds=(0.015, 0.03, 0.06))
+    assert [scores[f'dab_{i}_count'] for i in range(4)] == [1, 2, 1, 1]
+    assert scores['pct_dab_positive'] == pytest.approx(80)
+    assert scores['h_score'] == pytest.approx(40 + 2 * 20 + 3 * 20)
+    assert scores['mean_nuclear_dab'] == pytest.approx(0.038)
+    assert dab_scores([0.015, 0.03, 0.06])['h_score'] == pytest.approx(200)
+    empty = dab_scores([])
+    assert empty['h_score'] == 0 and empty['mean_nuclear_dab'] is None
+
+
+def test_measured_images_score_their_counted_nuclei(write_image):
+    path = write_image('a.png', seed=8)
+    params = processing_params(PARAM_SETS['defaults'])
+    result = measure_image(path, params, measure_objects=True)
+    counted = result['objects_h']['area'] > params['min_area_h']
+    assert sum(result[f'dab_{i}_count'] for i in range(4)) == result['blue_count'] == counted.sum()
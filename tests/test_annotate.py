@@ -0,0 +1,72 @@
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from annotate import AnnotationWriter, label_outlines, render_annotation
+from overlay import BLUE_MARKER, RED_MARKER
+
+
+def test_output_paths_are_unique_per_image(tmp_path):
+    writer = AnnotationWriter(str(tmp_path / 'out'))
+    paths = [writer.output_path(p) for p in ('a/x.png', 'a/x.jpg', 'b/x.png', 'a/s.tif#2', 'a/s.tif#3')]
+    writer.close()
+    assert len(set(paths)) == len(paths)
+    assert all(os.path.dirname(p) == str(tmp_path / 'out') for p in paths)
+    assert os.path.basename(paths[0]).startswith('x.png_')
+    assert writer.output_path('a/x.png') == paths[0]
+
+
+def test_label_outlines_mark_object_borders():
+    lbl = np.zeros((7, 7), dtype=np.int32)
+    lbl[1:6, 1:6] = 1
+    edge = label_outlines(lbl)
+    assert edge[1, 1:6].all() and edge[1:6, 1].all()
+    assert not edge[2:5, 2:5].any()
+    assert not edge[lbl == 0].any()
+
+
+def test_render_annotation_stamps_markers():
+    img = np.full((20, 20, 3), 255, dtype=np.uint8)
+    render_annotation(img, [(5, 5)], [(15, 12)], marker_radius=1)
+    assert tuple(img[5, 5]) == BLUE_MARKER[::-1]
+    assert tuple(img[15, 12]) == RED_MARKER[::-1]
+    assert tuple(img[0, 0]) == (255, 255, 255)
+
+
+def test_writer_writes_every_image(tmp_path, write_image):
+    images = [write_image(f'{folder}/x.png', seed=i) for i, folder in enumerate('ab')]
+    writer = AnnotationWriter(str(tmp_path / 'out'), 'png', 1, workers=2, max_pending=1)
+    paths = [writer.submit(path, [(10, 10)], [(20, 20)]) for path in images]
+    writer.close()
+    assert writer.errors == {} and writer.written == 2
+    for path, image in zip(paths, images):
+        assert cv2.imread(path).shape == cv2.imread(image).shape
+
+
+def test_submit_waits_for_a_free_slot(tmp_path, write_image, monkeypatch):
+    image = write_image('x.png')
+    release = threading.Event()
+    writer = AnnotationWriter(str(tmp_path / 'out'), workers=1, max_pending=1)
+    monkeypatch.setattr(writer, '_write', lambda *args: release.wait(5))
+    writer.submit(image, [], [])
+
+    threading.Timer(0.3, release.set).start()
+    start = time.perf_counter()
+    writer.submit(image, [], [])
+    assert time.perf_counter() - start >= 0.25
+    writer.close()
+
+
+def test_cancel_stops_waiting(tmp_path, write_image, monkeypatch):
+    image = write_image('x.png')
+    cancel, release = threading.Event(), threading.Event()
+    writer = AnnotationWriter(str(tmp_path / 'out'), workers=1, max_pending=1, cancel_event=cancel)
+    monkeypatch.setattr(writer, '_write', lambda *args: release.wait(5))
+    writer.submit(image, [], [])
+    cancel.set()
+    assert writer.submit(image, [], []) is None
+    release.set()
+    writer.close(cancel=True)
@@ -0,0 +1,140 @@
+import queue
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import main
+from journal import RunJournal
+from main import BulkProcessorApp
+from regression import PARAM_SETS
+
+PARAMS = dict(PARAM_SETS['defaults'], marker_radius=2)
+
+
+@pytest.fixture
+def app(monkeypatch):
+    # The worker loop only needs the result queue; no Tk widgets are created
+    monkeypatch.setattr(main, 'BULK_WORKERS', 1)
+    app = object.__new__(BulkProcessorApp)
+    app.result_queue = queue.Queue()
+    return app
+
+
+def run(app, image_files, journal, cancel_event=None, completed=None):
+    app._run_batch(1, image_files, PARAMS, journal, completed or {}, cancel_event or threading.Event())
+    messages = []
+    while not app.result_queue.empty():
+        messages.append(app.result_queue.get())
+    return messages
+
+
+def test_results_are_queued_in_listing_order(app, tmp_path, write_image):
+    paths = [write_image('b.png', seed=2), write_image('a.png', seed=1), str(tmp_path / 'missing.png')]
+    shutil.copyfile(paths[0], tmp_path / 'copy.png')
+    paths.insert(2, str(tmp_path / 'copy.png'))
+    journal = RunJournal(str(tmp_path / 'journal.jsonl'))
+    messages = run(app, paths, journal)
+
+    assert [kind for kind, *_ in messages] == ['image'] * 4 + ['finished']
+    assert [path for _, _, path, *_ in messages[:4]] == paths
+    results = [result for _, _, _, result, _, _ in messages[:4]]
+    assert results[0]['filename'] == 'b.png' and results[3] is None
+    assert results[2]['duplicate_of'] == 'b.png'
+    assert results[2]['blue_count'] == results[0]['blue_count']
+    # A finished run leaves nothing to resume
+    assert RunJournal(journal.path).completed(PARAMS) == {}
+
+
+def test_cancelled_runs_report_nothing_and_keep_the_journal(app, tmp_path, write_image):
+    paths = [write_image('a.png', seed=1), write_image('b.png', seed=2)]
+    journal = RunJournal(str(tmp_path / 'journal.jsonl'))
+    journal.record(paths[0], PARAMS, {'filename': 'a.png', 'blue_count': 1})
+    cancel = threading.Event()
+    cancel.set()
+    messages = run(app, paths, journal, cancel)
+    assert messages == [('finished', 1, None, None, False, None)]
+    assert set(RunJournal(journal.path).completed(PARAMS)) == {paths[0]}
+
+
+def test_images_are_journaled_as_they_finish(app, tmp_path, write_image, monkeypatch):
+    # The first listed image is the smallest, so it is started last
+    paths = [write_image('small.png', seed=1, size=(80, 100))] + [write_image(f'{i}.png', seed=i) for i in (2, 3)]
+    journal = RunJournal(str(tmp_path / 'journal.jsonl'))
+    journaled = []
+    record = journal.record
+    monkeypatch.setattr(journal, 'record', lambda path, *args: journaled.append(path) or record(path, *args))
+    held_back = []
+    measure = main.measure_task
+
+    def measure_task(image_path, *args):
+        if image_path == paths[0]:
+            # Hold back the first image until the others are journaled
+            deadline = time.monotonic() + 10
+            while len(journaled) < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            held_back.append(list(journaled))
+        return measure(image_path, *args)
+
+    monkeypatch.setattr(main, 'BULK_WORKERS', 3)
+    monkeypatch.setattr(main, 'ProcessPoolExecutor', lambda max_workers, mp_context: ThreadPoolExecutor(max_workers))
+    monkeypatch.setattr(main, 'measure_task', measure_task)
+    messages = run(app, paths, journal)
+
+    assert [sorted(seen) for seen in held_back] == [sorted(paths[1:])]
+    assert journaled[2] == paths[0]
+    # The display still follows the listing
+    assert [path for _, _, path, *_ in messages[:3]] == paths
+
+
+class Stub:
+    # Stands in for the Tk widgets and variables touched when results are polled
+    def __init__(self):
+        self.value = None
+
+    def winfo_exists(self):
+        return True
+
+    def after(self, *args):
+        pass
+
+    def config(self, **kwargs):
+        pass
+
+    def set(self, value):
+        self.value = value
+
+
+def test_failures_are_reported_in_the_status_bar(app, tmp_path):
+    app.run_id, app.results = 1, []
+    app.master, app.status_var, app.process_btn, app.cancel_btn = Stub(), Stub(), Stub(), Stub()
+    app.add_result_row = app.flag_near_duplicates = lambda result: None
+    app.cancel_event = threading.Event()
+    app.run_state = {'total': 3, 'done': 0, 'processed': 0, 'resumed': 0, 'remaining': 3,
+                     'failed': 0, 'annotation_failed': 0, 'start': 0}
+
+    app.result_queue.put(('image', 1, 'a.png', {'filename': 'a.png'}, False, None))
+    app.result_queue.put(('image', 1, 'b.png', None, False, "Could not read image"))
+    app._poll_results()
+    assert app.status_var.value.startswith("Processed 2 of 3 image(s)")
+    assert app.status_var.value.endswith(" | 1 failed")
+
+    app.result_queue.put(('image', 1, 'c.png', None, False, "boom"))
+    app.result_queue.put(('annotation', 1, 'a.png', None, False, "disk full"))
+    app.result_queue.put(('finished', 1, None, None, False, None))
+    app._poll_results()
+    assert app.run_state['done'] == 3
+    assert app.status_var.value.endswith(" | 2 failed, 1 annotated image(s) not written")
+
+
+def test_journaled_images_are_not_hashed_again(app, tmp_path, write_image, monkeypatch):
+    paths = [write_image('a.png', seed=1), write_image('b.png', seed=2)]
+    journal = RunJournal(str(tmp_path / 'journal.jsonl'))
+    journal.record(paths[0], PARAMS, {'filename': 'a.png', 'blue_count': 1})
+    hashed = []
+    monkeypatch.setattr(main, 'DUPLICATE_DETECTION', True)
+    monkeypatch.setattr(main, 'exact_duplicates', lambda image_paths: hashed.extend(image_paths) or {})
+    run(app, paths, journal, completed=journal.completed(PARAMS))
+    assert hashed == paths[1:]
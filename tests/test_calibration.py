@@ -0,0 +1,50 @@
+import json
+
+import cv2
+import pytest
+from skimage.filters import threshold_otsu
+
+from analysis import deconvolve
+from calibration import sample_images, calibrate, save_calibration, load_calibration, apply_calibration
+from regression import PARAM_SETS
+
+
+def test_samples_spread_over_the_sorted_batch():
+    paths = [f"{i:02d}.png" for i in range(10, 0, -1)]
+    assert sample_images(paths, 3) == ['01.png', '05.png', '10.png']
+    assert sample_images(paths, 0) == sorted(paths)
+    assert sample_images(paths, 20) == sorted(paths)
+
+
+def test_unsampled_calibration_gives_the_otsu_thresholds_of_the_pooled_pixels(write_image):
+    path = write_image('a.png', seed=5)
+    h_chan, d_chan = deconvolve(cv2.imread(path))
+    calibration = calibrate([path, 'missing.png'], PARAM_SETS['otsu'], sample_count=0, pixels_per_image=10 ** 9)
+    assert calibration['h_threshold'] == pytest.approx(threshold_otsu(h_chan))
+    assert calibration['d_threshold'] == pytest.approx(threshold_otsu(d_chan))
+    assert calibration['sampled_pixels'] == h_chan.size
+    assert calibration['batch_images'] == 2 and len(calibration['images']) == 1
+
+
+def test_sampling_limits_the_pixels_per_image(write_image):
+    paths = [write_image('a.png', seed=1), write_image('b.png', seed=2)]
+    progress = []
+    calibration = calibrate(paths, PARAM_SETS['otsu'], pixels_per_image=2000,
+                            progress=lambda done, total: progress.append((done, total)))
+    assert calibration['sampled_pixels'] <= 2 * 2000
+    assert progress == [(1, 2), (2, 2)]
+
+
+def test_calibration_files_round_trip(tmp_path):
+    path = str(tmp_path / 'calibration.json')
+    calibration = {'version': 1, 'h_threshold': 0.1, 'd_threshold': 0.02}
+    save_calibration(path, calibration)
+    assert load_calibration(path) == calibration
+    assert apply_calibration({'h_threshold': None, 'disk_size': 2}, calibration) == \
+        {'h_threshold': 0.1, 'd_threshold': 0.02, 'disk_size': 2}
+    assert apply_calibration({'h_threshold': 0.3}, None) == {'h_threshold': 0.3}
+
+    with open(path, 'w') as f:
+        json.dump({'h_threshold': 0.1}, f)
+    with pytest.raises(ValueError):
+        load_calibration(path)
@@ -0,0 +1,43 @@
+import os
+
+import numpy as np
+
+from density import DensityMap, export_maps, heatmap_image
+
+
+def test_points_are_binned_per_cell():
+    density = DensityMap((600, 300), cell_size=256)
+    assert density.shape == (2, 3)
+    density.add_nuclei([(10, 10), (10, 300), (299, 599)], positive=[True, False, True])
+    density.add_brown([(260, 20)])
+    assert density.nuclei.tolist() == [[1, 1, 0], [0, 0, 1]]
+    assert density.positive.tolist() == [[1, 0, 0], [0, 0, 1]]
+    assert density.brown.sum() == 1 and density.brown[1, 0] == 1
+    fraction = density.positive_fraction()
+    assert fraction[0, 0] == 1 and fraction[0, 1] == 0 and np.isnan(fraction[1, 0])
+
+
+def test_save_and_load_round_trip(tmp_path):
+    density = DensityMap((300, 300), cell_size=100)
+    density.add_nuclei(np.random.default_rng(0).uniform(0, 300, (50, 2)))
+    path = str(tmp_path / 'maps' / 'x.npz')
+    density.save(path)
+    loaded = DensityMap.load(path)
+    assert loaded.cell_size == 100
+    assert np.array_equal(loaded.nuclei, density.nuclei)
+
+
+def test_heatmap_keeps_cells_visible():
+    img = heatmap_image(np.array([[0, 1], [2, np.nan]]), min_side=64)
+    assert img.shape == (64, 64, 3)
+
+
+def test_export_maps_of_same_named_images_do_not_collide(tmp_path):
+    results = []
+    for folder in ('a', 'b'):
+        density = DensityMap((100, 100), cell_size=50)
+        path = str(tmp_path / folder / 'x.npz')
+        density.save(path)
+        results.append({'filename': 'x.png', 'image_path': str(tmp_path / folder / 'x.png'), 'density_file': path})
+    assert export_maps(results, str(tmp_path / 'results.csv')) == 2
+    assert len(os.listdir(tmp_path / 'results_density')) == 6
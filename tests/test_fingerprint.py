@@ -0,0 +1,86 @@
+import io
+import shutil
+
+import cv2
+from PIL import Image
+
+import fingerprint
+from fingerprint import exact_duplicates, file_digest, perceptual_hash, NearDuplicateIndex
+from regression import synthetic_image
+
+
+def pil_image(seed, quality=None):
+    rgb = cv2.cvtColor(synthetic_image(seed, size=(160, 200), nuclei=20, brown=8), cv2.COLOR_BGR2RGB)
+    img = Image.fromarray(rgb)
+    if quality is not None:
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG', quality=quality)
+        img = Image.open(buffer)
+    return img
+
+
+def test_exact_duplicates_point_to_the_first_copy(tmp_path, write_image):
+    first = write_image('a.png', seed=1)
+    other = write_image('b.png', seed=2)
+    copies = [str(tmp_path / 'copy1.png'), str(tmp_path / 'sub' / 'copy2.png')]
+    (tmp_path / 'sub').mkdir()
+    for copy in copies:
+        shutil.copyfile(first, copy)
+    missing = str(tmp_path / 'missing.png')
+
+    duplicates = exact_duplicates([first, other, missing] + copies)
+    assert duplicates == {copies[0]: first, copies[1]: first}
+    assert file_digest(copies[1]) == file_digest(first)
+
+
+def test_same_size_files_with_other_contents_are_not_duplicates(tmp_path):
+    paths = []
+    for name, content in (('a', b'1234'), ('b', b'1235')):
+        path = tmp_path / name
+        path.write_bytes(content)
+        paths.append(str(path))
+    assert exact_duplicates(paths) == {}
+
+
+def test_reencoded_images_are_near_duplicates():
+    original = perceptual_hash(pil_image(1))
+    index = NearDuplicateIndex(max_distance=24)
+    assert index.add('original', original) == []
+    assert index.add('other field', perceptual_hash(pil_image(2))) == []
+    assert index.add('jpeg', perceptual_hash(pil_image(1, quality=60))) == ['original']
+
+
+def test_images_of_one_group_are_not_reported():
+    index = NearDuplicateIndex(max_distance=0)
+    hash_hex = perceptual_hash(pil_image(3))
+    index.add('a', hash_hex, group='g')
+    assert index.add('b', hash_hex, group='g') == []
+    assert index.add('c', hash_hex) == ['a', 'b']
+
+
+def test_index_grows_past_its_initial_table():
+    index = NearDuplicateIndex(max_distance=0)
+    for i in range(40):
+        index.add(i, f"{i:064x}")
+    assert index.add('again', f"{7:064x}") == [7]
+    assert len(index.hashes) >= 41
+
+
+def test_only_files_matching_at_both_ends_are_read_completely(tmp_path, monkeypatch):
+    contents = {'a': b'head' + b'0' * 32 + b'tail', 'b': b'head' + b'0' * 32 + b'tail',
+                'c': b'head0000' + b'1' * 24 + b'0000tail', 'd': b'HEAD' + b'0' * 32 + b'tail'}
+    paths = []
+    for name, content in contents.items():
+        path = tmp_path / name
+        path.write_bytes(content)
+        paths.append(str(path))
+    read = []
+    digest = fingerprint.file_digest
+    monkeypatch.setattr(fingerprint, 'file_digest', lambda path, *args: read.append(path) or digest(path, *args))
+
+    assert exact_duplicates(paths, chunk_size=8) == {paths[1]: paths[0]}
+    assert read == paths[:3]
+    # Files of up to two chunks are settled by their partial digest
+    read.clear()
+    assert exact_duplicates(paths, chunk_size=32) == {paths[1]: paths[0]}
+    assert read == []
@@ -0,0 +1,83 @@
+import os
+import time
+
+import numpy as np
+
+import hedcache
+from hedcache import HEDCache
+
+STATS = {'h_min': 0.0, 'h_max': 1.0, 'h_otsu': 0.5, 'd_min': 0.0, 'd_max': 1.0, 'd_otsu': 0.5}
+
+
+def planes(value, side=32):
+    return np.full((side, side), value, dtype=np.float64), np.full((side, side), -value, dtype=np.float64)
+
+
+def entry_keys(cache):
+    return sorted(name[:-len('.json')] for name in os.listdir(cache.folder) if name.endswith('.json'))
+
+
+def age(cache, key, seconds):
+    for path in cache._paths(key):
+        stamp = time.time() - seconds
+        os.utime(path, (stamp, stamp))
+
+
+def test_store_and_load_memory_mapped(tmp_path):
+    cache = HEDCache(str(tmp_path), 2 ** 20)
+    h_chan, d_chan = planes(0.25)
+    assert cache.store('k', h_chan, d_chan, STATS)
+    loaded = cache.load('k')
+    assert isinstance(loaded[0], np.memmap) and not loaded[0].flags.writeable
+    assert np.array_equal(loaded[0], h_chan) and np.array_equal(loaded[1], d_chan)
+    assert loaded[2] == STATS
+    assert cache.load('missing') is None
+
+
+def test_key_follows_file_contents(tmp_path):
+    cache = HEDCache(str(tmp_path / 'cache'))
+    for name in ('a.png', 'b.png', 'c.png'):
+        (tmp_path / name).write_bytes(b'same' if name != 'c.png' else b'other')
+    assert cache.key(str(tmp_path / 'a.png')) == cache.key(str(tmp_path / 'b.png'))
+    assert cache.key(str(tmp_path / 'a.png')) != cache.key(str(tmp_path / 'c.png'))
+    assert cache.key(str(tmp_path / 'missing.png')) is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    entry_bytes = 2 * (32 * 32 * 8 + 128)
+    cache = HEDCache(str(tmp_path), int(2.5 * entry_bytes))
+    cache.store('a', *planes(1), STATS)
+    cache.store('b', *planes(2), STATS)
+    age(cache, 'a', 20)
+    age(cache, 'b', 10)
+    cache.load('a')  # a is now the most recently used
+
+    cache.store('c', *planes(3), STATS)
+    assert entry_keys(cache) == ['a', 'c']
+
+
+def test_entries_larger_than_the_cache_are_not_stored(tmp_path):
+    cache = HEDCache(str(tmp_path), 1000)
+    assert not cache.store('a', *planes(1), STATS)
+    assert cache.load('a') is None
+
+
+def test_stale_temporary_files_are_removed(tmp_path):
+    cache = HEDCache(str(tmp_path), 10 ** 6)
+    stale, fresh = tmp_path / 'x_h.npy.tmp.npy', tmp_path / 'y_h.npy.tmp.npy'
+    stale.write_bytes(b'0' * 100)
+    fresh.write_bytes(b'0' * 100)
+    old = time.time() - hedcache.STALE_TMP_SECONDS - 1
+    os.utime(stale, (old, old))
+
+    cache.evict()
+    assert not stale.exists() and fresh.exists()
+
+
+def test_recent_temporary_files_count_towards_the_cap(tmp_path):
+    entry_bytes = 2 * (32 * 32 * 8 + 128)
+    cache = HEDCache(str(tmp_path), int(1.5 * entry_bytes))
+    cache.store('a', *planes(1), STATS)
+    (tmp_path / 'b_h.npy.tmp.npy').write_bytes(b'0' * entry_bytes)
+    cache.evict()
+    assert entry_keys(cache) == []
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+from skimage.filters import threshold_otsu
+
+from histogram import channel_histogram
+
+
+def test_otsu_matches_skimage():
+    plane = np.random.default_rng(0).gamma(2.0, 0.05, (300, 400))
+    assert channel_histogram([(plane, None)]).otsu() == threshold_otsu(plane)
+
+
+def test_parts_and_masks_pool_their_pixels():
+    rng = np.random.default_rng(1)
+    first, second = rng.random((50, 60)), rng.normal(0.5, 0.2, (40, 30))
+    mask = rng.random(second.shape) > 0.5
+    pooled = np.concatenate([first.ravel(), second[mask]])
+    stats = channel_histogram([(first, None), (second, mask)])
+    assert stats.sampled == stats.total == pooled.size
+    assert (stats.min, stats.max) == (pooled.min(), pooled.max())
+    assert np.array_equal(stats.counts, np.histogram(pooled, bins=256, range=(pooled.min(), pooled.max()))[0])
+    assert stats.otsu() == threshold_otsu(pooled)
+    assert stats.percentile(50) == pytest.approx(np.median(pooled), abs=stats.bin_width)
+
+
+def test_sampled_histograms_bound_their_error():
+    plane = np.random.default_rng(2).random((400, 500))
+    stats = channel_histogram([(plane, None)], sample_pixels=10000)
+    assert stats.sampled < stats.total == plane.size
+    assert 0 < stats.cdf_error() < 0.02
+    exact = np.cumsum(np.histogram(plane, bins=stats.edges)[0]) / plane.size
+    assert np.abs(np.cumsum(stats.counts) / stats.sampled - exact).max() <= stats.cdf_error()
+    assert channel_histogram([(plane, None)]).cdf_error() == 0
+
+
+def test_constant_and_empty_planes():
+    constant = channel_histogram([(np.full((10, 10), 0.25), None)])
+    assert constant.otsu() == 0.25
+    empty = channel_histogram([(np.ones((5, 5)), np.zeros((5, 5), dtype=bool))])
+    assert empty.sampled == 0 and empty.otsu() == 0.0
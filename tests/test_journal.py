@@ -0,0 +1,89 @@
+import json
+import os
+
+import pytest
+
+from journal import RunJournal
+
+PARAMS = {'h_threshold': 0.1, 'min_area_h': 2}
+OTHER = {'h_threshold': 0.2, 'min_area_h': 2}
+
+
+@pytest.fixture
+def images(tmp_path):
+    paths = []
+    for name in ('a.png', 'b.png', 'c.png'):
+        path = tmp_path / name
+        path.write_bytes(name.encode())
+        paths.append(str(path))
+    return paths
+
+
+def make_journal(tmp_path):
+    return RunJournal(str(tmp_path / '.dotcounter_journal.jsonl'))
+
+
+def test_completed_matches_parameters(tmp_path, images):
+    journal = make_journal(tmp_path)
+    journal.record(images[0], PARAMS, {'blue_count': 1})
+    journal.record(images[1], OTHER, {'blue_count': 2})
+    journal.close()
+
+    done = journal.completed(PARAMS)
+    assert list(done) == [os.path.abspath(images[0])]
+    assert done[os.path.abspath(images[0])]['result'] == {'blue_count': 1}
+
+
+def test_changed_file_is_not_completed(tmp_path, images):
+    journal = make_journal(tmp_path)
+    journal.record(images[0], PARAMS, {})
+    journal.close()
+    with open(images[0], 'ab') as f:
+        f.write(b'changed')
+    assert journal.completed(PARAMS) == {}
+
+
+def test_partial_trailing_line_is_ignored(tmp_path, images):
+    journal = make_journal(tmp_path)
+    journal.record(images[0], PARAMS, {})
+    journal.close()
+    with open(journal.path, 'a') as f:
+        f.write('{"type": "image", "sig')
+    assert len(journal.completed(PARAMS)) == 1
+
+    # Appending after the broken line starts a new line
+    journal.record(images[1], PARAMS, {})
+    journal.close()
+    assert len(journal.completed(PARAMS)) == 2
+
+
+def test_discard_keeps_other_parameters(tmp_path, images):
+    journal = make_journal(tmp_path)
+    journal.record(images[0], PARAMS, {})
+    journal.record(images[1], OTHER, {})
+    journal.discard(PARAMS)
+
+    assert journal.completed(PARAMS) == {}
+    assert list(journal.completed(OTHER)) == [os.path.abspath(images[1])]
+
+
+def test_discard_limited_to_images(tmp_path, images):
+    journal = make_journal(tmp_path)
+    for path in images:
+        journal.record(path, PARAMS, {})
+    journal.discard(PARAMS, images[:2])
+
+    assert list(journal.completed(PARAMS)) == [os.path.abspath(images[2])]
+
+
+def test_discard_of_last_records_removes_file(tmp_path, images):
+    journal = make_journal(tmp_path)
+    journal.record(images[0], PARAMS, {})
+    journal.discard(PARAMS)
+    assert not os.path.exists(journal.path)
+
+    # The journal can be written again afterwards
+    journal.record(images[1], PARAMS, {})
+    journal.close()
+    with open(journal.path) as f:
+        assert [json.loads(line)['signature']['path'] for line in f] == [os.path.abspath(images[1])]
@@ -0,0 +1,53 @@
+import numpy as np
+from skimage.measure import regionprops
+
+from analysis import analyze_image, processing_params
+from labels import RunLengthLabels, save_labels, load_labels
+from regression import PARAM_SETS, synthetic_image
+
+
+def segmented_labels():
+    result = analyze_image(synthetic_image(0, size=(160, 200), nuclei=40, brown=12),
+                           processing_params(PARAM_SETS['defaults']))
+    return result['lbl_h'], result['lbl_d']
+
+
+def test_encode_decode_round_trip():
+    lbl_h, lbl_d = segmented_labels()
+    for lbl in (lbl_h, lbl_d):
+        assert np.array_equal(RunLengthLabels.encode(lbl).decode(), lbl)
+
+
+def test_runs_stop_at_row_ends_and_skip_background():
+    lbl = np.array([[0, 3, 3],
+                    [3, 3, 0],
+                    [0, 0, 0]], dtype=np.int32)
+    runs = RunLengthLabels.encode(lbl)
+    assert runs.starts.tolist() == [1, 3]
+    assert runs.lengths.tolist() == [2, 2]
+    assert runs.values.tolist() == [3, 3]
+    assert np.array_equal(runs.decode(), lbl)
+
+
+def test_empty_label_images_round_trip():
+    for shape in ((0, 5), (4, 6)):
+        lbl = np.zeros(shape, dtype=np.int32)
+        runs = RunLengthLabels.encode(lbl)
+        assert len(runs.starts) == 0
+        assert np.array_equal(runs.decode(), lbl)
+
+
+def test_centroids_match_regionprops():
+    lbl_h, _ = segmented_labels()
+    expected = [r.centroid for r in regionprops(lbl_h) if r.area > 2]
+    assert np.allclose(RunLengthLabels.encode(lbl_h).centroids(2), expected)
+
+
+def test_save_and_load_round_trip(tmp_path):
+    lbl_h, lbl_d = segmented_labels()
+    path = str(tmp_path / 'labels' / 'x.npz')
+    save_labels(path, lbl_h, lbl_d)
+    runs_h, runs_d = load_labels(path)
+    assert runs_h.shape == lbl_h.shape
+    assert np.array_equal(runs_h.decode(), lbl_h)
+    assert np.array_equal(runs_d.decode(), lbl_d)
@@ -0,0 +1,61 @@
+import pytest
+
+from metrics import StageTimer, MetricsLog, metrics_record, read_records, summarize, format_report
+
+
+def test_repeated_stages_add_up():
+    timer = StageTimer()
+    for _ in range(3):
+        with timer.stage('segment'):
+            pass
+    with pytest.raises(ValueError):
+        with timer.stage('read'):
+            raise ValueError
+    assert set(timer.stages) == {'segment', 'read'}
+    assert all(ms >= 0 for ms in timer.stages.values())
+
+
+def test_records_take_size_and_counts_from_the_result(write_image):
+    path = write_image('a.png')
+    timer = StageTimer()
+    timer.stages['read'] = 1.234
+    record = metrics_record('bulk', path, timer, 12.345, {'image_size': (200, 100), 'blue_count': 7},
+                            cache={'hed': True}, error=None)
+    assert record['filename'] == 'a.png'
+    assert record['file_bytes'] > 0
+    assert (record['width'], record['height'], record['megapixels']) == (200, 100, 0.02)
+    assert record['stages_ms'] == {'read': 1.23}
+    assert record['blue_count'] == 7
+    assert record['error'] is None
+
+
+def test_logs_are_read_back_from_folders_skipping_torn_lines(tmp_path):
+    log = MetricsLog(str(tmp_path / 'metrics' / 'worker1.jsonl'))
+    for i in range(3):
+        log.write({'time': 100 - i, 'total_ms': 10.0 * (i + 1), 'source': 'worker'})
+    with open(log.path, 'a') as f:
+        f.write('{"time": 1, "total_')
+    records = read_records([str(tmp_path / 'metrics')])
+    assert [record['time'] for record in records] == [98, 99, 100]
+
+
+def test_summary_and_report():
+    records = [
+        {'time': 0, 'source': 'bulk', 'total_ms': 100.0, 'megapixels': 1.0, 'stages_ms': {'segment': 80.0},
+         'cache': {'hed': True}, 'path': 'a.png', 'width': 1000, 'height': 1000},
+        {'time': 30, 'source': 'bulk', 'total_ms': 300.0, 'megapixels': 1.0, 'stages_ms': {'segment': 250.0},
+         'cache': {'hed': False}, 'path': 'b.png', 'width': 1000, 'height': 1000},
+        {'time': 70, 'source': 'service', 'total_ms': 200.0, 'path': 'c.png'}
+    ]
+    summary = summarize(records, slowest=2, interval=60)
+    assert summary['records'] == 3
+    assert summary['sources'] == ['bulk', 'service']
+    assert summary['total_ms']['p50'] == 200
+    assert summary['stages_ms']['segment']['count'] == 2
+    assert summary['cache'] == {'hed': (1, 2)}
+    assert [count for _, count, _ in summary['throughput']] == [2, 1]
+    assert summary['megapixels_per_second'] == pytest.approx(2 / 0.6)
+    assert [record['path'] for record in summary['slowest']] == ['b.png', 'c.png']
+    report = format_report(summary)
+    assert "1 of 2 hit(s)" in report and "b.png" in report
+    assert format_report(summarize([])) == "No metrics records"
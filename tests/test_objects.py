@@ -0,0 +1,63 @@
+import pytest
+
+import objects
+from analysis import measure_image, processing_params
+from objects import ObjectWriter, image_info, read_images, read_objects, summary_results
+from regression import PARAM_SETS
+
+SUMMARY_KEYS = ('blue_count', 'red_count', 'dab_1_count', 'h_score', 'red_near_blue_count')
+
+
+def write_dataset(path, image_paths, params, row_group=16):
+    measured = []
+    writer = ObjectWriter(path, row_group=row_group)
+    for image_path in image_paths:
+        result = measure_image(image_path, params, measure_objects=True)
+        writer.append(image_info(result, params), result['objects_h'], result['objects_d'])
+        measured.append(result)
+    writer.close()
+    return measured
+
+
+@pytest.fixture(params=['parquet', 'npz'])
+def storage(request, monkeypatch):
+    if request.param == 'parquet':
+        pytest.importorskip('pyarrow')
+    else:
+        monkeypatch.setattr(objects, 'pq', None)
+    return request.param
+
+
+def test_summary_reproduces_the_measured_images(tmp_path, write_image, storage):
+    params = processing_params(PARAM_SETS['defaults'])
+    paths = [write_image('a.png', seed=1), write_image('b.png', seed=2)]
+    dataset = str(tmp_path / 'objects')
+    measured = write_dataset(dataset, paths, params)
+
+    assert [info['image_id'] for info in read_images(dataset)] == [0, 1]
+    columns = read_objects(dataset, ['image_id', 'stain'])
+    assert len(columns['image_id']) == sum(len(r['objects_h']['label']) + len(r['objects_d']['label'])
+                                           for r in measured)
+    for summary, result in zip(summary_results(dataset), measured):
+        assert summary['filename'] == result['filename']
+        for key in SUMMARY_KEYS:
+            assert summary[key] == pytest.approx(result[key])
+
+
+def test_summary_refilters_objects_by_area(tmp_path, write_image, storage):
+    params = processing_params(PARAM_SETS['defaults'])
+    path = write_image('a.png', seed=3)
+    dataset = str(tmp_path / 'objects')
+    write_dataset(dataset, [path], params)
+
+    stricter = processing_params(dict(PARAM_SETS['defaults'], min_area_h=10, min_area_d=12))
+    expected = measure_image(path, stricter)
+    summary = summary_results(dataset, min_area_h=10, min_area_d=12)[0]
+    assert summary['blue_count'] == expected['blue_count']
+    assert summary['red_count'] == expected['red_count']
+
+
+def test_empty_dataset_has_no_summary(tmp_path):
+    dataset = str(tmp_path / 'objects')
+    ObjectWriter(dataset).close()
+    assert summary_results(dataset) == []
@@ -0,0 +1,44 @@
+import numpy as np
+from PIL import Image
+
+from overlay import BLUE_MARKER, RED_MARKER, OverlayRenderer, display_points, stamp_offsets
+
+
+def naive_render(base, points, radius, color):
+    out = base.copy()
+    for x, y in points:
+        for dy in range(-radius, radius + 1):
+            for dx in range(-radius, radius + 1):
+                if dy * dy + dx * dx <= radius * radius and 0 <= y + dy < out.shape[0] and 0 <= x + dx < out.shape[1]:
+                    out[y + dy, x + dx] = color
+    return out
+
+
+def test_markers_match_pixel_by_pixel_drawing():
+    base = np.random.default_rng(0).integers(0, 256, (40, 50, 3), dtype=np.uint8)
+    points_h = [(0, 0), (25, 20), (49, 39)]
+    points_d = [(10, 30), (-2, 5)]
+    rendered = np.asarray(OverlayRenderer(Image.fromarray(base)).render(points_h, points_d, 3).convert('RGB'))
+    expected = naive_render(naive_render(base, points_h, 3, BLUE_MARKER), points_d, 3, RED_MARKER)
+    assert np.array_equal(rendered, expected)
+
+
+def test_every_render_starts_from_the_base_image():
+    base = np.zeros((20, 20, 3), dtype=np.uint8)
+    renderer = OverlayRenderer(Image.fromarray(base))
+    renderer.render([(5, 5)], [], 2)
+    image = renderer.render([], [(15, 15)], 2)
+    pixels = np.asarray(image.convert('RGB'))
+    assert not pixels[5, 5].any()
+    assert tuple(pixels[15, 15]) == RED_MARKER
+
+
+def test_stamp_offsets_are_filled_discs():
+    dy, dx = stamp_offsets(0)
+    assert (dy.tolist(), dx.tolist()) == ([0], [0])
+    assert len(stamp_offsets(2)[0]) == 13
+
+
+def test_display_points_swap_and_scale():
+    assert display_points([(10, 20), (3.9, 7.9)], 0.5, 2).tolist() == [[10, 20], [3, 7]]
+    assert display_points([], 1, 1).shape == (0, 2)
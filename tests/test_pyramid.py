@@ -0,0 +1,40 @@
+import cv2
+import numpy as np
+
+from analysis import analyze_image, processing_params
+from pyramid import min_pool, build_pyramid, coarse_level, candidate_mask, validate
+from regression import PARAM_SETS, synthetic_image
+
+
+def test_min_pooling_keeps_the_darkest_pixel_of_every_block():
+    img = np.full((5, 6, 3), 200, dtype=np.uint8)
+    img[1, 3] = (10, 20, 30)
+    pooled = min_pool(img)
+    assert pooled.shape == (2, 3, 3)
+    assert tuple(pooled[0, 1]) == (10, 20, 30)
+    assert (pooled[:, [0, 2]] == 200).all()
+
+
+def test_pyramid_stops_at_the_coarse_side():
+    levels = build_pyramid(np.zeros((1000, 700, 3), dtype=np.uint8), min_side=200)
+    assert [level.shape[:2] for level in levels] == [(1000, 700), (500, 350), (250, 175), (125, 87)]
+    assert coarse_level(levels[0], min_side=200).shape == (125, 87, 3)
+
+
+def test_candidates_cover_the_stained_objects():
+    img = synthetic_image(3, size=(256, 320), nuclei=30, brown=10, glass=0.5)
+    assert candidate_mask(img).any()
+    assert not candidate_mask(np.full((64, 64, 3), 245, dtype=np.uint8), 0.05, 0.01).any()
+
+
+def test_pyramid_analysis_keeps_the_counts_and_skips_glass(tmp_path):
+    img = synthetic_image(3, size=(512, 640), nuclei=60, brown=20, glass=0.5)
+    path = str(tmp_path / 'glass.png')
+    cv2.imwrite(path, img)
+    full = analyze_image(img, processing_params(PARAM_SETS['defaults']))
+    coarse = analyze_image(img, processing_params(dict(PARAM_SETS['defaults'], pyramid_analysis=True)))
+    assert len(coarse['cents_h']) == len(full['cents_h'])
+    assert len(coarse['cents_d']) == len(full['cents_d'])
+    assert coarse['skipped_fraction'] > 0.2
+    row = validate([path], PARAM_SETS['defaults'])[0]
+    assert row['blue_diff'] == row['red_diff'] == 0
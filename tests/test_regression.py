@@ -0,0 +1,53 @@
+import json
+
+import numpy as np
+
+from regression import (
+    PARAM_SETS, REFERENCE_FILE, compare, corpus, label_checksum, match_centroids, parse_options, run_case,
+    synthetic_image
+)
+
+
+def test_synthetic_images_are_deterministic():
+    assert np.array_equal(synthetic_image(1, size=(64, 80), nuclei=5), synthetic_image(1, size=(64, 80), nuclei=5))
+    assert not np.array_equal(synthetic_image(1, size=(64, 80)), synthetic_image(2, size=(64, 80)))
+    glass = synthetic_image(1, size=(64, 100), glass=0.5)
+    assert (glass[:, 60:] == 242).all()
+
+
+def test_label_checksums_ignore_the_dtype():
+    lbl = np.arange(12).reshape(3, 4)
+    assert label_checksum(lbl) == label_checksum(lbl.astype(np.int32))
+    assert label_checksum(lbl) != label_checksum(lbl.T)
+
+
+def test_centroid_matching_counts_unpartnered_points():
+    assert match_centroids([(0, 0), (10, 10)], [(0.2, 0), (30, 30)], 0.5) == (1, 1)
+    assert match_centroids([], [(1, 1)], 0.5) == (0, 1)
+
+
+def test_compare_reports_changes_within_tolerances():
+    reference = {'img/set': {'blue_count': 2, 'red_count': 1, 'cents_h': [[0, 0], [5, 5]], 'cents_d': [[9, 9]],
+                             'lbl_h_checksum': 'a', 'lbl_d_checksum': 'b'}}
+    same = json.loads(json.dumps(reference))
+    assert compare(reference, same) == []
+    moved = json.loads(json.dumps(reference))
+    moved['img/set']['cents_h'][1] = [5, 5.3]
+    moved['img/set']['lbl_h_checksum'] = 'c'
+    problems = compare(reference, moved)[0]['problems']
+    assert problems == ["cents_h: 1 unmatched, 1 new (tolerance 0.01px)", "lbl_h_checksum changed"]
+    assert compare(reference, moved, centroid_tolerance=0.5, check_labels=False) == []
+    assert compare(reference, {})[0]['problems'] == ['missing from run']
+
+
+def test_options_are_parsed_as_json_values():
+    assert parse_options(['low_memory=true', 'memory_budget_mb=4', 'name=abc']) == \
+        {'low_memory': True, 'memory_budget_mb': 4, 'name': 'abc'}
+
+
+def test_reference_covers_the_corpus_and_a_case_reproduces_it():
+    with open(REFERENCE_FILE) as f:
+        reference = json.load(f)
+    items = dict(corpus())
+    assert set(reference) == {f"{name}/{set_name}" for name in items for set_name in PARAM_SETS}
+    assert run_case(items['synthetic_sparse'](), PARAM_SETS['defaults']) == reference['synthetic_sparse/defaults']
@@ -0,0 +1,82 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from scheduler import AdmissionScheduler
+
+
+class RecordingExecutor(ThreadPoolExecutor):
+    """
+    Thread pool recording the jobs that run at the same time.
+    """
+
+    def __init__(self, workers):
+        super().__init__(max_workers=workers)
+        self.lock = threading.Lock()
+        self.running = set()
+        self.started = []
+        self.overlaps = []
+
+    def submit(self, fn, *args):
+        def job():
+            with self.lock:
+                self.running.add(args[0])
+                self.started.append(args[0])
+                self.overlaps.append(set(self.running))
+            try:
+                return fn(*args)
+            finally:
+                with self.lock:
+                    self.running.discard(args[0])
+        return super().submit(job)
+
+
+def sleep_job(name, seconds=0.05):
+    time.sleep(seconds)
+    return name
+
+
+def test_jobs_start_largest_first_and_are_handed_out_as_they_finish():
+    with RecordingExecutor(1) as executor:
+        scheduler = AdmissionScheduler(executor, 1, 100)
+        jobs = [(size, sleep_job, (name, 0.01)) for name, size in (('small', 10), ('large', 50), ('medium', 30))]
+        outputs = [(index, future.result()) for index, future in scheduler.run(jobs)]
+    # The small first job does not hold back the jobs that finished before it
+    assert outputs == [(1, 'large'), (2, 'medium'), (0, 'small')]
+    assert executor.started == ['large', 'medium', 'small']
+
+
+def test_running_jobs_stay_within_the_memory_budget():
+    sizes = {'a': 60, 'b': 50, 'c': 40, 'd': 30, 'e': 20}
+    with RecordingExecutor(4) as executor:
+        scheduler = AdmissionScheduler(executor, 4, 100)
+        jobs = [(size, sleep_job, (name,)) for name, size in sizes.items()]
+        outputs = {index: future.result() for index, future in scheduler.run(jobs)}
+    assert outputs == dict(enumerate(sizes))
+    assert max(sum(sizes[name] for name in running) for running in executor.overlaps) <= 100
+    assert scheduler.peak_bytes <= 100
+    assert scheduler.peak_running >= 2
+
+
+def test_oversized_and_unknown_jobs_run_alone():
+    sizes = {'huge': 500, 'unknown': None, 'a': 10, 'b': 10}
+    with RecordingExecutor(4) as executor:
+        scheduler = AdmissionScheduler(executor, 4, 100)
+        jobs = [(size, sleep_job, (name,)) for name, size in sizes.items()]
+        outputs = {index: future.result() for index, future in scheduler.run(jobs)}
+    assert outputs == dict(enumerate(sizes))
+    for running in executor.overlaps:
+        if 'huge' in running or 'unknown' in running:
+            assert len(running) == 1
+
+
+def test_cancelled_runs_admit_no_more_jobs():
+    cancel = threading.Event()
+    with RecordingExecutor(1) as executor:
+        scheduler = AdmissionScheduler(executor, 1, 100)
+        jobs = [(10, sleep_job, (i, 0.02)) for i in range(10)]
+        results = scheduler.run(jobs, cancel)
+        assert next(results)[1].result() == 0
+        cancel.set()
+        assert list(results) == []
+    assert len(executor.started) < len(jobs)
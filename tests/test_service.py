@@ -0,0 +1,71 @@
+import http.client
+import json
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from service import AnalysisService, ServiceHandler
+
+
+def make_service(defaults=None):
+    # Without the process pool: only the parameter handling is tested
+    service = object.__new__(AnalysisService)
+    service.default_params = defaults or {}
+    return service
+
+
+def test_request_params_override_defaults():
+    service = make_service({'min_area_h': 4, 'disk_size': 2})
+    params = service.request_params({'min_area_h': 7})
+    assert params == {'min_area_h': 7, 'disk_size': 2}
+
+
+@pytest.mark.parametrize('params', [
+    {'min_area_h': 'abc'},
+    {'gaussian_sigma': None},
+    {'dab_thresholds': 5},
+])
+def test_request_params_reject_wrong_types(params):
+    with pytest.raises(ValueError, match="Invalid parameters"):
+        make_service().request_params(params)
+
+
+@pytest.fixture
+def server():
+    ServiceHandler.service = make_service()
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), ServiceHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.mark.parametrize('body', [b'[1]', b'"path"', b'{"path": "x.png", "params": [1]}', b'{"path": ""}', b'{'])
+def test_malformed_json_requests_get_400(server, body):
+    connection = http.client.HTTPConnection(*server.server_address, timeout=5)
+    connection.request('POST', '/analyze', body, {'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    assert response.status == 400
+    assert 'error' in json.loads(response.read())
+
+
+def test_pool_restarts_outside_the_status_lock():
+    service = make_service()
+    service.lock = threading.Lock()
+    service.restart_lock = threading.Lock()
+    broken, restarts = object(), []
+
+    def start_pool():
+        # /health and new requests take the status lock while the pool warms up
+        assert service.lock.acquire(blocking=False)
+        service.lock.release()
+        restarts.append(1)
+        service.pool = object()
+
+    service.start_pool = start_pool
+    service.pool = broken
+    service.restart_pool(broken)
+    service.restart_pool(broken)
+    assert restarts == [1]
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from spatial import DetectionIndex, spatial_statistics
+
+
+def random_points(seed, n, side=200):
+    return np.random.default_rng(seed).uniform(0, side, (n, 2))
+
+
+def test_queries_match_all_pairs():
+    cents_h, cents_d = random_points(0, 60), random_points(1, 40)
+    pairs = np.linalg.norm(cents_h[:, None] - cents_d[None], axis=2)
+    index = DetectionIndex(cents_h, cents_d)
+    assert np.allclose(index.nearest_nucleus_distances(), pairs.min(axis=0))
+    assert index.brown_neighbour_counts(20).tolist() == (pairs <= 20).sum(axis=1).tolist()
+    assert index.brown_within(cents_h[0], 20).tolist() == np.flatnonzero(pairs[0] <= 20).tolist()
+
+
+def test_statistics_of_a_small_layout():
+    cents_h = [(0, 0), (100, 100)]
+    cents_d = [(0, 3), (0, 4), (100, 130)]
+    stats = spatial_statistics(cents_h, cents_d, radius=5)
+    assert stats['red_near_blue_count'] == 2
+    assert stats['pct_red_near_blue'] == pytest.approx(200 / 3)
+    assert stats['pct_blue_with_red'] == 50
+    assert stats['mean_red_per_blue'] == 1
+    assert stats['max_red_per_blue'] == 2
+    assert stats['nearest_blue_median'] == 4
+
+
+def test_statistics_without_detections():
+    no_nuclei = spatial_statistics([], [(1, 1)])
+    assert no_nuclei['red_near_blue_count'] == 0
+    assert no_nuclei['nearest_blue_median'] is None
+    no_brown = spatial_statistics([(1, 1)], [])
+    assert no_brown['pct_red_near_blue'] == 0
+    assert no_brown['mean_red_per_blue'] == 0
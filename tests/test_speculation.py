@@ -0,0 +1,65 @@
+import threading
+
+import numpy as np
+
+from speculation import SpeculativeSegmenter, result_bytes
+
+
+def fake_result(value, pixels=1000):
+    return (np.full(pixels, value, dtype=np.int32), np.zeros(pixels, dtype=np.int32), [(0, 0)], [])
+
+
+def wait_idle(segmenter):
+    # The background executor has one thread, so this runs after all speculation submitted before
+    segmenter.executor.submit(lambda: None).result()
+
+
+def test_candidates_are_computed_in_the_background():
+    segmenter = SpeculativeSegmenter(max_mb=1)
+    computed = []
+
+    def compute(values):
+        computed.append(values['h'])
+        return fake_result(len(computed))
+
+    segmenter.speculate({'h': 0.5}, [{'h': 0.51}, {'h': 0.49}], compute)
+    wait_idle(segmenter)
+    assert computed == [0.51, 0.49]
+    assert segmenter.get({'h': 0.49})[0][0] == 2
+    assert segmenter.get({'h': 0.52}) is None
+    assert (segmenter.hits, segmenter.misses) == (1, 1)
+    segmenter.shutdown()
+
+
+def test_a_new_generation_abandons_older_work():
+    segmenter = SpeculativeSegmenter(max_mb=1)
+    started, release = threading.Event(), threading.Event()
+
+    def slow(values):
+        started.set()
+        release.wait(5)
+        return fake_result(1)
+
+    segmenter.speculate({'h': 0.5}, [{'h': 0.51}, {'h': 0.52}], slow)
+    started.wait(5)
+    segmenter.discard()
+    release.set()
+    wait_idle(segmenter)
+    assert segmenter.entries == []
+    segmenter.shutdown()
+
+
+def test_results_stay_within_the_memory_cap():
+    one = result_bytes(fake_result(0, pixels=2 ** 16))
+    segmenter = SpeculativeSegmenter(max_mb=2.5 * one / 2 ** 20)
+    segmenter.put({'h': 0.1}, fake_result(1, pixels=2 ** 16))
+    segmenter.put({'h': 0.2}, fake_result(2, pixels=2 ** 16))
+    segmenter.put({'h': 0.3}, fake_result(3, pixels=2 ** 16))
+    assert segmenter.get({'h': 0.1}) is None
+    assert segmenter.get({'h': 0.3}) is not None
+
+    segmenter.speculate({'h': 0.3}, [{'h': 0.4}, {'h': 0.5}], lambda values: fake_result(4, pixels=2 ** 16))
+    wait_idle(segmenter)
+    assert [entry[0]['h'] for entry in segmenter.entries] == [0.3, 0.4]
+    assert segmenter._used() <= segmenter.max_bytes
+    segmenter.shutdown()
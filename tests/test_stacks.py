@@ -0,0 +1,66 @@
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from regression import synthetic_image
+from stacks import (
+    expand_pages, image_size, output_name, page_count, project_pages, read_image, split_page, open_thumbnail
+)
+
+
+def write_stack(path, count=3, size=(64, 80)):
+    pages = [synthetic_image(seed, size=size, nuclei=8, brown=3) for seed in range(count)]
+    images = [Image.fromarray(cv2.cvtColor(page, cv2.COLOR_BGR2RGB)) for page in pages]
+    images[0].save(path, save_all=True, append_images=images[1:])
+    return pages
+
+
+def test_page_specifications():
+    assert split_page('/data/x.tif#2') == ('/data/x.tif', 2)
+    assert split_page('/data/x.TIFF#MAX') == ('/data/x.TIFF', 'max')
+    assert split_page('/data/x.png#2') == ('/data/x.png#2', None)
+    assert split_page('/data/x.tif') == ('/data/x.tif', None)
+
+
+def test_existing_files_named_like_pages_stay_plain(tmp_path):
+    path = tmp_path / 'odd.tif#1'
+    path.write_bytes(b'')
+    assert split_page(str(path)) == (str(path), None)
+
+
+def test_pages_and_projections_are_read(tmp_path):
+    path = str(tmp_path / 'stack.tif')
+    pages = write_stack(path)
+    assert page_count(path) == 3
+    assert np.array_equal(read_image(f"{path}#2"), pages[1])
+    assert np.array_equal(read_image(f"{path}#max"), np.minimum.reduce(pages))
+    assert image_size(f"{path}#3") == (80, 64)
+    assert open_thumbnail(f"{path}#mean", (32, 32)).size[0] <= 32
+
+
+def test_projections_stream_over_pages():
+    pages = [np.full((2, 2, 3), value, dtype=np.uint8) for value in (10, 20, 31)]
+    assert project_pages(iter(pages), 'max').max() == 10
+    assert project_pages(iter(pages), 'mean').max() == 20
+    assert project_pages(iter([]), 'mean') is None
+
+
+def test_stacks_expand_by_mode(tmp_path):
+    stack = str(tmp_path / 'stack.tif')
+    write_stack(stack, count=2)
+    plain = str(tmp_path / 'plain.png')
+    cv2.imwrite(plain, synthetic_image(0, size=(32, 32), nuclei=2, brown=1))
+    assert expand_pages([stack, plain], 'pages') == [f"{stack}#1", f"{stack}#2", plain]
+    assert expand_pages([stack], 'pages + max') == [f"{stack}#1", f"{stack}#2", f"{stack}#max"]
+    assert expand_pages([stack], 'mean') == [f"{stack}#mean"]
+    assert expand_pages([stack], 'first page') == [stack]
+
+
+def test_output_names_differ_per_path_and_page(tmp_path):
+    names = {output_name(str(tmp_path / 'a' / 'x.png')), output_name(str(tmp_path / 'a' / 'x.jpg')),
+             output_name(str(tmp_path / 'b' / 'x.png')), output_name(str(tmp_path / 's.tif') + '#1'),
+             output_name(str(tmp_path / 's.tif') + '#2')}
+    assert len(names) == 5
+    assert all(os.sep not in name and '#' not in name for name in names)
@@ -0,0 +1,30 @@
+import numpy as np
+
+from viewer import TileCache, ZoomViewer
+
+
+def test_least_recently_used_tiles_are_evicted():
+    cache = TileCache(max_tiles=2)
+    built = []
+
+    def create(key):
+        return lambda: built.append(key) or key
+
+    cache.get('a', create('a'))
+    cache.get('b', create('b'))
+    assert cache.get('a', create('a')) == 'a'
+    cache.get('c', create('c'))
+    assert list(cache.tiles) == ['a', 'c']
+    cache.get('b', create('b'))
+    assert built == ['a', 'b', 'c', 'b']
+    assert (cache.hits, cache.misses) == (1, 4)
+    cache.clear()
+    assert not cache.tiles
+
+
+def test_reduced_levels_are_built_on_demand():
+    viewer = object.__new__(ZoomViewer)
+    viewer.levels = [np.zeros((100, 70, 3), dtype=np.uint8)]
+    assert viewer.level(2).shape == (25, 17, 3)
+    assert len(viewer.levels) == 3
+    assert viewer.level(1) is viewer.levels[1]
@@ -0,0 +1,103 @@
+import os
+import time
+
+import pytest
+
+import workqueue
+from analysis import processing_params
+from workqueue import WorkQueue, run_worker
+
+
+@pytest.fixture
+def images(write_image):
+    return [write_image('images/a.png', seed=1), write_image('images/b.png', seed=2)]
+
+
+def test_create_again_keeps_progress(tmp_path, images):
+    queue = WorkQueue(str(tmp_path / 'queue'))
+    queue.create(images, {'min_area_h': 2})
+    queue.write_result('000000', {'result': {'filename': 'a.png'}, 'error': None})
+
+    WorkQueue(str(tmp_path / 'queue')).create(images, {'min_area_h': 2})
+    assert queue.is_done('000000')
+    with pytest.raises(FileExistsError):
+        WorkQueue(str(tmp_path / 'queue')).create(images, {'min_area_h': 3})
+
+
+def test_claims_are_exclusive(tmp_path, images):
+    queue = WorkQueue(str(tmp_path / 'queue'))
+    queue.create(images, {})
+    assert queue.claim('000000', 'worker-1')
+    assert not queue.claim('000000', 'worker-2')
+    queue.release('000000', 'worker-1')
+    assert queue.claim('000000', 'worker-2')
+
+
+def test_release_keeps_a_claim_taken_over_by_another_worker(tmp_path, images):
+    queue = WorkQueue(str(tmp_path / 'queue'))
+    queue.create(images, {})
+    assert queue.claim('000000', 'worker-1')
+    old = time.time() - workqueue.WORKQUEUE_STALE_SECONDS - 1
+    os.utime(queue.claim_path('000000'), (old, old))
+    assert queue.claim('000000', 'worker-2')
+
+    # The stalled worker finishing late must not remove the new claim
+    assert not queue.release('000000', 'worker-1')
+    assert not queue.claim('000000', 'worker-3')
+    assert os.listdir(queue.claims_dir) == ['000000.claim']
+    assert queue.release('000000', 'worker-2')
+    assert os.listdir(queue.claims_dir) == []
+
+
+def test_lost_heartbeat_discards_the_result(tmp_path, images):
+    queue = WorkQueue(str(tmp_path / 'queue'))
+    queue.create(images, {})
+    heartbeat = workqueue.Heartbeat(queue.claim_path('000000'), interval=0.01)
+    with heartbeat:
+        time.sleep(0.1)
+    assert heartbeat.lost and isinstance(heartbeat.error, FileNotFoundError)
+
+    params = processing_params({})
+    assert not workqueue.process_task(queue, '000000', params, 'worker-1', heartbeat=heartbeat)
+    assert not queue.is_done('000000')
+
+
+def test_stale_claim_is_taken_over(tmp_path, images):
+    queue = WorkQueue(str(tmp_path / 'queue'))
+    queue.create(images, {})
+    assert queue.claim('000000', 'worker-1')
+    old = time.time() - workqueue.WORKQUEUE_STALE_SECONDS - 1
+    os.utime(queue.claim_path('000000'), (old, old))
+
+    assert queue.claim('000000', 'worker-2')
+    assert not any(name.endswith('.stale') for name in os.listdir(queue.claims_dir))
+    assert queue.status()['claimed'] == 1
+
+
+def test_relative_queue_merges_from_another_directory(tmp_path, images, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    WorkQueue('queue').create(images, {})
+    assert run_worker('queue', 'worker-1', metrics=False) == 2
+
+    # Label and density files are found wherever the queue is read from
+    monkeypatch.chdir(tmp_path / 'images')
+    results, missing = WorkQueue(os.path.join('..', 'queue')).results()
+    assert missing == []
+    for result in results:
+        assert os.path.isabs(result['labels_file']) and os.path.exists(result['labels_file'])
+        assert os.path.isabs(result['density_file']) and os.path.exists(result['density_file'])
+
+    # Stored relative to the queue folder
+    record = WorkQueue(str(tmp_path / 'queue')).read_result('000000')
+    assert record['result']['labels_file'] == os.path.join('labels', '000000.npz')
+
+
+def test_merge_writes_maps_of_same_named_images(tmp_path, write_image):
+    images = [write_image('a/x.png', seed=1), write_image('b/x.png', seed=2)]
+    queue = WorkQueue(str(tmp_path / 'queue'))
+    queue.create(images, {})
+    run_worker(queue.path, 'worker-1', metrics=False)
+
+    exported, missing = queue.merge(str(tmp_path / 'results.csv'))
+    assert (exported, missing) == (2, [])
+    assert len(os.listdir(tmp_path / 'results_density')) == 6
@@ -0,0 +1,260 @@
+import tkinter as tk
+from collections import OrderedDict
+import cv2
+import numpy as np
+from PIL import Image, ImageTk
+
+from config import VIEWER_TILE_SIZE, VIEWER_CACHE_TILES, VIEWER_MAX_ZOOM, MARKER_RADIUS
+from overlay import OverlayRenderer
+
+BLUE_OUTLINE = (0, 0, 255)
+RED_OUTLINE = (255, 0, 0)
+
+
+class TileCache:
+    """
+    Bounded least-recently-used cache of rendered tiles.
+    """
+
+    def __init__(self, max_tiles=VIEWER_CACHE_TILES):
+        """
+        Initialize an empty cache.
+
+        Parameters:
+            max_tiles (int): Maximum number of tiles kept
+        """
+        self.max_tiles = max_tiles
+        self.tiles = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, create):
+        """
+        Get a tile, creating it on a miss and evicting the least recently used tile if needed.
+
+        Parameters:
+            key: Hashable tile key
+            create (callable): Function building the tile when it is not cached
+
+        Returns:
+            The cached or newly created tile
+        """
+        if key in self.tiles:
+            self.hits += 1
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+
+        self.misses += 1
+        tile = create()
+        self.tiles[key] = tile
+        while len(self.tiles) > self.max_tiles:
+            self.tiles.popitem(last=False)
+        return tile
+
+    def clear(self):
+        """
+        Drop all cached tiles.
+        """
+        self.tiles.clear()
+
+
+class ZoomViewer:
+    """
+    Pan/zoom viewer for full resolution images with detection overlays.
+    Only the visible tiles are rendered, from reduced copies of the image at low zoom and
+    from the full resolution array at high zoom, so no full size Tk image is ever built.
+    """
+
+    def __init__(self, master, img_bgr, title="Zoom View"):
+        """
+        Open the viewer window.
+
+        Parameters:
+            master: Parent widget
+            img_bgr (numpy.ndarray): Full resolution image as returned by cv2.imread
+            title (str): Window title
+        """
+        self.window = tk.Toplevel(master)
+        self.window.title(title)
+        self.window.geometry("900x700")
+
+        self.canvas = tk.Canvas(self.window, background="black", highlightthickness=0)
+        self.canvas.pack(fill=tk.BOTH, expand=True)
+        self.status = tk.Label(self.window, text="", anchor="w")
+        self.status.pack(fill=tk.X)
+
+        self.levels = [img_bgr]
+        self.lbl_h = self.lbl_d = None
+        self.cents_h = self.cents_d = np.zeros((0, 2))
+        self.marker_radius = MARKER_RADIUS
+        self.overlay_version = 0
+
+        self.cache = TileCache()
+        self.items = {}
+
+        h, w = img_bgr.shape[:2]
+        self.zoom = 1.0
+        while self.zoom > 1 / 1024 and max(h, w) * self.zoom > 900:
+            self.zoom /= 2
+        self.ox = self.oy = 0.0
+
+        self.canvas.bind("<Configure>", lambda e: self.refresh())
+        self.canvas.bind("<ButtonPress-1>", self.start_pan)
+        self.canvas.bind("<B1-Motion>", self.pan)
+        self.canvas.bind("<MouseWheel>", self.wheel)
+        self.canvas.bind("<Button-4>", lambda e: self.zoom_at(e.x, e.y, 2))
+        self.canvas.bind("<Button-5>", lambda e: self.zoom_at(e.x, e.y, 0.5))
+
+    def set_overlays(self, lbl_h, lbl_d, cents_h, cents_d, marker_radius=MARKER_RADIUS):
+        """
+        Replace the detections drawn on top of the image.
+
+        Parameters:
+            lbl_h (numpy.ndarray): Nucleus label image (or None)
+            lbl_d (numpy.ndarray): Brown spot label image (or None)
+            cents_h (list): (row, col) centroids of nuclei
+            cents_d (list): (row, col) centroids of brown spots
+            marker_radius (int): Marker radius in screen pixels
+        """
+        self.lbl_h, self.lbl_d = lbl_h, lbl_d
+        self.cents_h = np.asarray(cents_h, dtype=np.float64).reshape(-1, 2)
+        self.cents_d = np.asarray(cents_d, dtype=np.float64).reshape(-1, 2)
+        self.marker_radius = marker_radius
+        self.overlay_version += 1
+        self.refresh()
+
+    def level(self, k):
+        """
+        Get the image reduced by 2**k, building missing levels on demand.
+
+        Parameters:
+            k (int): Pyramid level
+
+        Returns:
+            numpy.ndarray: Reduced BGR image
+        """
+        while len(self.levels) <= k:
+            prev = self.levels[-1]
+            size = (max(1, prev.shape[1] // 2), max(1, prev.shape[0] // 2))
+            self.levels.append(cv2.resize(prev, size, interpolation=cv2.INTER_AREA))
+        return self.levels[k]
+
+    def render_tile(self, tx, ty):
+        """
+        Render one tile at the current zoom.
+
+        Parameters:
+            tx, ty (int): Tile column and row
+
+        Returns:
+            ImageTk.PhotoImage: The rendered tile (None if it lies outside the image)
+        """
+        t = VIEWER_TILE_SIZE
+        k = max(0, int(round(-np.log2(self.zoom)))) if self.zoom < 1 else 0
+        src = self.level(k)
+        scale = self.zoom * (2 ** k)
+
+        y0, x0 = int(ty * t / scale), int(tx * t / scale)
+        y1 = min(src.shape[0], int(np.ceil((ty + 1) * t / scale)))
+        x1 = min(src.shape[1], int(np.ceil((tx + 1) * t / scale)))
+        if y0 >= y1 or x0 >= x1:
+            return None
+
+        crop = cv2.cvtColor(src[y0:y1, x0:x1], cv2.COLOR_BGR2RGB)
+        th = min(t, int(round((y1 - y0) * scale)))
+        tw = min(t, int(round((x1 - x0) * scale)))
+        tile = cv2.resize(crop, (max(1, tw), max(1, th)), interpolation=cv2.INTER_NEAREST)
+
+        full_scale = 2 ** k
+        fy0, fx0 = y0 * full_scale, x0 * full_scale
+        for lbl, color in ((self.lbl_h, BLUE_OUTLINE), (self.lbl_d, RED_OUTLINE)):
+            if lbl is None:
+                continue
+            ys = np.minimum(lbl.shape[0] - 1, (fy0 + np.arange(tile.shape[0]) / self.zoom).astype(np.intp))
+            xs = np.minimum(lbl.shape[1] - 1, (fx0 + np.arange(tile.shape[1]) / self.zoom).astype(np.intp))
+            part = lbl[ys[:, None], xs[None, :]]
+            edge = np.zeros(part.shape, dtype=bool)
+            edge[:-1, :] |= part[:-1, :] != part[1:, :]
+            edge[:, :-1] |= part[:, :-1] != part[:, 1:]
+            edge &= part > 0
+            tile[edge] = color
+
+        renderer = OverlayRenderer(Image.fromarray(tile))
+        points = []
+        for cents in (self.cents_h, self.cents_d):
+            px = (cents[:, 1] - fx0) * self.zoom
+            py = (cents[:, 0] - fy0) * self.zoom
+            visible = (px >= -self.marker_radius) & (px < tile.shape[1] + self.marker_radius) & \
+                      (py >= -self.marker_radius) & (py < tile.shape[0] + self.marker_radius)
+            points.append(np.column_stack((px[visible], py[visible])).astype(np.intp))
+        return ImageTk.PhotoImage(renderer.render(points[0], points[1], self.marker_radius))
+
+    def refresh(self):
+        """
+        Show the tiles covering the visible part of the canvas.
+        """
+        t = VIEWER_TILE_SIZE
+        cw, ch = max(1, self.canvas.winfo_width()), max(1, self.canvas.winfo_height())
+        h, w = self.levels[0].shape[:2]
+        max_tx = int(np.ceil(w * self.zoom / t))
+        max_ty = int(np.ceil(h * self.zoom / t))
+
+        visible = set()
+        for ty in range(max(0, int(self.oy // t)), min(max_ty, int((self.oy + ch) // t) + 1)):
+            for tx in range(max(0, int(self.ox // t)), min(max_tx, int((self.ox + cw) // t) + 1)):
+                key = (self.zoom, tx, ty, self.overlay_version)
+                visible.add(key)
+                photo = self.cache.get(key, lambda tx=tx, ty=ty: self.render_tile(tx, ty))
+                if photo is None:
+                    continue
+                x, y = tx * t - self.ox, ty * t - self.oy
+                if key in self.items:
+                    self.canvas.coords(self.items[key][0], x, y)
+                else:
+                    item = self.canvas.create_image(x, y, image=photo, anchor="nw")
+                    self.items[key] = (item, photo)
+
+        for key in list(self.items):
+            if key not in visible:
+                self.canvas.delete(self.items.pop(key)[0])
+
+        self.status.config(text=f"Zoom {self.zoom * 100:.1f}% | tile cache {len(self.cache.tiles)} "
+                                f"({self.cache.hits} hits, {self.cache.misses} misses)")
+
+    def start_pan(self, event):
+        """
+        Remember where a pan drag started.
+        """
+        self.drag = (event.x, event.y)
+
+    def pan(self, event):
+        """
+        Move the view while the mouse is dragged.
+        """
+        x, y = self.drag
+        self.ox -= event.x - x
+        self.oy -= event.y - y
+        self.drag = (event.x, event.y)
+        self.refresh()
+
+    def wheel(self, event):
+        """
+        Zoom in or out with the mouse wheel.
+        """
+        self.zoom_at(event.x, event.y, 2 if event.delta > 0 else 0.5)
+
+    def zoom_at(self, x, y, factor):
+        """
+        Change the zoom while keeping the point under the cursor fixed.
+
+        Parameters:
+            x, y (int): Cursor position on the canvas
+            factor (float): Zoom multiplier
+        """
+        zoom = min(VIEWER_MAX_ZOOM, max(1 / 1024, self.zoom * factor))
+        if zoom == self.zoom:
+            return
+        fx, fy = (self.ox + x) / self.zoom, (self.oy + y) / self.zoom
+        self.zoom = zoom
+        self.ox, self.oy = fx * zoom - x, fy * zoom - y
+        self.refresh()
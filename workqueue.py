@@ -0,0 +1,532 @@
+import os
+import sys
+import json
+import time
+import socket
+import threading
+
+from config import (
+    DEFAULT_PARAMS_FILE, WORKQUEUE_HEARTBEAT_SECONDS, WORKQUEUE_STALE_SECONDS, WORKQUEUE_POLL_SECONDS,
+    METRICS_ENABLED, STACK_MODE, DENSITY_MAPS
+)
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff')
+
+# Files of a result that are stored relative to the queue folder, so the queue can be
+# merged from any working directory or machine that mounts it
+QUEUE_FILES = ('labels_file', 'density_file')
+
+
+def write_json_atomic(path, data):
+    """
+    Write a JSON file so that readers never see a partially written file.
+
+    Parameters:
+        path (str): Destination file
+        data: JSON-serializable value
+    """
+    tmp_path = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class Heartbeat:
+    """
+    Context manager that keeps refreshing the modification time of a claim file
+    while the claimed image is being processed. If the claim file can no longer be
+    refreshed, the error is kept in `error` and the claim counts as lost.
+    """
+
+    def __init__(self, path, interval=WORKQUEUE_HEARTBEAT_SECONDS):
+        self.path = path
+        self.interval = interval
+        self.error = None
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    @property
+    def lost(self):
+        return self.error is not None
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                os.utime(self.path)
+            except OSError as e:
+                self.error = e
+                sys.stderr.write(f"Lost claim {self.path}: {e}\n")
+                return
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop_event.set()
+        self.thread.join()
+        return False
+
+
+class WorkQueue:
+    """
+    Coordinator-free work queue on a shared folder.
+    The folder holds the task list, one claim file per image that is being processed and
+    one result file per finished image. Workers claim images by creating the claim file
+    exclusively, so any number of processes on any machine that mounts the folder can
+    work on the same queue. Claims that are no longer refreshed by a heartbeat are taken
+    over by other workers.
+    """
+
+    def __init__(self, path):
+        """
+        Initialize access to a queue folder.
+
+        Parameters:
+            path (str): Queue folder (created by create)
+        """
+        self.path = os.path.abspath(path)
+        self.tasks_path = os.path.join(self.path, 'tasks.json')
+        self.claims_dir = os.path.join(self.path, 'claims')
+        self.results_dir = os.path.join(self.path, 'results')
+        self._tasks = None
+
+    def create(self, image_paths, params):
+        """
+        Create the queue folder and its task list.
+        Creating a queue again with the same images and parameters keeps its progress.
+
+        Parameters:
+            image_paths (list): Images to process, in export order
+            params (dict): Raw processing parameters shared by all workers
+        """
+        tasks = {
+            'params': json.loads(json.dumps(params)),
+            'images': [os.path.abspath(p) for p in image_paths]
+        }
+        if os.path.exists(self.tasks_path):
+            if self.load() != tasks:
+                raise FileExistsError(f"A different queue already exists in {self.path}")
+            return
+
+        os.makedirs(self.claims_dir, exist_ok=True)
+        os.makedirs(self.results_dir, exist_ok=True)
+        write_json_atomic(self.tasks_path, tasks)
+        self._tasks = tasks
+
+    def load(self):
+        """
+        Read the task list.
+
+        Returns:
+            dict: Raw parameters ('params') and image paths ('images')
+        """
+        if self._tasks is None:
+            with open(self.tasks_path, 'r') as f:
+                self._tasks = json.load(f)
+        return self._tasks
+
+    def task_ids(self):
+        """
+        Get the identifiers of all tasks, in export order.
+
+        Returns:
+            list: Task identifiers
+        """
+        return [f"{i:06d}" for i in range(len(self.load()['images']))]
+
+    def image_path(self, task_id):
+        return self.load()['images'][int(task_id)]
+
+    def claim_path(self, task_id):
+        return os.path.join(self.claims_dir, f"{task_id}.claim")
+
+    def result_path(self, task_id):
+        return os.path.join(self.results_dir, f"{task_id}.json")
+
+    def labels_path(self, task_id):
+        return os.path.join(self.path, 'labels', f"{task_id}.npz")
+
+    def density_path(self, task_id):
+        return os.path.join(self.path, 'density', f"{task_id}.npz")
+
+    def metrics_path(self, worker_id):
+        return os.path.join(self.path, 'metrics', f"{worker_id}.jsonl")
+
+    def is_done(self, task_id):
+        return os.path.exists(self.result_path(task_id))
+
+    def claim(self, task_id, worker_id):
+        """
+        Try to claim a task for a worker.
+
+        Parameters:
+            task_id (str): Task identifier
+            worker_id (str): Identifier of the claiming worker
+
+        Returns:
+            bool: True if the worker now owns the task
+        """
+        for _ in range(2):
+            try:
+                fd = os.open(self.claim_path(task_id), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self._remove_stale_claim(task_id, worker_id):
+                    return False
+                continue
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'worker': worker_id, 'claimed': time.time()}, f)
+            return True
+        return False
+
+    def _remove_stale_claim(self, task_id, worker_id):
+        """
+        Remove the claim of a task if its worker stopped refreshing it.
+        The claim is first renamed, which only one worker can do; if the renamed file turns
+        out to be a fresh claim made in the meantime it is put back.
+
+        Parameters:
+            task_id (str): Task identifier
+            worker_id (str): Identifier of the worker taking over
+
+        Returns:
+            bool: True if the task is no longer claimed
+        """
+        claim_path = self.claim_path(task_id)
+        try:
+            st = os.stat(claim_path)
+        except FileNotFoundError:
+            return True
+        if time.time() - st.st_mtime < WORKQUEUE_STALE_SECONDS:
+            return False
+
+        stale_path = f"{claim_path}.{worker_id}.stale"
+        try:
+            os.rename(claim_path, stale_path)
+        except FileNotFoundError:
+            return True
+
+        moved = os.stat(stale_path)
+        if (moved.st_ino, moved.st_mtime_ns) != (st.st_ino, st.st_mtime_ns):
+            try:
+                os.link(stale_path, claim_path)
+            except FileExistsError:
+                pass
+            os.remove(stale_path)
+            return False
+
+        os.remove(stale_path)
+        return True
+
+    def release(self, task_id, worker_id):
+        """
+        Remove the claim of a task if the worker still owns it.
+        The claim is first renamed, so that a claim another worker made after taking the
+        task over is put back instead of being removed.
+
+        Parameters:
+            task_id (str): Task identifier
+            worker_id (str): Identifier of the releasing worker
+
+        Returns:
+            bool: True if the claim of the worker was removed
+        """
+        claim_path = self.claim_path(task_id)
+        release_path = f"{claim_path}.{worker_id}.release"
+        try:
+            os.rename(claim_path, release_path)
+        except FileNotFoundError:
+            return False
+
+        try:
+            with open(release_path, 'r') as f:
+                owner = json.load(f).get('worker')
+        except ValueError:
+            owner = None
+        if owner != worker_id:
+            try:
+                os.link(release_path, claim_path)
+            except FileExistsError:
+                pass
+            os.remove(release_path)
+            return False
+
+        os.remove(release_path)
+        return True
+
+    def write_result(self, task_id, record):
+        """
+        Store the result of a task, which marks it as done.
+
+        Parameters:
+            task_id (str): Task identifier
+            record (dict): JSON-serializable result record
+        """
+        write_json_atomic(self.result_path(task_id), record)
+
+    def read_result(self, task_id):
+        """
+        Read the result of a task.
+
+        Parameters:
+            task_id (str): Task identifier
+
+        Returns:
+            dict: Result record, or None if the task is not done
+        """
+        try:
+            with open(self.result_path(task_id), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def status(self):
+        """
+        Count the tasks by state.
+
+        Returns:
+            dict: Numbers of 'total', 'done', 'failed', 'claimed' and 'pending' tasks
+        """
+        counts = {'total': 0, 'done': 0, 'failed': 0, 'claimed': 0, 'pending': 0}
+        for task_id in self.task_ids():
+            counts['total'] += 1
+            record = self.read_result(task_id)
+            if record is not None:
+                counts['failed' if record.get('error') else 'done'] += 1
+            elif os.path.exists(self.claim_path(task_id)):
+                counts['claimed'] += 1
+            else:
+                counts['pending'] += 1
+        return counts
+
+    def results(self):
+        """
+        Collect the results of all successfully processed images, in export order.
+
+        Returns:
+            tuple: (results, missing) where results are the result dictionaries (with their
+                   label and density files resolved against the queue folder) and
+                   missing lists the images that are not done or failed
+        """
+        results, missing = [], []
+        for task_id in self.task_ids():
+            record = self.read_result(task_id)
+            if record is None or record.get('result') is None:
+                missing.append(self.image_path(task_id))
+                continue
+            result = record['result']
+            result.setdefault('image_path', record.get('image') or self.image_path(task_id))
+            for key in QUEUE_FILES:
+                if result.get(key):
+                    result[key] = os.path.join(self.path, result[key])
+            results.append(result)
+        return results, missing
+
+    def merge(self, csv_path):
+        """
+        Write the results of the queue to a CSV file with the columns of the bulk
+        processor export, and their density maps to a folder next to it.
+
+        Parameters:
+            csv_path (str): Output CSV file
+
+        Returns:
+            tuple: (number of exported images, list of images without result)
+        """
+        import pandas as pd
+        from analysis import export_row
+        from density import export_maps
+
+        results, missing = self.results()
+        pd.DataFrame([export_row(result) for result in results]).to_csv(csv_path, index=False)
+        export_maps(results, csv_path)
+        return len(results), missing
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def process_task(queue, task_id, params, worker_id, metrics=None, heartbeat=None):
+    """
+    Process the image of a claimed task and store its result.
+
+    Parameters:
+        queue (WorkQueue): Queue the task belongs to
+        task_id (str): Claimed task
+        params (dict): Normalized processing parameters
+        worker_id (str): Identifier of the worker
+        metrics (MetricsLog): Optional log receiving the metrics record of the image
+        heartbeat (Heartbeat): Heartbeat of the claim; no result is stored once it is lost
+
+    Returns:
+        bool: True if the result was stored
+    """
+    from analysis import measure_image
+    from metrics import StageTimer, metrics_record
+
+    image_path = queue.image_path(task_id)
+    timer = StageTimer()
+    start = time.perf_counter()
+    result, error = None, None
+    try:
+        result = measure_image(image_path, params, labels_path=queue.labels_path(task_id), timer=timer,
+                               density_path=queue.density_path(task_id) if DENSITY_MAPS else None)
+        if result is None:
+            error = "Could not read image"
+        else:
+            result.pop('cents_h')
+            result.pop('cents_d')
+            for key in QUEUE_FILES:
+                if result.get(key):
+                    result[key] = os.path.relpath(result[key], queue.path)
+    except Exception as e:
+        error = str(e)
+
+    seconds = time.perf_counter() - start
+    if heartbeat is not None and heartbeat.lost:
+        # The task may have been taken over by another worker in the meantime
+        return False
+    queue.write_result(task_id, {
+        'image': image_path,
+        'worker': worker_id,
+        'seconds': seconds,
+        'result': result,
+        'error': error
+    })
+    if metrics is not None:
+        metrics.write(metrics_record('worker', image_path, timer, seconds * 1000, result,
+                                     worker=worker_id, task=task_id, error=error))
+    return True
+
+
+def run_worker(queue_path, worker_id=None, metrics=METRICS_ENABLED):
+    """
+    Process tasks of a queue until every task has a result.
+    Tasks claimed by other workers are revisited until they finish or their claim
+    becomes stale.
+
+    Parameters:
+        queue_path (str): Queue folder
+        worker_id (str): Identifier written to claims and results (default: host and PID)
+        metrics (bool): Log per-image metrics to metrics/<worker>.jsonl in the queue folder
+
+    Returns:
+        int: Number of tasks processed by this worker
+    """
+    from analysis import processing_params
+    from metrics import MetricsLog
+
+    worker_id = worker_id or default_worker_id()
+    queue = WorkQueue(queue_path)
+    params = processing_params(queue.load()['params'])
+    log = MetricsLog(queue.metrics_path(worker_id)) if metrics else None
+
+    processed = 0
+    while True:
+        waiting = False
+        for task_id in queue.task_ids():
+            if queue.is_done(task_id):
+                continue
+            if not queue.claim(task_id, worker_id):
+                waiting = True
+                continue
+            try:
+                if queue.is_done(task_id):
+                    continue
+                with Heartbeat(queue.claim_path(task_id)) as heartbeat:
+                    if process_task(queue, task_id, params, worker_id, log, heartbeat):
+                        processed += 1
+                    else:
+                        waiting = True
+            finally:
+                queue.release(task_id, worker_id)
+        if not waiting:
+            return processed
+        time.sleep(WORKQUEUE_POLL_SECONDS)
+
+
+def list_images(paths, stack_mode=STACK_MODE):
+    """
+    Expand folders in a list of image paths, and multi-page TIFFs into their pages.
+
+    Parameters:
+        paths (list): Image files and folders
+        stack_mode (str): How multi-page TIFFs are expanded (a key of stacks.STACK_MODES)
+
+    Returns:
+        list: Image files and page specifications
+    """
+    from stacks import expand_pages
+
+    images = []
+    for path in paths:
+        if os.path.isdir(path):
+            images.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                          if name.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            images.append(path)
+    return expand_pages(images, stack_mode)
+
+
+if __name__ == "__main__":
+    import argparse
+    import multiprocessing
+
+    parser = argparse.ArgumentParser(description="Process images through a work queue on a shared folder")
+    sub = parser.add_subparsers(dest='command', required=True)
+    init_parser = sub.add_parser('init', help="Create a queue for a set of images")
+    init_parser.add_argument('queue', help="Queue folder on the shared file system")
+    init_parser.add_argument('images', nargs='+', help="Image files or folders")
+    init_parser.add_argument('--params', default=DEFAULT_PARAMS_FILE, help="Parameters file")
+    init_parser.add_argument('--calibration', help="Calibration file providing the thresholds")
+    init_parser.add_argument('--stacks', default=STACK_MODE,
+                             help="How multi-page TIFFs are queued: pages, 'pages + max', 'pages + mean', max, "
+                                  "mean or 'first page'")
+    work_parser = sub.add_parser('work', help="Process queued images until the queue is finished")
+    work_parser.add_argument('queue', help="Queue folder")
+    work_parser.add_argument('--processes', type=int, default=1, help="Worker processes started on this machine")
+    work_parser.add_argument('--metrics', action='store_true', default=METRICS_ENABLED,
+                             help="Log per-image metrics to the metrics folder of the queue")
+    status_parser = sub.add_parser('status', help="Show the progress of a queue")
+    status_parser.add_argument('queue', help="Queue folder")
+    merge_parser = sub.add_parser('merge', help="Write the queue results to a CSV file")
+    merge_parser.add_argument('queue', help="Queue folder")
+    merge_parser.add_argument('output', help="CSV file to write")
+    args = parser.parse_args()
+
+    queue = WorkQueue(args.queue)
+    if args.command == 'init':
+        with open(args.params, 'r') as f:
+            params = {k: v for k, v in json.load(f).items() if k != 'image_path'}
+        if args.calibration:
+            from calibration import load_calibration, apply_calibration
+            params = apply_calibration(params, load_calibration(args.calibration))
+        images = list_images(args.images, args.stacks)
+        queue.create(images, params)
+        print(f"Queued {len(images)} image(s) in {args.queue}")
+
+    elif args.command == 'work':
+        if args.processes > 1:
+            workers = [multiprocessing.Process(target=run_worker,
+                                               args=(args.queue, f"{default_worker_id()}-{i}", args.metrics))
+                       for i in range(args.processes)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        else:
+            print(f"Processed {run_worker(args.queue, metrics=args.metrics)} image(s)")
+
+    elif args.command == 'status':
+        counts = queue.status()
+        print(", ".join(f"{counts[key]} {key}" for key in ('total', 'done', 'failed', 'claimed', 'pending')))
+
+    else:
+        exported, missing = queue.merge(args.output)
+        print(f"Exported {exported} image(s) to {args.output}")
+        for path in missing:
+            print(f"    no result: {path}")
+        sys.exit(1 if missing else 0)